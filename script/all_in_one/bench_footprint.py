@@ -0,0 +1,116 @@
+'''
+对比"每设备一个进程"（即多容器方案中每个容器运行的解释器）与单进程方案的
+常驻内存（RSS）和冷启动时间（从启动到所有端口可连接）
+仅支持 Linux（读取 /proc/<pid>/status）
+用法：
+    python bench_footprint.py --rounds 5
+    python bench_footprint.py --with-robot --mqtt-host localhost   # 需要可用的 MQTT Broker
+'''
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 设备脚本与基准测试使用的端口（避开特权端口）
+SCRIPTS = {
+    "grinder": os.path.join(SCRIPT_DIR, "grinder", "grinder_sim.py"),
+    "coffee": os.path.join(SCRIPT_DIR, "coffeemachine", "coffeemachine_sim.py"),
+    "ice": os.path.join(SCRIPT_DIR, "ice_maker", "icemaker_sim.py"),
+    "robot": os.path.join(SCRIPT_DIR, "delivery_robots", "deliveryrobots_sim.py"),
+}
+PORTS = {"grinder": 15020, "coffee": 18888, "ice": 11020}
+ALL_IN_ONE = os.path.join(SCRIPT_DIR, "all_in_one", "smartshop_sim.py")
+
+
+def rss_kb(pid):
+    """读取进程常驻内存（KB）"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def wait_ports(ports, timeout=30):
+    """等待所有端口可连接，返回是否成功"""
+    deadline = time.monotonic() + timeout
+    pending = set(ports)
+    while pending and time.monotonic() < deadline:
+        for port in list(pending):
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                    pending.discard(port)
+            except OSError:
+                pass
+        if pending:
+            time.sleep(0.005)
+    return not pending
+
+
+def bench_env(args):
+    env = dict(os.environ)
+    env.update({
+        "GRINDER_PORT": str(PORTS["grinder"]),
+        "COFFEE_PORT": str(PORTS["coffee"]),
+        "ICE_PORT": str(PORTS["ice"]),
+        "MQTT_HOST": args.mqtt_host,
+        "MQTT_PORT": str(args.mqtt_port),
+        "SIM_LOG_LEVEL": "WARNING",
+    })
+    return env
+
+
+def run_once(commands, devices, args):
+    """启动一组进程，返回 (冷启动秒数, RSS 总和 KB)"""
+    start = time.perf_counter()
+    procs = [subprocess.Popen(cmd, env=bench_env(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+             for cmd in commands]
+    try:
+        ports = [PORTS[d] for d in devices if d in PORTS]
+        if not wait_ports(ports):
+            raise RuntimeError("设备端口未在超时时间内就绪")
+        elapsed = time.perf_counter() - start
+        # 等待后台线程与机器人连接稳定后再采样内存
+        time.sleep(args.settle)
+        total = sum(rss_kb(p.pid) for p in procs)
+        return elapsed, total
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单进程与多进程模拟器的内存/冷启动对比")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--settle", type=float, default=1.0, help="就绪后等待多少秒再采样内存")
+    parser.add_argument("--with-robot", action="store_true", help="同时启动送餐机器人（需要 MQTT Broker）")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    args = parser.parse_args()
+
+    devices = ["grinder", "coffee", "ice"] + (["robot"] if args.with_robot else [])
+    multi = [[sys.executable, SCRIPTS[d]] for d in devices]
+    single = [[sys.executable, ALL_IN_ONE, "all"] + ([] if args.with_robot else ["--no-robot"])]
+
+    results = {}
+    for label, commands in (("multi-process", multi), ("single-process", single)):
+        samples = [run_once(commands, devices, args) for _ in range(args.rounds)]
+        results[label] = (
+            statistics.median(s[0] for s in samples),
+            statistics.median(s[1] for s in samples),
+        )
+
+    print(f"devices: {', '.join(devices)}  rounds: {args.rounds}")
+    print(f"{'mode':<16}{'cold start (ms)':>18}{'RSS total (MB)':>18}")
+    for label, (elapsed, rss) in results.items():
+        print(f"{label:<16}{elapsed * 1000:>18.0f}{rss / 1024:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
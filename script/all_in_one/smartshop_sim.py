@@ -0,0 +1,112 @@
+'''
+单进程"全部设备"模拟器入口
+- 在同一个 Python 解释器中托管磨粉机、咖啡机、制冰机、送餐机器人
+- 共享一份配置（命令行参数 > 环境变量 > 默认值），可按设备启停并指定端口
+- 只导入启用的设备模块，未启用的设备不占用内存
+用法：
+    smartshop-sim all                       # 启动全部设备
+    smartshop-sim all --no-robot            # 不启动送餐机器人（无需 MQTT Broker）
+    smartshop-sim grinder --grinder-port 5020
+    smartshop-sim all --embedded-broker     # 在本进程内启动 MQTT Broker，无需 Mosquitto
+    SHOP_ID=2 smartshop-sim all             # 门店 2 的一组设备，端口与话题按门店偏移，见 common/shop.py
+    SIM_HEALTH_PORT=9100 smartshop-sim all  # 全部设备就绪后 9100 端口返回 200，见 common/ready.py
+'''
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+
+# 共享模块与各设备目录位于 script/（容器内位于 /app）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+from common.mqtt_broker import MQTTBroker
+from common import ready
+from common.shop import SHOP_ID, shop_port
+
+logger = get_logger("smartshop_sim")
+
+# 设备名 -> (模块路径, 启动函数)，启动函数接收模块与解析后的参数，阻塞运行设备主循环
+DEVICES = {
+    "grinder": ("grinder.grinder_sim", lambda m, a: m.run(port=a.grinder_port, transport=a.grinder_transport)),
+    "coffee": ("coffeemachine.coffeemachine_sim", lambda m, a: m.run_server(port=a.coffee_port)),
+    "ice": ("ice_maker.icemaker_sim", lambda m, a: m.run(port=a.ice_port)),
+    "robot": ("delivery_robots.deliveryrobots_sim", lambda m, a: m.run(host=a.mqtt_host, port=a.mqtt_port)),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="smartshop-sim", description="在单个进程中运行智能咖啡店设备模拟器")
+    parser.add_argument("target", choices=["all"] + list(DEVICES), help="all 启动全部设备，或指定单个设备")
+    for name in DEVICES:
+        parser.add_argument(f"--no-{name}", dest=f"no_{name}", action="store_true", help=f"不启动 {name}")
+    parser.add_argument("--grinder-port", type=int, default=shop_port("GRINDER_PORT", 502))
+    parser.add_argument("--grinder-transport", choices=["threaded", "asyncio"],
+                        default=os.getenv("GRINDER_TRANSPORT", "threaded"), help="磨粉机 Modbus 服务实现")
+    parser.add_argument("--coffee-port", type=int, default=shop_port("COFFEE_PORT", 8888))
+    parser.add_argument("--ice-port", type=int, default=shop_port("ICE_PORT", 102))
+    parser.add_argument("--mqtt-host", default=os.getenv("MQTT_HOST", "localhost"))
+    parser.add_argument("--mqtt-port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    parser.add_argument("--embedded-broker", action="store_true",
+                        help="在本进程内监听 --mqtt-port 启动 MQTT Broker，机器人连接到本机")
+    return parser
+
+
+def enabled_devices(args):
+    """根据 target 与 --no-<device> 计算需要启动的设备列表"""
+    names = list(DEVICES) if args.target == "all" else [args.target]
+    return [name for name in names if not getattr(args, f"no_{name}")]
+
+
+def start_device(name, args):
+    """导入设备模块并在守护线程中运行其主循环"""
+    module_path, runner = DEVICES[name]
+    module = importlib.import_module(module_path)
+
+    def target():
+        try:
+            runner(module, args)
+        except Exception as e:
+            logger.error("设备 %s 运行时发生错误：%s", name, e)
+        logger.warning("设备 %s 已退出", name)
+
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    names = enabled_devices(args)
+    if not names:
+        logger.error("没有需要启动的设备")
+        return 1
+
+    start = time.perf_counter()
+    if args.embedded_broker:
+        MQTTBroker("0.0.0.0", args.mqtt_port).start()
+        args.mqtt_host = "127.0.0.1"
+    # 先登记全部设备，健康端口在所有设备就绪前一直返回 503
+    for name in names:
+        ready.starting(name)
+    threads = {name: start_device(name, args) for name in names}
+    # 各设备在服务监听、状态初始化完成后报告就绪
+    if ready.wait_local(names, timeout=30):
+        logger.info("门店 %d 单进程中的设备 %s 已全部就绪，用时 %.0f ms", SHOP_ID, ", ".join(names),
+                    (time.perf_counter() - start) * 1000)
+    else:
+        done, _ = ready.snapshot()
+        logger.warning("30 s 内未就绪的设备: %s", ", ".join(n for n in names if n not in done))
+
+    try:
+        # 所有设备都退出后主进程结束
+        while any(thread.is_alive() for thread in threads.values()):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("模拟器已被手动停止")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+'''
+咖啡店离线容量仿真（离散事件，不启动任何模拟器或网络服务）
+- 设备模型直接取自各模拟器：磨粉/补豆时间与豆量消耗、每种咖啡的制作时间与原料配方、
+  制冰/出冰时间与库存、机器人各配送阶段时间；SIM_PROFILE 中的服务时间配置同样生效
+- 订单流程与 Go 流水线 Core 一致：轮询器每 0.5 s 取最多 50 单，每台设备同一时刻只服务一个订单，
+  磨粉（豆量不足先补豆）→ 制作（原料不足先 REFILL:ALL，0.5 s 后重试）→ 需要冰时制冰至 200 克再出冰 100 克 → 配送
+- 机器人串行执行配送指令，Core 在收到 RECEIVED 确认或 3 s 超时后即释放机器人并记为完成，
+  因此同时统计"完成"（写回数据库的时间）与"送达"（到达桌边的时间）
+- 不模拟瞬时故障、丢包与设备轮询间隔
+- 一个工作日的订单在数秒内仿真完成，可一次比较多种设备配置
+用法：
+    python shop_des.py --orders-per-hour 300 --hours 10
+    python shop_des.py --config 1,1,1,1 --config 1,2,1,2 --json capacity.json
+    python shop_des.py --mix LATTE=3,AMERICANO=2,MOCHA=1 --ice 0.4 --seed 7 --csv capacity.csv
+'''
+import argparse
+import csv
+import heapq
+import json
+import math
+import os
+import sys
+from collections import namedtuple
+
+# 离线仿真不读写模拟器的持久化状态
+os.environ.pop("SIM_STATE_DIR", None)
+
+# 共享模块与各模拟器位于 script/ 下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.sim_profile import DeviceProfile, PROFILE_FILE, SEED
+from common.stats import percentile
+from grinder import grinder_sim
+from coffeemachine import coffeemachine_sim
+from ice_maker import icemaker_sim
+from delivery_robots import deliveryrobots_sim
+
+# 与 Go 流水线（smart_gateway/cmd/pipeline_demo）的默认参数一致
+POLL_INTERVAL = 0.5     # 订单轮询间隔（秒）
+POLL_BATCH = 50         # 每次轮询最多取出的订单数
+ICE_MIN_STOCK = 200     # 出冰前要求的最低库存（克）
+ICE_DISPENSE = 100      # 每单出冰量（克）
+REFILL_RETRY_DELAY = 0.5    # 补料后重新下发 MAKE 的间隔（秒）
+DELIVER_ACK_TIMEOUT = 3     # 等待机器人 RECEIVED 的超时（秒）
+
+DEVICES = ("grinder", "coffee", "ice", "robot")
+
+Config = namedtuple("Config", DEVICES)
+
+
+class Event:
+    """仿真事件：触发后依次调用回调，value 为触发值"""
+    def __init__(self, engine):
+        self.engine = engine
+        self.callbacks = []
+        self.triggered = False
+        self.value = None
+
+    def succeed(self, value=None):
+        self.triggered = True
+        self.value = value
+        for callback in self.callbacks:
+            self.engine.schedule(0, callback, self)
+        self.callbacks = None
+
+
+class Engine:
+    """基于小顶堆的事件调度器，进程为 yield Event 的生成器"""
+    def __init__(self):
+        self.now = 0.0
+        self.queue = []
+        self.seq = 0
+
+    def schedule(self, delay, callback, arg=None):
+        self.seq += 1
+        heapq.heappush(self.queue, (self.now + delay, self.seq, callback, arg))
+
+    def timeout(self, delay):
+        event = Event(self)
+        self.schedule(delay, lambda _: event.succeed())
+        return event
+
+    def process(self, generator):
+        """启动一个进程，返回进程结束时触发的事件"""
+        done = Event(self)
+
+        def resume(event):
+            try:
+                target = generator.send(event.value if event is not None else None)
+            except StopIteration as stop:
+                done.succeed(stop.value)
+                return
+            if target.triggered:
+                self.schedule(0, resume, target)
+            else:
+                target.callbacks.append(resume)
+
+        self.schedule(0, resume)
+        return done
+
+    def run(self, until=math.inf):
+        while self.queue and self.queue[0][0] <= until:
+            self.now, _, callback, arg = heapq.heappop(self.queue)
+            callback(arg)
+
+
+class Pool:
+    """
+    同类设备池，对应 Core 中的信号量：每台设备同一时刻只服务一个订单，等待者按先来先服务
+    request() 返回的事件值为分配到的设备，用完后调用 release(unit)
+    """
+    def __init__(self, engine, units):
+        self.engine = engine
+        self.free = list(units)
+        self.units = list(units)
+        self.waiting = []
+        self.wait_times = []
+
+    def request(self):
+        event = Event(self.engine)
+        event.requested_at = self.engine.now
+        if self.free:
+            self.grant(event, self.free.pop(0))
+        else:
+            self.waiting.append(event)
+        return event
+
+    def grant(self, event, unit):
+        self.wait_times.append(self.engine.now - event.requested_at)
+        unit.acquired_at = self.engine.now
+        event.succeed(unit)
+
+    def release(self, unit, busy=None):
+        """busy 为本次占用设备的实际工作时长，默认为持有时间"""
+        unit.busy += self.engine.now - unit.acquired_at if busy is None else busy
+        if self.waiting:
+            self.grant(self.waiting.pop(0), unit)
+        else:
+            self.free.append(unit)
+
+
+class Unit:
+    """单台设备：时间模型与运行中的库存"""
+    def __init__(self, kind, index, spec, seed):
+        self.profile = DeviceProfile(f"{kind}#{index}", spec, seed)
+        self.busy = 0.0
+        self.acquired_at = 0.0
+        self.bean_level = grinder_sim.FULL_BEAN_LEVEL
+        self.inventory = {i: coffeemachine_sim.MAX_STORAGE for i in coffeemachine_sim.INGREDIENTS}
+        self.ice_stock = icemaker_sim.INITIAL_STOCK
+        self.free_at = 0.0      # 机器人：本地指令队列清空的时间
+        self.restocks = 0
+
+
+class Shop:
+    """
+    一种设备配置下的门店
+    输入：config (Config) - 各类设备数量
+         profile (dict) - SIM_PROFILE 格式的配置，按设备名取服务时间
+         seed - 随机种子
+    """
+    def __init__(self, config, profile, seed):
+        self.config = config
+        self.engine = Engine()
+        self.pools = {
+            kind: Pool(self.engine, [Unit(kind, i, profile.get(kind), seed) for i in range(count)])
+            for kind, count in zip(DEVICES, config)
+        }
+        self.arrivals = DeviceProfile("orders", None, seed)
+        self.pending = []       # 已下单、尚未被轮询器取出的订单
+        self.results = []       # (下单时间, 完成时间, 送达时间, 是否超时)
+
+    def grind(self):
+        pool = self.pools["grinder"]
+        unit = yield pool.request()
+        if unit.bean_level < grinder_sim.MIN_BEAN_LEVEL:
+            yield self.engine.timeout(unit.profile.service_time("add_bean", grinder_sim.ADD_BEAN_TIME))
+            unit.bean_level = grinder_sim.FULL_BEAN_LEVEL
+            unit.restocks += 1
+        unit.bean_level -= unit.profile.stream("bean_use").randint(*grinder_sim.BEAN_USE)
+        yield self.engine.timeout(unit.profile.service_time("grind", grinder_sim.GRIND_TIME))
+        pool.release(unit)
+
+    def brew(self, coffee_type):
+        pool = self.pools["coffee"]
+        unit = yield pool.request()
+        recipe = coffeemachine_sim.recipes[coffee_type]
+        if any(unit.inventory[i] < amount for i, amount in recipe.items()):
+            yield self.engine.timeout(unit.profile.service_time("refill_all", coffeemachine_sim.REFILL_ALL_TIME)
+                                      + REFILL_RETRY_DELAY)
+            unit.inventory = dict.fromkeys(unit.inventory, coffeemachine_sim.MAX_STORAGE)
+            unit.restocks += 1
+        for ingredient, amount in recipe.items():
+            unit.inventory[ingredient] -= amount
+        yield self.engine.timeout(unit.profile.service_time(f"make:{coffee_type}",
+                                                            coffeemachine_sim.brew_times[coffee_type]))
+        pool.release(unit)
+
+    def ice(self):
+        pool = self.pools["ice"]
+        unit = yield pool.request()
+        while unit.ice_stock < ICE_MIN_STOCK:
+            yield self.engine.timeout(unit.profile.service_time("make_ice", icemaker_sim.MAKE_ICE_TIME))
+            unit.ice_stock = min(unit.ice_stock + icemaker_sim.ICE_BATCH, icemaker_sim.ICE_CAPACITY)
+            unit.restocks += 1
+        yield self.engine.timeout(unit.profile.service_time("dispense", icemaker_sim.DISPENSE_TIME))
+        unit.ice_stock = max(unit.ice_stock - ICE_DISPENSE, 0)
+        pool.release(unit)
+
+    def deliver(self):
+        """返回 (送达时间, 是否确认超时)；机器人忙于前一单时，确认要等到它开始本单"""
+        pool = self.pools["robot"]
+        unit = yield pool.request()
+        now = self.engine.now
+        start = max(now, unit.free_at)
+        legs = deliveryrobots_sim.LEG_TIMES
+        served = start + unit.profile.service_time("to_pickup", legs["to_pickup"]) \
+            + unit.profile.service_time("to_table", legs["to_table"])
+        unit.free_at = served + unit.profile.service_time("return", legs["return"])
+        timed_out = start - now > DELIVER_ACK_TIMEOUT
+        yield self.engine.timeout(DELIVER_ACK_TIMEOUT if timed_out else start - now)
+        # 利用率按机器人实际行驶时间统计，而不是 Core 持有信号量的时间
+        pool.release(unit, busy=unit.free_at - start)
+        return served, timed_out
+
+    def order(self, created, coffee_type, need_ice):
+        yield self.engine.process(self.grind())
+        yield self.engine.process(self.brew(coffee_type))
+        if need_ice:
+            yield self.engine.process(self.ice())
+        served, timed_out = yield self.engine.process(self.deliver())
+        self.results.append((created, self.engine.now, served, timed_out))
+
+    def customers(self, hours, per_hour, mix, ice_ratio):
+        rng = self.arrivals.stream("arrivals")
+        drinks, weights = zip(*mix.items())
+        end = hours * 3600
+        while True:
+            yield self.engine.timeout(rng.expovariate(per_hour / 3600))
+            if self.engine.now >= end:
+                return
+            coffee_type = rng.choices(drinks, weights)[0]
+            self.pending.append((self.engine.now, coffee_type, rng.random() < ice_ratio))
+
+    def poller(self, customers):
+        while not (customers.triggered and not self.pending):
+            yield self.engine.timeout(POLL_INTERVAL)
+            batch, self.pending = self.pending[:POLL_BATCH], self.pending[POLL_BATCH:]
+            for created, coffee_type, need_ice in batch:
+                self.engine.process(self.order(created, coffee_type, need_ice))
+
+    def run(self, hours, per_hour, mix, ice_ratio):
+        customers = self.engine.process(self.customers(hours, per_hour, mix, ice_ratio))
+        self.engine.process(self.poller(customers))
+        self.engine.run()
+        return report_shop(self, hours)
+
+
+def summarize(values):
+    return {"mean": sum(values) / len(values) if values else None,
+            "p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values, default=None)}
+
+
+def report_shop(shop, hours):
+    horizon = max(shop.engine.now, hours * 3600)
+    latency = [done - created for created, done, _, _ in shop.results]
+    served = [at - created for created, _, at, _ in shop.results]
+    report = {
+        "config": dict(shop.config._asdict()),
+        "orders": len(shop.results),
+        "throughput_per_hour": len(shop.results) / horizon * 3600,
+        "makespan_s": shop.engine.now,
+        "latency_s": summarize(latency),
+        "served_s": summarize(served),
+        "ack_timeouts": sum(1 for *_, timed_out in shop.results if timed_out),
+        "devices": {},
+    }
+    for kind, pool in shop.pools.items():
+        busy = [unit.busy / horizon for unit in pool.units]
+        report["devices"][kind] = {
+            "count": len(pool.units),
+            "utilization": sum(busy) / len(busy),
+            "wait_s": summarize(pool.wait_times),
+            "restocks": sum(unit.restocks for unit in pool.units),
+        }
+    return report
+
+
+def parse_config(text):
+    counts = [int(n) for n in text.split(",")]
+    if len(counts) != len(DEVICES) or min(counts) < 1:
+        raise argparse.ArgumentTypeError(f"设备配置应为 {len(DEVICES)} 个正整数，例如 1,2,1,1")
+    return Config(*counts)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        coffee_type, _, weight = item.partition("=")
+        coffee_type = coffee_type.strip().upper()
+        if coffee_type not in coffeemachine_sim.recipes:
+            raise argparse.ArgumentTypeError(f"未知咖啡类型: {coffee_type}")
+        mix[coffee_type] = float(weight or 1)
+    return mix
+
+
+def print_report(report):
+    def fmt(v):
+        return "   n/a" if v is None else f"{v:8.1f}"
+    config = report["config"]
+    print(f"配置 磨豆机 {config['grinder']} / 咖啡机 {config['coffee']} / 制冰机 {config['ice']} / 机器人 {config['robot']}：")
+    print(f"  完成 {report['orders']} 单，吞吐 {report['throughput_per_hour']:.1f} 单/小时，"
+          f"最后一单完成于 {report['makespan_s'] / 3600:.2f} h，确认超时 {report['ack_timeouts']} 单")
+    print(f"  {'':<10}{'均值 (s)':>10}{'P50 (s)':>10}{'P95 (s)':>10}{'最大 (s)':>10}")
+    for label, key in (("完成时延", "latency_s"), ("送达时延", "served_s")):
+        s = report[key]
+        print(f"  {label:<8}{fmt(s['mean']):>10}{fmt(s['p50']):>10}{fmt(s['p95']):>10}{fmt(s['max']):>10}")
+    print(f"  {'设备':<8}{'利用率':>8}{'平均排队 (s)':>14}{'P95 排队 (s)':>14}{'补料次数':>10}")
+    for kind, d in report["devices"].items():
+        print(f"  {kind:<10}{d['utilization']:>9.1%}{fmt(d['wait_s']['mean']):>14}"
+              f"{fmt(d['wait_s']['p95']):>14}{d['restocks']:>12}")
+
+
+def write_csv(reports, path):
+    header = ["grinder", "coffee", "ice", "robot", "orders", "throughput_per_hour", "makespan_s",
+              "latency_p50_s", "latency_p95_s", "served_p50_s", "served_p95_s", "ack_timeouts"]
+    header += [f"{kind}_{m}" for kind in DEVICES for m in ("utilization", "wait_mean_s", "wait_p95_s")]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for r in reports:
+            row = [r["config"][kind] for kind in DEVICES]
+            row += [r["orders"], round(r["throughput_per_hour"], 2), round(r["makespan_s"], 1),
+                    r["latency_s"]["p50"], r["latency_s"]["p95"], r["served_s"]["p50"], r["served_s"]["p95"],
+                    r["ack_timeouts"]]
+            for kind in DEVICES:
+                d = r["devices"][kind]
+                row += [round(d["utilization"], 4), d["wait_s"]["mean"], d["wait_s"]["p95"]]
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="咖啡店离线容量仿真")
+    parser.add_argument("--config", type=parse_config, action="append",
+                        help="磨豆机,咖啡机,制冰机,机器人 的数量，可重复以比较多种配置，默认 1,1,1,1")
+    parser.add_argument("--orders-per-hour", type=float, default=300, help="平均下单速率（泊松到达）")
+    parser.add_argument("--hours", type=float, default=10, help="营业时长（小时），之后不再下单")
+    parser.add_argument("--mix", type=parse_mix, default=dict.fromkeys(coffeemachine_sim.recipes, 1.0),
+                        help="咖啡类型权重，例如 LATTE=3,AMERICANO=2，默认各类型等概率")
+    parser.add_argument("--ice", type=float, default=0.3, help="需要加冰的订单比例")
+    parser.add_argument("--profile", default=PROFILE_FILE, help="SIM_PROFILE 格式的服务时间配置文件")
+    parser.add_argument("--seed", default=None, help="随机种子，默认取 SIM_SEED、配置文件中的 seed 或 0")
+    parser.add_argument("--json", help="把全部结果写入 JSON 文件")
+    parser.add_argument("--csv", help="把全部结果写入 CSV 文件（每种配置一行）")
+    args = parser.parse_args()
+
+    profile = {}
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as f:
+            profile = json.load(f)
+    seed = args.seed or SEED or profile.get("seed", 0)
+
+    reports = []
+    for config in args.config or [Config(1, 1, 1, 1)]:
+        shop = Shop(config, profile, seed)
+        report = shop.run(args.hours, args.orders_per_hour, args.mix, args.ice)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    if args.csv:
+        write_csv(reports, args.csv)
+
+
+if __name__ == "__main__":
+    main()
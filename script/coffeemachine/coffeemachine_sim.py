@@ -5,37 +5,44 @@ Used to simulate the coffee machine, using custom TCP messages
 '''
 
 
+import os
+import sys
 import socket
 import logging
 import time
-import random
-from colorlog import ColoredFormatter
 import threading
 
-
-logger = logging.getLogger("coffeemachine_sim")
-logger.setLevel(logging.DEBUG)
-# 用于输出，后续可以扩展至网络传输
-handler = logging.StreamHandler()
-# 设置格式
-formatter = ColoredFormatter(
-    "%(log_color)s%(asctime)s %(levelname)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red,bg_white',
-    },
-)
-handler.setFormatter(formatter)
-if not logger.handlers:
-    logger.addHandler(handler)
-
-# -------------------- 1. 端口设置
+import numpy as np
+
+# 共享模块位于 script/common（容器内与脚本位于同一目录）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger, request_gate
+from common import record
+from common.sim_profile import load_profile
+from common.state import load_state
+from common import ready
+from common.trace import get_tracer, parse_trace_id
+from common.profiling import get_profiler
+from common.shop import shop_port
+
+
+# 日志经队列交给后台线程格式化输出
+logger = get_logger("coffeemachine_sim")
+# 每条指令都会触发的日志经过采样/限流闸门
+request_log = request_gate(logger)
+brew_log = request_gate(logger, logging.INFO)
+# 设置了 SIM_RECORD_FILE 时录制所有收到的报文
+recorder = record.get_recorder()
+# 设置了 SIM_TRACE_FILE 时记录带订单号指令的制作/补料区间
+tracer = get_tracer()
+# SIGUSR1 / SIM_PROF 开启性能剖析时记录每次处理的耗时，见 common/profiling.py
+profiler = get_profiler()
+# 服务时间、连接延迟与故障注入配置，见 SIM_PROFILE / SIM_SEED
+profile = load_profile("coffee")
+
+# -------------------- 1. 端口设置，未设置 COFFEE_PORT 时按 SHOP_ID 偏移（见 common/shop.py）
 HOST = '0.0.0.0'
-PORT = 8888
+PORT = shop_port("COFFEE_PORT", 8888)
 
 # -------------------- 2. 库存与食谱设置
 MAX_STORAGE = 20 # 最大库存为50
@@ -46,6 +53,12 @@ inventory = {
     "CHOCOLATE_SAUCE": MAX_STORAGE,
     "CARAMEL_SYRUP": MAX_STORAGE,
 }
+# 库存保存在内存映射文件中，设置 SIM_STATE_DIR 后重启从上次的库存继续
+state = load_state("coffee", inventory)
+inventory.update(state.as_dict())
+# 补料在后台进行，只锁定被补充的原料：refilling 为正在补充的原料，库存读写与等待都在 inventory_cond 下进行
+inventory_cond = threading.Condition()
+refilling = set()
 
 
 # 食谱记录所有种类咖啡所需要消耗的原材料
@@ -63,46 +76,157 @@ recipes = {
 }
 VALID_COFFEES = list(recipes.keys())
 
+# 每种咖啡的制作时间模型（秒），分布写法见 common/sim_profile.py
+# 可在 SIM_PROFILE 中用 "make:<咖啡类型>" 覆盖单个咖啡，或用 "make" 覆盖全部
+brew_times = {
+    "LATTE": {"dist": "randint", "low": 7, "high": 9},
+    "FLAT WHITE": {"dist": "randint", "low": 7, "high": 9},
+    "CAPPUCCINO": {"dist": "randint", "low": 7, "high": 9},
+    "MACCHIATO": {"dist": "randint", "low": 6, "high": 8},
+    "OAT LATTE": {"dist": "randint", "low": 7, "high": 9},
+    "MOCHA": {"dist": "randint", "low": 8, "high": 10},
+    "MATCHA LATTE": {"dist": "randint", "low": 8, "high": 10},
+    "ESPRESSO": {"dist": "randint", "low": 5, "high": 6},
+    "AMERICANO": {"dist": "randint", "low": 5, "high": 7},
+    "LONG BLACK": {"dist": "randint", "low": 5, "high": 7},
+}
+REFILL_ALL_TIME = 7     # 补充全部原料时间（秒）
+REFILL_TIME = 3         # 补充单种原料时间（秒）
+
+# 食谱矩阵：行为咖啡（VALID_COFFEES 顺序），列为原料（inventory 顺序），值为每杯消耗量
+INGREDIENTS = list(inventory.keys())
+RECIPE_MATRIX = np.array([[recipes[c].get(i, 0) for i in INGREDIENTS] for c in VALID_COFFEES], dtype=np.int64)
+COFFEE_INDEX = {c: k for k, c in enumerate(VALID_COFFEES)}
+
+
+def inventory_vector():
+    """当前库存的数组表示，顺序与 INGREDIENTS 一致；在 inventory_cond 下取快照，不会读到制作或补料写到一半的库存"""
+    with inventory_cond:
+        return np.array([inventory[i] for i in INGREDIENTS], dtype=np.int64)
+
+
+def plan_capacity(mix=None):
+    """
+    一次矩阵运算回答容量规划问题
+    输入：mix (dict) - 订单组合 {咖啡类型: 杯数}，None 表示只查询
+    输出：(max_servings, shortage)
+         max_servings (ndarray) - 按当前库存每种咖啡最多还能做的杯数，不消耗原料的咖啡为 -1（不限）
+         shortage (ndarray) - 完成订单组合后各原料的缺口（>0 表示不足），未给出 mix 时全为 0
+    """
+    stock = inventory_vector()
+    # 每种咖啡的上限 = 各原料 库存 // 单杯用量 的最小值，用量为 0 的原料不构成约束
+    per_ingredient = np.where(RECIPE_MATRIX > 0, stock // np.maximum(RECIPE_MATRIX, 1), np.iinfo(np.int64).max)
+    max_servings = per_ingredient.min(axis=1)
+    max_servings[~RECIPE_MATRIX.any(axis=1)] = -1
+
+    counts = np.zeros(len(VALID_COFFEES), dtype=np.int64)
+    for coffee_type, n in (mix or {}).items():
+        counts[COFFEE_INDEX[coffee_type]] += n
+    shortage = np.maximum(counts @ RECIPE_MATRIX - stock, 0)
+    return max_servings, shortage
+
+
+def parse_plan_mix(payload):
+    """解析 "LATTE=2,MOCHA=1" 形式的订单组合，格式错误抛出 ValueError，未知咖啡抛出 KeyError"""
+    mix = {}
+    for item in payload.split(","):
+        coffee_type, sep, count = item.partition("=")
+        coffee_type = coffee_type.strip()
+        if not sep or not count.strip().isdigit():
+            raise ValueError(item)
+        if coffee_type not in COFFEE_INDEX:
+            raise KeyError(coffee_type)
+        mix[coffee_type] = mix.get(coffee_type, 0) + int(count)
+    return mix
+
 
 def check_and_custom_ingredients(coffee_type):
     """
-    检查咖啡的原料是否充足，如果充足则消耗，不充足则返回False和缺少的原材料列表
+    检查咖啡的原料是否充足，如果充足则消耗，不充足则返回缺少的原材料列表
+    配方用到的原料正在补充时先等待补充完成；不用这些原料的咖啡不受影响
     """
     recipe = recipes.get(coffee_type)
 
     required_ingredients = [] # 缺少的原材料列表
-    # 首先检查所有原料是否充足
-    for ingredient, amount in recipe.items():
-        if inventory[ingredient] < amount:
-            logger.error(f"原料 {ingredient} 不足，需要 {amount} 单位，当前库存 {inventory[ingredient]} 单位")
-            required_ingredients.append(ingredient)
-        
-        # 如果有缺少的原料，返回False和缺少的原料列表
+    with inventory_cond:
+        inventory_cond.wait_for(lambda: refilling.isdisjoint(recipe))
+        # 首先检查所有原料是否充足
+        for ingredient, amount in recipe.items():
+            if inventory[ingredient] < amount:
+                logger.error(f"原料 {ingredient} 不足，需要 {amount} 单位，当前库存 {inventory[ingredient]} 单位")
+                required_ingredients.append(ingredient)
+
+        # 如果有缺少的原料，返回缺少的原料列表
         if required_ingredients:
             return required_ingredients
 
         # 如果所有原料都充足，则消耗原料
         for ingredient, amount in recipe.items():
             inventory[ingredient] -= amount
+        state.update(inventory)
+
+    return []
+
 
-        return []
+def refill_in_background(name, ingredients, op, default_time, reply, trace_id):
+    """
+    后台补料：等待同一原料上进行中的补料结束后锁定 ingredients，补料时间过后补满并解锁，
+    再通过 reply 在原连接上报告完成（连接已关闭时忽略）
+    输入：name (str) - 指令中的原料名（ALL 或单个原料），用于应答
+         op, default_time - 补料时间在 SIM_PROFILE 中的操作名与默认值
+    """
+    with inventory_cond:
+        inventory_cond.wait_for(lambda: refilling.isdisjoint(ingredients))
+        refilling.update(ingredients)
+    refill_start = time.time()
+    try:
+        time.sleep(profile.service_time(op, default_time))
+    finally:
+        with inventory_cond:
+            for ingredient in ingredients:
+                inventory[ingredient] = MAX_STORAGE
+            state.update(inventory)
+            refilling.difference_update(ingredients)
+            inventory_cond.notify_all()
+    logger.info("所有原料已被补充" if name == "ALL" else f"{name} 已被补充")
+    if tracer:
+        tracer.span(trace_id, "coffee", "refill", refill_start, ingredient=name)
+    try:
+        reply(b"ACK:REFILL_SUCCESS:" + name.encode('utf-8') + b"\n")
+    except OSError:
+        logger.warning("补料 %s 完成时连接已关闭", name)
 
 
 
 # ------------------------------
 # 自定义报文操作逻辑
 # 编码格式： utf-8
+# 每条指令以换行符结尾，一次可发送多条，同一条指令也可能分多次到达
 # ｜ 指令类型            ｜ 成功返回值                     ｜ 失败返回值 
-# ｜ MAKE:COFFEE_TYPE   | DONE:SUCCESS                  | ERROR:INSUFFICIENT_INGREDIENT  ERROR:UNKNOWN_COFFEE_TYPE
+# ｜ MAKE:COFFEE_TYPE   | DONE:SUCCESS                  | ERROR:INSUFFICIENT_INGREDIENT  ERROR:UNKNOWN_COFFEE_TYPE  ERROR:MACHINE_FAULT
 # ｜ REFILL:INGREDIENT  | ACK:REFILL_SUCCESS:INGREDIENT | ERROR:UNKNOWN_INGREDIENT
 # ｜ REFILL:ALL         | ACK:REFILL_SUCCESS:ALL        | N/A
+# ｜ REFILL 在后台执行，只锁定被补充的原料：同一连接上随后的指令照常处理，完成应答在补料结束时异步发送，
+# ｜   可能晚于之后指令的应答；配方用到正在补充的原料的 MAKE 会等待补料完成
+# ｜ MAKE/REFILL 可在末尾附加 :<订单号>，例如 MAKE:LATTE:1024，用于按订单关联各设备的时间线 | 订单号格式错误时 ERROR:INVALID_TRACE_ID
 # ｜ STATUS:INGREDIENTS | ACK:STATUS:INVENTORY:MILK=50  | N/A
+# ｜ PLAN 或 PLAN:MAX    | PLAN:MAX:LATTE=6,...,ESPRESSO=-1（-1 表示不限） | N/A
+# ｜ PLAN:LATTE=2,MOCHA=1 | PLAN:FEASIBLE                | PLAN:INFEASIBLE:MILK=3（各原料缺口）  ERROR:UNKNOWN_COFFEE_TYPE  ERROR:INVALID_PLAN
 # ------------------------------
 def handle_client(conn, addr):
     """
     处理客户端连接，接收客户端发送的咖啡类型，检查原料是否充足，充足则制作咖啡，不充足则返回错误信息
     """
     logger.info(f"接收到来自 {addr} 的连接请求")
+    # 后台补料线程也会在本连接上应答，发送需要加锁，避免两条应答交错
+    send_lock = threading.Lock()
+
+    def reply(data):
+        with send_lock:
+            conn.sendall(data)
+
+    # 一条指令可能被拆到多个 TCP 分段中，未收到换行的部分留到下次接收后再处理
+    pending = b""
     with conn:  # 确保连接在处理完成后关闭
         while True: # 持续监听客户端请求
             try:
@@ -110,74 +234,149 @@ def handle_client(conn, addr):
                 if not data:
                     logger.warning(f"客户端 {addr} 主动断开连接") # 客户端主动断开连接
                     break
-
-                message = data.decode().strip().upper() # 解码并转换为大写
-                logger.debug(f"客户端 {addr} 发送指令: {message}") # 记录接收到的指令
-                
-                # ----------------- 协议解析
-                parts = message.split(":", 1)
-                command = parts[0]
-                payload = parts[1] if len(parts) > 1 else ""
-
-
-
-
-                if command == "MAKE":
-                    coffee_type = payload
-                    if coffee_type not in VALID_COFFEES:
-                        conn.sendall(b"ERROR:UNKNOWN_COFFEE_TYPE\n")
-                        logger.error(f"未知咖啡类型: {coffee_type}")
+                if recorder:
+                    recorder.write(record.DEVICE_COFFEE, record.OP_TCP_DATA, addr[1], data)
+                *lines, pending = (pending + data).split(b"\n")
+                if not lines:
+                    continue
+
+                delay = profile.connection_delay()
+                if delay:
+                    time.sleep(delay)
+                if profile.drop():
+                    # 注入丢弃：不处理也不回复本条指令
+                    logger.warning("丢弃来自 %s 的指令", addr)
+                    continue
+
+                t0 = time.perf_counter() if profiler.on else 0
+                # 客户端可能不等应答连续发送多条指令（例如补料进行中继续下单），一次收到多行时按行逐条处理
+                for line in lines:
+                    message = line.decode().upper().strip() # 解码并转换为大写
+                    if not message:
                         continue
-                    else:
-                        missing_ingredients = check_and_custom_ingredients(coffee_type)
-                        if not missing_ingredients:
-                            conn.sendall(b"ACK:MAKE\n")
-                            logger.info(f"开始制作 {coffee_type}")
-
-                            # 模拟制作时间
-                            time.sleep(random.randint(5,10))
-
-                            conn.sendall(b"DONE:SUCCESS\n")
-                            logger.info(f"成功制作 {coffee_type}")
+                    if request_log():
+                        logger.debug("客户端 %s 发送指令: %s", addr, message) # 记录接收到的指令
+                
+                    # ----------------- 协议解析
+                    parts = message.split(":", 1)
+                    command = parts[0]
+                    payload = parts[1] if len(parts) > 1 else ""
+
+
+
+
+                    if command in ("MAKE", "REFILL"):
+                        # 可选的订单号后缀
+                        payload, _, trace_text = payload.partition(":")
+                        try:
+                            trace_id = parse_trace_id(trace_text)
+                        except ValueError:
+                            reply(b"ERROR:INVALID_TRACE_ID\n")
+                            logger.error(f"无效的订单号: '{trace_text}'")
+                            continue
+
+                    if command == "MAKE":
+                        coffee_type = payload
+                        if coffee_type not in VALID_COFFEES:
+                            reply(b"ERROR:UNKNOWN_COFFEE_TYPE\n")
+                            logger.error(f"未知咖啡类型: {coffee_type}")
+                            continue
                         else:
-                            error_message = f"ERROR:INSUFFICIENT_INGREDIENT:{', '.join(missing_ingredients)}"
-                            conn.sendall(error_message.encode('utf-8') + b"\n")
-                            logger.error(f"制作 {coffee_type} 失败，缺少原料: {', '.join(missing_ingredients)}")
-
-
+                            missing_ingredients = check_and_custom_ingredients(coffee_type)
+                            if not missing_ingredients:
+                                reply(b"ACK:MAKE\n")
+                                brew_start = time.time()
+                                if brew_log():
+                                    logger.info("开始制作 %s", coffee_type)
+
+                                fault_duration = profile.fault()
+                                if fault_duration:
+                                    # 注入瞬时故障：制作中断，故障持续一段时间后返回错误
+                                    time.sleep(fault_duration)
+                                    reply(b"ERROR:MACHINE_FAULT\n")
+                                    if tracer:
+                                        tracer.span(trace_id, "coffee", "brew", brew_start, coffee_type=coffee_type, result="fault")
+                                    logger.warning("制作 %s 时发生瞬时故障", coffee_type)
+                                    continue
+
+                                # 模拟制作时间
+                                time.sleep(profile.service_time(f"make:{coffee_type}", brew_times[coffee_type]))
+
+                                reply(b"DONE:SUCCESS\n")
+                                if tracer:
+                                    tracer.span(trace_id, "coffee", "brew", brew_start, coffee_type=coffee_type, result="done")
+                                if brew_log():
+                                    logger.info("成功制作 %s", coffee_type)
+                            else:
+                                error_message = f"ERROR:INSUFFICIENT_INGREDIENT:{', '.join(missing_ingredients)}"
+                                reply(error_message.encode('utf-8') + b"\n")
+                                if tracer:
+                                    now = time.time()
+                                    tracer.span(trace_id, "coffee", "brew", now, now, coffee_type=coffee_type,
+                                                result="insufficient")
+                                logger.error(f"制作 {coffee_type} 失败，缺少原料: {', '.join(missing_ingredients)}")
+
+
+
+
+
+                    elif command == "REFILL":
+                        ingredient_to_refill = payload
+
+                        if ingredient_to_refill == "ALL":
+                            refill = (INGREDIENTS, "refill_all", REFILL_ALL_TIME)
+                        elif ingredient_to_refill in inventory:
+                            refill = ([ingredient_to_refill], "refill", REFILL_TIME)
+                        else:
+                            refill = None
+                        if refill:
+                            threading.Thread(target=refill_in_background,
+                                             args=(ingredient_to_refill, *refill, reply, trace_id), daemon=True).start()
+                        else:
+                            reply(b"ERROR:UNKNOWN_INGREDIENT\n")
+                            logger.error(f"未知原料: {ingredient_to_refill}")
 
 
 
-                elif command == "REFILL":
-                    ingredient_to_refill = payload
+                    elif command == "STATUS" and payload == "INGREDIENTS":
+                        with inventory_cond:
+                            status_string = ",".join([f"{ingredient}={amount}" for ingredient, amount in inventory.items()])
+                        resp = f"STATUS:INGREDIENTS:{status_string}\n"
+                        reply(resp.encode('utf-8'))
+                        if brew_log():
+                            logger.info("Sent inventory status: %s", status_string)
+                
+                    elif command == "PLAN":
+                        # 只读查询：不消耗原料，也不触发制作时间
+                        if payload in ("", "MAX"):
+                            max_servings, _ = plan_capacity()
+                            resp = "PLAN:MAX:" + ",".join(f"{c}={n}" for c, n in zip(VALID_COFFEES, max_servings.tolist()))
+                        else:
+                            try:
+                                mix = parse_plan_mix(payload)
+                            except KeyError as e:
+                                reply(b"ERROR:UNKNOWN_COFFEE_TYPE\n")
+                                logger.error(f"未知咖啡类型: {e.args[0]}")
+                                continue
+                            except ValueError:
+                                reply(b"ERROR:INVALID_PLAN\n")
+                                logger.error(f"无效的订单组合: '{payload}'")
+                                continue
+                            _, shortage = plan_capacity(mix)
+                            if shortage.any():
+                                resp = "PLAN:INFEASIBLE:" + ",".join(
+                                    f"{i}={n}" for i, n in zip(INGREDIENTS, shortage.tolist()) if n > 0)
+                            else:
+                                resp = "PLAN:FEASIBLE"
+                        reply(resp.encode('utf-8') + b"\n")
+                        if request_log():
+                            logger.debug("容量规划 %s -> %s", payload or "MAX", resp)
 
-                    if ingredient_to_refill == "ALL":
-                        for ingredient in inventory:
-                            inventory[ingredient] = MAX_STORAGE
-                        time.sleep(7)
-                        logger.info("所有原料已被补充")
-                        conn.sendall(b"ACK:REFILL_SUCCESS:ALL\n")
-                    
-                    elif ingredient_to_refill in inventory:
-                        inventory[ingredient_to_refill] = MAX_STORAGE
-                        time.sleep(3)
-                        logger.info(f"{ingredient_to_refill} 已被补充")
-                        conn.sendall(b"ACK:REFILL_SUCCESS:" + ingredient_to_refill.encode('utf-8') + b"\n")
                     else:
-                        conn.sendall(b"ERROR:INVALID_INGREDIENT\n")
-                        logger.error(f"未知原料: {ingredient_to_refill}")
-
-
-
-                elif command == "STATUS" and payload == "INGREDIENTS":
-                    status_string = ",".join([f"{ingredient}={amount}" for ingredient, amount in inventory.items()])
-                    resp = f"STATUS:INGREDIENTS:{status_string}\n"
-                    conn.sendall(resp.encode('utf-8'))
-                    logger.info(f"Sent inventory status: {status_string}")
-                
-                else:
-                    conn.sendall(b"ERROR:UNKNOWN_COMMAND\n")
-                    logger.error(f"未知指令格式: '{message}'")
+                        reply(b"ERROR:UNKNOWN_COMMAND\n")
+                        logger.error(f"未知指令格式: '{message}'")
+                if t0:
+                    profiler.record("coffee.handle_client", t0)
             
 
             except ConnectionResetError:
@@ -187,18 +386,26 @@ def handle_client(conn, addr):
                 logger.error(f"处理客户端 {addr} 时发生意外错误: {e}")
                 break
 
-def run_server():
+def run_server(host=HOST, port=PORT):
+    ready.starting("coffee")
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((HOST, PORT))
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, port))
         server_socket.listen()
-        logger.info(f"咖啡机器服务器已启动，监听端口 {PORT}")
+        logger.info(f"咖啡机器服务器已启动，监听端口 {port}")
+        if state.restored:
+            logger.info("已从 %s 恢复库存: %s", state.path, state.as_dict())
+        ready.ready("coffee", port=port)
 
         while True:
             conn, addr = server_socket.accept()
             # 为每个客户端连接创建一个新线程，使其可以处理多个并发连接
-            client_thread = threading.Thread(target=handle_client, args=(conn, addr))
+            client_thread = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
             client_thread.start()
 
-if __name__ == "__main__":
+def main():
     run_server()
 
+if __name__ == "__main__":
+    main()
+
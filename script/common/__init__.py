@@ -0,0 +1,3 @@
+'''
+各设备模拟器共享的公共模块
+'''
@@ -0,0 +1,178 @@
+'''
+模拟器共享的异步日志模块
+- 业务线程只合并消息参数后把 LogRecord 放入队列，格式化与输出由 QueueListener 后台线程完成
+- 支持彩色控制台输出与 JSON lines 输出
+- 提供按请求日志的采样/限流闸门，热路径上几乎不做日志工作
+'''
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+from colorlog import ColoredFormatter
+
+# ----------------- 环境变量配置
+# SIM_LOG_LEVEL   日志级别，默认 DEBUG
+# SIM_LOG_FORMAT  输出格式，color(默认) 或 json
+# SIM_LOG_FILE    额外写入的日志文件路径（可选）
+# SIM_LOG_SAMPLE  按请求日志每 N 条输出 1 条，默认 1（全部输出）
+# SIM_LOG_RATE    按请求日志每秒最多输出条数，默认 0（不限流）
+LOG_LEVEL = os.getenv("SIM_LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.getenv("SIM_LOG_FORMAT", "color").lower()
+LOG_FILE = os.getenv("SIM_LOG_FILE", "")
+LOG_SAMPLE = int(os.getenv("SIM_LOG_SAMPLE", "1"))
+LOG_RATE = float(os.getenv("SIM_LOG_RATE", "0"))
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_COLORS = {
+    'DEBUG':    'cyan',
+    'INFO':     'green',
+    'WARNING':  'yellow',
+    'ERROR':    'red',
+    'CRITICAL': 'red,bg_white',
+}
+
+# 进程内共享一个队列与一个后台监听线程
+_queue = queue.SimpleQueue()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    将日志记录格式化为一行 JSON，便于日志采集与离线分析
+    通过 extra={"fields": {...}} 传入的结构化字段会合并到输出中
+    """
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    标准 QueueHandler.prepare 会在调用线程中按格式化器生成整行并复制记录，
+    这里只在调用线程中合并 msg 与 args（args 可能是之后会被修改的可变对象），
+    时间戳、颜色、JSON 等格式化仍在监听线程中完成，异常信息也留给监听线程格式化
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _build_formatter(fmt):
+    if fmt == "json":
+        return JsonFormatter()
+    return ColoredFormatter(
+        "%(log_color)s%(asctime)s %(levelname)s %(name)s %(message)s",
+        datefmt=DATE_FORMAT,
+        log_colors=LOG_COLORS,
+    )
+
+
+def _start_listener():
+    """首次获取 logger 时启动后台监听线程，进程退出时自动刷新并停止"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        console = logging.StreamHandler()
+        console.setFormatter(_build_formatter(LOG_FORMAT))
+        handlers = [console]
+        if LOG_FILE:
+            file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+            # 文件输出不带颜色控制符
+            if LOG_FORMAT == "json":
+                file_handler.setFormatter(JsonFormatter())
+            else:
+                file_handler.setFormatter(logging.Formatter(
+                    "%(asctime)s %(levelname)s %(name)s %(message)s", datefmt=DATE_FORMAT))
+            handlers.append(file_handler)
+        _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=False)
+        _listener.start()
+        atexit.register(stop)
+
+
+def stop():
+    """停止后台监听线程，确保队列中剩余日志全部输出"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name, level=None):
+    """
+    获取挂载了队列处理器的 logger
+    输入：name (str) - logger 名称，例如 "grinder_sim"
+         level (str|int) - 日志级别，默认取 SIM_LOG_LEVEL
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level if level is not None else LOG_LEVEL)
+    if not logger.handlers:
+        _start_listener()
+        logger.addHandler(_DeferredQueueHandler(_queue))
+        # 不再向 root 传播，避免重复输出
+        logger.propagate = False
+    return logger
+
+
+class RequestLogGate:
+    """
+    按请求日志的闸门：级别未开启时直接返回 False，
+    否则按 1/N 采样，并用令牌桶限制每秒输出条数。
+    用法：
+        if gate():
+            logger.debug("收到指令: %s", message)
+    """
+    def __init__(self, logger, level=logging.DEBUG, sample=None, rate=None):
+        self.logger = logger
+        self.level = level
+        self.sample = max(1, LOG_SAMPLE if sample is None else sample)
+        self.rate = LOG_RATE if rate is None else rate
+        # 令牌桶容量至少为 1，每秒少于 1 条（例如 0.5）时也能攒够一个令牌
+        self.burst = max(1.0, self.rate)
+        self.count = 0          # 经过闸门的请求数
+        self.dropped = 0        # 被采样或限流丢弃的条数
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def __call__(self):
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        # 计数在多线程下可能有少量误差，这里只用于采样，不加锁
+        self.count += 1
+        if self.sample > 1 and self.count % self.sample:
+            self.dropped += 1
+            return False
+        if self.rate > 0:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                self.dropped += 1
+                return False
+            self._tokens -= 1
+        return True
+
+
+def request_gate(logger, level=logging.DEBUG, sample=None, rate=None):
+    """创建按请求日志的闸门，sample/rate 默认取 SIM_LOG_SAMPLE/SIM_LOG_RATE"""
+    return RequestLogGate(logger, level, sample, rate)
@@ -0,0 +1,136 @@
+'''
+基于 asyncio 的 Modbus TCP 服务端
+- 与 pyModbusTCP.server.ModbusServer 接口相同（data_bank、start()、stop()），沿用同一个 DataHandler，
+  模拟器的寄存器语义、命令信箱与流量录制不变
+- 所有连接由一个事件循环线程服务，不再为每个客户端创建线程，适合数百个并发轮询方
+- 同一连接上可以连续发送多条请求（流水线），按顺序应答
+- 支持功能码 0x03 读保持寄存器、0x04 读输入寄存器、0x06 写单个寄存器、0x10 写多个寄存器，
+  其他功能码返回异常 0x01
+'''
+import asyncio
+import struct
+import threading
+
+from pyModbusTCP.constants import (EXP_DATA_VALUE, EXP_ILLEGAL_FUNCTION,
+                                   READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS,
+                                   WRITE_MULTIPLE_REGISTERS, WRITE_SINGLE_REGISTER)
+from pyModbusTCP.server import DataHandler, ModbusServer
+
+MBAP = struct.Struct(">HHHB")   # transaction_id, protocol_id, length, unit_id
+MAX_READ = 125                  # 一次最多读取的寄存器数
+MAX_WRITE = 123                 # 一次最多写入的寄存器数
+
+
+class AsyncModbusServer:
+    """
+    输入：host, port - 监听地址
+         data_hdl (DataHandler) - 请求处理器，默认使用 pyModbusTCP 的 DataHandler
+         request_delay - 可选，每个请求前调用一次，返回需要等待的秒数（用于注入连接级延迟，不阻塞其他连接）
+    """
+    def __init__(self, host="localhost", port=502, data_hdl=None, request_delay=None):
+        self.host = host
+        self.port = port
+        self.data_hdl = data_hdl or DataHandler()
+        self.data_bank = self.data_hdl.data_bank
+        self.request_delay = request_delay
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """在后台线程中启动事件循环并开始监听，返回实际监听的端口（port=0 时由系统分配）"""
+        started = threading.Event()
+        error = []
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.server = self.loop.run_until_complete(
+                    asyncio.start_server(self.handle, self.host, self.port, reuse_address=True, backlog=1024))
+            except OSError as e:
+                error.append(e)
+                started.set()
+                return
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, name="modbus-asyncio", daemon=True)
+        self.thread.start()
+        started.wait()
+        if error:
+            raise error[0]
+        return self.port
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+
+    @property
+    def is_run(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info("peername") or ("", 0)
+        srv_info = ModbusServer.ServerInfo()
+        srv_info.client.address, srv_info.client.port = peer[0], peer[1]
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                transaction_id, protocol_id, length, unit_id = MBAP.unpack(header)
+                if protocol_id != 0 or not 2 <= length <= 254:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                if self.request_delay is not None:
+                    delay = self.request_delay()
+                    if delay:
+                        await asyncio.sleep(delay)
+                response = self.process(pdu, srv_info)
+                writer.write(MBAP.pack(transaction_id, 0, len(response) + 1, unit_id) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def process(self, pdu, srv_info):
+        """处理一个请求 PDU，返回应答 PDU"""
+        function_code = pdu[0]
+        try:
+            if function_code in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+                address, count = struct.unpack(">HH", pdu[1:5])
+                if not 1 <= count <= MAX_READ:
+                    return self.exception(function_code, EXP_DATA_VALUE)
+                if function_code == READ_HOLDING_REGISTERS:
+                    ret = self.data_hdl.read_h_regs(address, count, srv_info)
+                else:
+                    ret = self.data_hdl.read_i_regs(address, count, srv_info)
+                if not ret.ok:
+                    return self.exception(function_code, ret.exp_code)
+                return struct.pack(f">BB{count}H", function_code, count * 2, *ret.data)
+            if function_code == WRITE_SINGLE_REGISTER:
+                address, value = struct.unpack(">HH", pdu[1:5])
+                ret = self.data_hdl.write_h_regs(address, [value], srv_info)
+                if not ret.ok:
+                    return self.exception(function_code, ret.exp_code)
+                return pdu[:5]
+            if function_code == WRITE_MULTIPLE_REGISTERS:
+                address, count, byte_count = struct.unpack(">HHB", pdu[1:6])
+                if not 1 <= count <= MAX_WRITE or byte_count != count * 2 or len(pdu) != 6 + byte_count:
+                    return self.exception(function_code, EXP_DATA_VALUE)
+                words = list(struct.unpack(f">{count}H", pdu[6:]))
+                ret = self.data_hdl.write_h_regs(address, words, srv_info)
+                if not ret.ok:
+                    return self.exception(function_code, ret.exp_code)
+                return pdu[:5]
+        except struct.error:
+            return self.exception(function_code, EXP_DATA_VALUE)
+        return self.exception(function_code, EXP_ILLEGAL_FUNCTION)
+
+    @staticmethod
+    def exception(function_code, exp_code):
+        return struct.pack(">BB", function_code | 0x80, exp_code)
@@ -0,0 +1,490 @@
+'''
+进程内最小 MQTT Broker，用于测试与基准测试，替代外部 Mosquitto 容器
+- 支持 MQTT 3.1.1 与 5.0 客户端，QoS 0/1（QoS 2 的发布按 QoS 1 转发）、保留消息、遗嘱消息
+- 支持共享订阅 $share/<组名>/<过滤器>，同组订阅者轮流接收
+- 只支持清除会话（clean session），不持久化离线消息，不支持主题别名与认证
+用法：
+    broker = MQTTBroker(port=0)      # 0 表示随机端口
+    port = broker.start()            # 后台线程运行，返回实际端口
+    ...
+    broker.stop()
+    python mqtt_broker.py --port 1883   # 独立运行
+'''
+import argparse
+import itertools
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+
+logger = get_logger("mqtt_broker")
+
+# 报文类型（固定头高 4 位）
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+MAX_QOS = 1
+
+
+def encode_varint(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def encode_string(data):
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + encode_varint(len(body)) + body
+
+
+class Reader:
+    """按 MQTT 数据类型顺序读取报文体"""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def u16(self):
+        (value,) = struct.unpack_from("!H", self.data, self.pos)
+        self.pos += 2
+        return value
+
+    def binary(self):
+        length = self.u16()
+        self.pos += length
+        return self.data[self.pos - length:self.pos]
+
+    def varint(self):
+        value, shift = 0, 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def properties(self):
+        length = self.varint()
+        self.pos += length
+        return self.data[self.pos - length:self.pos]
+
+    def rest(self):
+        return self.data[self.pos:]
+
+    def remaining(self):
+        return len(self.data) - self.pos
+
+
+def valid_filter(topic_filter):
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+        if "#" in level and (level != "#" or i != len(levels) - 1):
+            return False
+        if "+" in level and level != "+":
+            return False
+    return bool(topic_filter)
+
+
+def split_shared(topic_filter):
+    """$share/<组名>/<过滤器> -> (组名, 过滤器)"""
+    _, group, real_filter = (topic_filter.split("/", 2) + ["", ""])[:3]
+    return group, real_filter
+
+
+def topic_matches(topic_filter, topic):
+    """判断话题是否匹配过滤器，通配符不匹配以 $ 开头的话题"""
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+    f_levels = topic_filter.split("/")
+    t_levels = topic.split("/")
+    for i, level in enumerate(f_levels):
+        if level == "#":
+            return True
+        if i >= len(t_levels) or (level != "+" and level != t_levels[i]):
+            return False
+    return len(f_levels) == len(t_levels)
+
+
+class Message:
+    __slots__ = ("topic", "payload", "qos", "retain", "properties", "sender")
+
+    def __init__(self, topic, payload, qos, retain, properties=b"", sender=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+        self.sender = sender
+
+
+class Subscription:
+    """一个订阅的选项（MQTT 5 订阅选项字节，3.1.1 只有 QoS）"""
+    __slots__ = ("qos", "no_local", "retain_as_published", "retain_handling")
+
+    def __init__(self, options):
+        self.qos = min(options & 0x03, MAX_QOS)
+        self.no_local = bool(options & 0x04)
+        self.retain_as_published = bool(options & 0x08)
+        self.retain_handling = (options >> 4) & 0x03
+
+
+class Session:
+    """一个客户端连接，send 可在任意线程调用"""
+    def __init__(self, broker, sock, addr):
+        self.broker = broker
+        self.sock = sock
+        self.addr = addr
+        self.client_id = None
+        self.v5 = False
+        self.will = None
+        self.send_lock = threading.Lock()
+        self.packet_ids = itertools.cycle(range(1, 65536))
+        self.qos2_pending = set()   # 已收到 PUBLISH 但尚未收到 PUBREL 的 QoS 2 报文标识
+        self.closed = False
+
+    def send(self, data):
+        try:
+            with self.send_lock:
+                self.sock.sendall(data)
+        except OSError:
+            self.close()
+
+    def deliver(self, message, sub):
+        qos = min(message.qos, sub.qos)
+        retain = message.retain if sub.retain_as_published else False
+        body = encode_string(message.topic.encode("utf-8"))
+        if qos:
+            with self.send_lock:
+                packet_id = next(self.packet_ids)
+            body += struct.pack("!H", packet_id)
+        if self.v5:
+            body += encode_varint(len(message.properties)) + message.properties
+        self.send(packet(PUBLISH, qos << 1 | int(retain), body + message.payload))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def recv_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("连接已关闭")
+            buf += chunk
+        return bytes(buf)
+
+    def read_packet(self):
+        header = self.recv_exact(1)[0]
+        length, shift = 0, 0
+        while True:
+            byte = self.recv_exact(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0F, self.recv_exact(length) if length else b""
+
+    # ----------------- 报文处理
+    def handle_connect(self, body):
+        r = Reader(body)
+        r.binary()                  # 协议名 MQTT / MQIsdp
+        level = r.byte()
+        flags = r.byte()
+        keepalive = r.u16()
+        if level not in (3, 4, 5):
+            self.send(packet(CONNACK, 0, bytes([0, 1])))
+            return False
+        self.v5 = level == 5
+        if self.v5:
+            r.properties()
+        self.client_id = r.binary().decode("utf-8") or f"auto-{id(self):x}"
+        if flags & 0x04:
+            if self.v5:
+                r.properties()      # 遗嘱属性（如延迟发送）不支持，忽略
+            will_topic = r.binary().decode("utf-8")
+            will_payload = r.binary()
+            self.will = Message(will_topic, will_payload, min((flags >> 3) & 0x03, MAX_QOS),
+                                bool(flags & 0x20), b"", self)
+        if keepalive:
+            self.sock.settimeout(keepalive * 1.5)
+        self.broker.register(self)
+        # 不支持持久会话，session present 恒为 0
+        self.send(packet(CONNACK, 0, bytes([0, 0, 0]) if self.v5 else bytes([0, 0])))
+        return True
+
+    def handle_publish(self, flags, body):
+        qos = (flags >> 1) & 0x03
+        r = Reader(body)
+        topic = r.binary().decode("utf-8")
+        packet_id = r.u16() if qos else None
+        properties = r.properties() if self.v5 else b""
+        message = Message(topic, r.rest(), min(qos, MAX_QOS), bool(flags & 0x01), properties, self)
+        if qos == 2:
+            self.send(packet(PUBREC, 0, struct.pack("!H", packet_id)))
+            if packet_id in self.qos2_pending:
+                return      # 重发的 QoS 2 报文只转发一次
+            self.qos2_pending.add(packet_id)
+        elif qos == 1:
+            self.send(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+        self.broker.publish(message)
+
+    def handle_subscribe(self, body):
+        r = Reader(body)
+        packet_id = r.u16()
+        if self.v5:
+            r.properties()
+        codes = []
+        granted = []
+        while r.remaining():
+            topic_filter = r.binary().decode("utf-8")
+            sub = Subscription(r.byte())
+            if self.broker.subscribe(self, topic_filter, sub):
+                codes.append(sub.qos)
+                granted.append((topic_filter, sub))
+            else:
+                codes.append(0x80)
+        props = b"\x00" if self.v5 else b""
+        self.send(packet(SUBACK, 0, struct.pack("!H", packet_id) + props + bytes(codes)))
+        for topic_filter, sub in granted:
+            self.broker.send_retained(self, topic_filter, sub)
+
+    def handle_unsubscribe(self, body):
+        r = Reader(body)
+        packet_id = r.u16()
+        if self.v5:
+            r.properties()
+        codes = []
+        while r.remaining():
+            codes.append(0x00 if self.broker.unsubscribe(self, r.binary().decode("utf-8")) else 0x11)
+        payload = struct.pack("!H", packet_id)
+        if self.v5:
+            payload += b"\x00" + bytes(codes)
+        self.send(packet(UNSUBACK, 0, payload))
+
+    def serve(self):
+        """连接处理线程"""
+        graceful = False
+        try:
+            packet_type, _, body = self.read_packet()
+            if packet_type != CONNECT or not self.handle_connect(body):
+                return
+            while True:
+                packet_type, flags, body = self.read_packet()
+                if packet_type == PUBLISH:
+                    self.handle_publish(flags, body)
+                elif packet_type == PUBREL:
+                    packet_id = struct.unpack_from("!H", body)[0]
+                    self.qos2_pending.discard(packet_id)
+                    self.send(packet(PUBCOMP, 0, struct.pack("!H", packet_id)))
+                elif packet_type == SUBSCRIBE:
+                    self.handle_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self.handle_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    graceful = True
+                    return
+                # PUBACK/PUBREC/PUBCOMP：不重发 QoS 1 消息，直接忽略确认
+        except (OSError, ConnectionError, IndexError, struct.error, UnicodeDecodeError) as e:
+            if not self.closed:
+                logger.debug("客户端 %s 断开: %s", self.client_id or self.addr, e)
+        finally:
+            self.broker.unregister(self)
+            self.close()
+            if self.will and not graceful:
+                self.broker.publish(self.will)
+
+
+class MQTTBroker:
+    """
+    最小 MQTT Broker
+    输入：host (str) - 监听地址
+         port (int) - 监听端口，0 表示由系统分配
+    """
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.sessions = {}      # client_id -> Session
+        self.subs = {}          # 过滤器 -> {Session: Subscription}
+        self.shared = {}        # (组名, 过滤器) -> {Session: Subscription}
+        self.shared_rr = Counter()
+        self.retained = {}      # 话题 -> Message
+        self.stats = Counter()  # in: 收到的 PUBLISH 数, out: 转发的 PUBLISH 数
+        self.server_socket = None
+        self.thread = None
+
+    # ----------------- 会话与订阅
+    def register(self, session):
+        with self.lock:
+            old = self.sessions.get(session.client_id)
+            self.sessions[session.client_id] = session
+        if old is not None and old is not session:
+            # 相同 client_id 的新连接接管会话，断开旧连接
+            old.close()
+
+    def unregister(self, session):
+        with self.lock:
+            if self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+            for table in (self.subs, self.shared):
+                for key in list(table):
+                    table[key].pop(session, None)
+                    if not table[key]:
+                        del table[key]
+
+    def subscribe(self, session, topic_filter, sub):
+        if topic_filter.startswith("$share/"):
+            group, real_filter = split_shared(topic_filter)
+            if not group or not valid_filter(real_filter):
+                return False
+            with self.lock:
+                self.shared.setdefault((group, real_filter), {})[session] = sub
+            return True
+        if not valid_filter(topic_filter):
+            return False
+        with self.lock:
+            self.subs.setdefault(topic_filter, {})[session] = sub
+        return True
+
+    def unsubscribe(self, session, topic_filter):
+        if topic_filter.startswith("$share/"):
+            key, table = split_shared(topic_filter), self.shared
+        else:
+            key, table = topic_filter, self.subs
+        with self.lock:
+            members = table.get(key)
+            if not members or session not in members:
+                return False
+            del members[session]
+            if not members:
+                del table[key]
+            return True
+
+    def send_retained(self, session, topic_filter, sub):
+        # 共享订阅不接收保留消息；MQTT 5 retain handling=2 表示不发送
+        if topic_filter.startswith("$share/") or sub.retain_handling == 2:
+            return
+        with self.lock:
+            messages = [m for topic, m in self.retained.items() if topic_matches(topic_filter, topic)]
+        for message in messages:
+            retained_sub = Subscription(sub.qos | 0x08)  # 保留消息发送时保持 retain 标志
+            session.deliver(message, retained_sub)
+
+    def has_subscriber(self, topic):
+        """是否有订阅（含共享订阅）匹配该话题"""
+        with self.lock:
+            return any(topic_matches(f, topic) for f in self.subs) or \
+                any(topic_matches(f, topic) for _, f in self.shared)
+
+    def wait_subscribed(self, topic, timeout=10):
+        """等待有客户端订阅该话题，用于测试中确认设备模拟器已就绪"""
+        deadline = time.monotonic() + timeout
+        while not self.has_subscriber(topic):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # ----------------- 转发
+    def publish(self, message):
+        targets = {}
+        with self.lock:
+            self.stats["in"] += 1
+            if message.retain:
+                if message.payload:
+                    self.retained[message.topic] = message
+                else:
+                    self.retained.pop(message.topic, None)
+            for topic_filter, members in self.subs.items():
+                if topic_matches(topic_filter, message.topic):
+                    for session, sub in members.items():
+                        if sub.no_local and session is message.sender:
+                            continue
+                        # 同一客户端匹配多个过滤器时只投递一次，取最高 QoS
+                        if session not in targets or sub.qos > targets[session].qos:
+                            targets[session] = sub
+            for key, members in self.shared.items():
+                if members and topic_matches(key[1], message.topic):
+                    # 共享订阅组内轮流投递
+                    index = self.shared_rr[key] % len(members)
+                    self.shared_rr[key] += 1
+                    session, sub = list(members.items())[index]
+                    if session not in targets:
+                        targets[session] = sub
+            self.stats["out"] += len(targets)
+        for session, sub in targets.items():
+            session.deliver(message, sub)
+
+    # ----------------- 服务
+    def start(self):
+        """在后台线程中监听，返回实际端口"""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen()
+        self.port = self.server_socket.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve_forever, name="mqtt_broker", daemon=True)
+        self.thread.start()
+        logger.info("MQTT Broker 已启动，监听 %s:%d", self.host, self.port)
+        return self.port
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, addr = self.server_socket.accept()
+            except OSError:
+                return      # stop() 关闭了监听套接字
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = Session(self, sock, addr)
+            threading.Thread(target=session.serve, name=f"mqtt_{addr[1]}", daemon=True).start()
+
+    def stop(self):
+        if self.server_socket:
+            self.server_socket.close()
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="进程内最小 MQTT Broker")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    args = parser.parse_args()
+    broker = MQTTBroker(args.host, args.port)
+    broker.start()
+    try:
+        broker.thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
+        logger.info("MQTT Broker 已停止")
+
+
+if __name__ == "__main__":
+    main()
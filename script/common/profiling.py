@@ -0,0 +1,236 @@
+'''
+模拟器运行中按需开启的性能剖析
+- 发送 SIGUSR1（kill -USR1 <pid>）开始一次剖析，再发送一次结束并写出结果，无需重启；
+  设置 SIM_PROF=1 时启动即开始，收到 SIGUSR1 或进程退出时写出
+- 一次剖析包括：
+    采样剖析器：后台线程每 SIM_PROF_INTERVAL 毫秒读取所有线程的调用栈（cProfile 只能观察调用它的线程，
+      模拟器的请求分布在连接线程、MQTT 线程与主循环中，因此使用采样）
+    tracemalloc：开始时取基线快照，结束时取快照并与基线比较（SIM_PROF_MEMORY=0 关闭，开销较大）
+    各处理函数耗时：handle_client、process_command、on_message 与磨粉机主循环每次处理的耗时分布
+- 未开始剖析时没有采样线程、不跟踪内存，处理函数只多一次 profiler.on 属性判断
+- 结果写入 SIM_PROF_DIR（默认 ./sim_prof）下的 <程序名>-<pid>-<时间>/：
+    stacks.folded   折叠调用栈（线程名;函数;...;函数 次数），可直接用 speedscope / flamegraph.pl 查看
+    top.txt         按自身与累计采样数排序的函数
+    memory.txt      内存占用最多的代码行及相对基线的增长；memory.snapshot 可用 tracemalloc.Snapshot.load 读取
+    timings.json    各处理函数的次数、均值与 P50/P95/P99/最大耗时
+- SIM_PROF_DURATION=<秒> 时每次剖析在到时后自动结束
+- Windows 没有 SIGUSR1，只能使用 SIM_PROF
+用法：
+    SIM_PROF_DIR=/tmp/prof python script/coffeemachine/coffeemachine_sim.py &
+    kill -USR1 $!   # 开始
+    kill -USR1 $!   # 结束并写出 /tmp/prof/coffeemachine_sim-<pid>-<时间>/
+'''
+import atexit
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from common.logs import get_logger
+from common.stats import percentile
+
+PROF_DIR = os.getenv("SIM_PROF_DIR", "sim_prof")
+PROF_AT_START = os.getenv("SIM_PROF", "") not in ("", "0")
+PROF_DURATION = float(os.getenv("SIM_PROF_DURATION", "0"))
+PROF_INTERVAL = float(os.getenv("SIM_PROF_INTERVAL", "5")) / 1000
+PROF_MEMORY = os.getenv("SIM_PROF_MEMORY", "1") != "0"
+MEMORY_FRAMES = 10      # tracemalloc 记录的调用栈深度
+MAX_SAMPLES = 100000    # 每个处理函数最多保留的耗时样本数（次数与总耗时不受限制）
+TOP_N = 30
+
+logger = get_logger("profiling")
+
+
+class StackSampler:
+    """后台线程定时读取所有线程的调用栈，按 (线程名, 调用栈) 计数"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="prof-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            self.samples += 1
+
+    def write(self, directory):
+        with open(os.path.join(directory, "stacks.folded"), "w", encoding="utf-8") as f:
+            for (thread_name, stack), count in self.stacks.most_common():
+                f.write(";".join((thread_name,) + stack) + f" {count}\n")
+        own, total = Counter(), Counter()
+        for (_, stack), count in self.stacks.items():
+            own[stack[-1]] += count
+            for func in set(stack):
+                total[func] += count
+        with open(os.path.join(directory, "top.txt"), "w", encoding="utf-8") as f:
+            f.write(f"采样 {self.samples} 次，间隔 {self.interval * 1000:.1f} ms，"
+                    f"线程栈 {sum(self.stacks.values())} 个\n")
+            for title, counter in (("自身", own), ("累计", total)):
+                f.write(f"\n按{title}采样数排序：\n")
+                for func, count in counter.most_common(TOP_N):
+                    f.write(f"{count:>8}  {func}\n")
+
+
+class MemorySnapshot:
+    """开始时取基线快照，结束时写出占用最多的代码行与相对基线的增长"""
+    def __init__(self):
+        self.started_here = False
+        self.baseline = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            self.started_here = True
+        self.baseline = tracemalloc.take_snapshot()
+
+    def stop(self, directory):
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_here:
+            tracemalloc.stop()
+        snapshot.dump(os.path.join(directory, "memory.snapshot"))
+        with open(os.path.join(directory, "memory.txt"), "w", encoding="utf-8") as f:
+            stats = snapshot.statistics("lineno")
+            f.write(f"当前跟踪的内存 {sum(s.size for s in stats) / 1024:.1f} KiB，占用最多的代码行：\n")
+            for stat in stats[:TOP_N]:
+                f.write(f"{stat}\n")
+            f.write("\n相对开始时的增长：\n")
+            for stat in snapshot.compare_to(self.baseline, "lineno")[:TOP_N]:
+                f.write(f"{stat}\n")
+
+
+class Profiler:
+    """
+    进程内共享的剖析控制，on 为 True 时各处理函数记录耗时：
+        t0 = time.perf_counter() if profiler.on else 0
+        ...
+        if t0:
+            profiler.record("coffee.handle_client", t0)
+    """
+    def __init__(self):
+        self.on = False
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.memory = None
+        self.timings = defaultdict(list)
+        self.totals = defaultdict(lambda: [0, 0.0, 0.0])   # 名称 -> [次数, 总耗时, 最大耗时]
+        self.started_at = None
+        self.timer = None
+
+    def record(self, name, start):
+        """记录一次处理耗时，start 为 time.perf_counter() 的返回值"""
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            total = self.totals[name]
+            total[0] += 1
+            total[1] += elapsed
+            total[2] = max(total[2], elapsed)
+            samples = self.timings[name]
+            if len(samples) < MAX_SAMPLES:
+                samples.append(elapsed)
+
+    def start(self):
+        with self.lock:
+            if self.started_at is not None:
+                return False
+            self.started_at = time.time()
+            self.timings.clear()
+            self.totals.clear()
+        self.sampler = StackSampler(PROF_INTERVAL)
+        self.sampler.start()
+        if PROF_MEMORY:
+            self.memory = MemorySnapshot()
+            self.memory.start()
+        self.on = True
+        if PROF_DURATION > 0:
+            self.timer = threading.Timer(PROF_DURATION, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+        logger.info("开始性能剖析（采样间隔 %.1f ms，内存跟踪%s）", PROF_INTERVAL * 1000, "开" if PROF_MEMORY else "关")
+        return True
+
+    def stop(self):
+        """结束剖析并写出结果，返回结果目录；未在剖析时返回 None"""
+        with self.lock:
+            if self.started_at is None:
+                return None
+            started_at, self.started_at = self.started_at, None
+            self.on = False
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        directory = os.path.join(PROF_DIR, "{}-{}-{}".format(
+            os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0], os.getpid(),
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(started_at))))
+        os.makedirs(directory, exist_ok=True)
+        self.sampler.stop()
+        self.sampler.write(directory)
+        if self.memory is not None:
+            self.memory.stop(directory)
+            self.memory = None
+        self.write_timings(directory, time.time() - started_at)
+        logger.info("性能剖析已结束（%.1f s），结果写入 %s", time.time() - started_at, directory)
+        return directory
+
+    def toggle(self):
+        if not self.start():
+            self.stop()
+
+    def write_timings(self, directory, duration):
+        with self.lock:
+            result = {"duration_s": round(duration, 3), "handlers": {}}
+            for name, (count, total, longest) in sorted(self.totals.items()):
+                samples = self.timings[name]
+                result["handlers"][name] = {
+                    "count": count, "total_s": round(total, 6), "mean_ms": round(total / count * 1000, 3),
+                    **{f"p{q}_ms": round(percentile(samples, q) * 1000, 3) for q in (50, 95, 99)},
+                    "max_ms": round(longest * 1000, 3),
+                }
+        with open(os.path.join(directory, "timings.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """
+    返回进程内共享的 Profiler；第一次调用时安装 SIGUSR1 处理（须在主线程中，否则只能用 SIM_PROF），
+    设置了 SIM_PROF 时立即开始剖析
+    """
+    global _profiler
+    with _profiler_lock:
+        if _profiler is not None:
+            return _profiler
+        _profiler = Profiler()
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        # 信号处理函数在主线程中执行，主线程可能正持有 profiler.lock，切换交给新线程完成
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+            target=_profiler.toggle, name="prof-toggle", daemon=True).start())
+    atexit.register(_profiler.stop)
+    if PROF_AT_START:
+        _profiler.start()
+    return _profiler
@@ -0,0 +1,218 @@
+'''
+模拟器就绪信号与并行等待
+- 设备在服务开始监听、状态初始化完成后调用 ready(name)，启动时调用 starting(name)
+- SIM_READY_DIR=<目录>：就绪时写入 <目录>/<设备名>.ready（门店 1 以外带 -shop<SHOP_ID> 后缀，内容为 JSON，原子替换），启动时删除上次残留的文件
+- SIM_HEALTH_PORT=<端口>：进程内启动一个健康检查端口，任何连接（包括 HTTP GET）都会收到 HTTP/1.0 响应，
+  全部设备就绪时为 200，否则为 503，正文为 {"ready": [...], "starting": [...]}
+  端口无法监听（例如已被占用）时记录警告，设备照常启动
+- 两者都未设置时只在进程内记录，不打开文件或端口
+- wait_ready(targets) 并行等待多个目标，目标写法：
+    file:<路径>                     文件存在
+    tcp:<主机>:<端口>               端口可以连接（例如 MQTT Broker）
+    health:<主机>:<端口>[/<设备>]    健康端口返回 200，或指定设备已就绪
+用法：
+    python script/common/ready.py tcp:localhost:1883 health:localhost:9100 file:/tmp/ready/ice.ready --timeout 30
+'''
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+from common.shop import SHOP_ID, scoped
+
+logger = get_logger("ready")
+
+READY_DIR = os.getenv("SIM_READY_DIR", "")
+HEALTH_PORT = int(os.getenv("SIM_HEALTH_PORT", "0"))
+
+_devices = {}           # 设备名 -> 就绪信息，None 表示启动中
+_changed = threading.Condition()
+_health_server = None
+
+
+def ready_file(name, directory=None):
+    """设备就绪文件路径，其他门店的文件名带门店后缀，见 common/shop.py"""
+    return os.path.join(directory or READY_DIR, f"{scoped(name)}.ready")
+
+
+def starting(name):
+    """设备开始初始化：清除残留的就绪文件，并在健康端口上报告为启动中"""
+    with _changed:
+        _devices[name] = None
+    if READY_DIR:
+        try:
+            os.remove(ready_file(name))
+        except FileNotFoundError:
+            pass
+    if HEALTH_PORT:
+        _start_health_server()
+
+
+def ready(name, **info):
+    """设备已可以服务请求，info 为附加信息（例如端口）"""
+    info = {"device": name, "shop": SHOP_ID, "pid": os.getpid(), "time": time.time(), **info}
+    if READY_DIR:
+        os.makedirs(READY_DIR, exist_ok=True)
+        tmp = ready_file(name) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(tmp, ready_file(name))
+    with _changed:
+        _devices[name] = info
+        _changed.notify_all()
+
+
+def wait_local(names, timeout=None):
+    """等待本进程内的设备全部就绪，返回是否在超时前就绪"""
+    with _changed:
+        return _changed.wait_for(lambda: all(_devices.get(n) is not None for n in names), timeout)
+
+
+def snapshot():
+    """(已就绪设备列表, 启动中设备列表)"""
+    with _changed:
+        return ([n for n, info in _devices.items() if info is not None],
+                [n for n, info in _devices.items() if info is None])
+
+
+# ----------------- 健康检查端口
+def _health_response():
+    done, pending = snapshot()
+    body = json.dumps({"ready": done, "starting": pending}).encode()
+    status = "503 Service Unavailable" if pending or not done else "200 OK"
+    return (f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+def _serve_health(server_socket):
+    while True:
+        conn, _ = server_socket.accept()
+        with conn:
+            try:
+                # 读掉可能存在的 HTTP 请求头，避免关闭时对端收到 RST
+                conn.settimeout(0.2)
+                conn.recv(1024)
+            except OSError:
+                pass
+            try:
+                conn.sendall(_health_response())
+            except OSError:
+                pass
+
+
+def _start_health_server():
+    global _health_server
+    with _changed:
+        if _health_server is not None:
+            return
+        _health_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    _health_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        _health_server.bind(("0.0.0.0", HEALTH_PORT))
+        _health_server.listen()
+    except OSError as e:
+        # 端口被占用等情况下设备照常启动，只是没有健康检查端口；之后的设备也不再重试
+        _health_server.close()
+        logger.warning("无法在端口 %d 启动健康检查: %s，继续运行但不提供健康检查端口", HEALTH_PORT, e)
+        return
+    threading.Thread(target=_serve_health, args=(_health_server,), name="health", daemon=True).start()
+
+
+# ----------------- 等待
+def _split_host_port(text):
+    host, _, port = text.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def probe(target, connect_timeout=0.5):
+    """检查一次目标是否就绪，目标写法见模块说明"""
+    kind, _, spec = target.partition(":")
+    if kind == "file":
+        return os.path.exists(spec)
+    if kind == "tcp":
+        try:
+            socket.create_connection(_split_host_port(spec), connect_timeout).close()
+            return True
+        except OSError:
+            return False
+    if kind == "health":
+        address, _, device = spec.partition("/")
+        try:
+            with socket.create_connection(_split_host_port(address), connect_timeout) as conn:
+                conn.settimeout(connect_timeout)
+                conn.sendall(b"GET / HTTP/1.0\r\n\r\n")
+                response = b""
+                while True:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    response += chunk
+        except OSError:
+            return False
+        head, _, body = response.partition(b"\r\n\r\n")
+        if device:
+            try:
+                return device in json.loads(body)["ready"]
+            except (ValueError, KeyError):
+                return False
+        return head.split(b" ", 2)[1:2] == [b"200"]
+    raise ValueError(f"未知就绪目标: {target}")
+
+
+def wait_ready(targets, timeout=30, interval=0.05):
+    """
+    并行等待全部目标就绪
+    输入：targets (list) - 目标列表
+         timeout (float) - 最长等待时间（秒），对全部目标共用
+         interval (float) - 每个目标的检查间隔（秒）
+    输出：{target: 就绪用时（秒）}；超时抛出 TimeoutError，消息中列出未就绪的目标
+    """
+    targets = list(targets)
+    for target in targets:
+        if target.partition(":")[0] not in ("file", "tcp", "health"):
+            raise ValueError(f"未知就绪目标: {target}")
+    start = time.monotonic()
+    deadline = start + timeout
+
+    def wait_one(target):
+        while True:
+            if probe(target):
+                return time.monotonic() - start
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        elapsed = dict(zip(targets, pool.map(wait_one, targets)))
+    missing = [t for t, e in elapsed.items() if e is None]
+    if missing:
+        raise TimeoutError(f"{timeout:.0f} s 内未就绪: {', '.join(missing)}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行等待模拟器与服务就绪")
+    parser.add_argument("targets", nargs="+", help="file:<路径> / tcp:<主机>:<端口> / health:<主机>:<端口>[/<设备>]")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    try:
+        elapsed = wait_ready(args.targets, args.timeout)
+    except (TimeoutError, ValueError) as e:
+        print(e)
+        return 1
+    for target, seconds in elapsed.items():
+        print(f"{target} 就绪，用时 {seconds * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+'''
+设备入站流量的录制格式
+- 设置 SIM_RECORD_FILE=<路径> 后，各模拟器把收到的每个请求追加写入同一个二进制文件
+- 文件以 6 字节文件头开始：魔数 b"SIMR" + uint16 格式版本（当前为 2）；
+  版本 1 没有文件头且负载长度为 uint16，超过 65535 字节的消息无法录制，不再支持读取
+- 每条记录 = 18 字节头部 + 负载，使用 O_APPEND 一次 write 写入，多线程/多设备共用同一文件
+- 录制失败（例如磁盘已满）只记录日志，不影响模拟器处理请求
+- replay_traffic.py 读取该文件并按 1×、10× 或最快速度回放
+
+记录头部（小端）：
+| 字段     | 类型   | 描述 |
+|----------|--------|------|
+| ts       | double | 接收时间（Unix 时间戳，秒） |
+| device   | uint8  | 设备编号，见 DEVICE_* |
+| op       | uint8  | 操作编号，见 OP_* |
+| session  | uint32 | 会话编号（客户端端口等），用于回放时区分连接 |
+| length   | uint32 | 负载长度 |
+'''
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from common.logs import get_logger
+
+logger = get_logger("record")
+
+MAGIC = b"SIMR"
+VERSION = 2
+FILE_HEADER = struct.Struct("<4sH")
+HEADER = struct.Struct("<dBBII")
+
+# 设备编号
+DEVICE_GRINDER = 1
+DEVICE_COFFEE = 2
+DEVICE_ICE = 3
+DEVICE_ROBOT = 4
+DEVICE_NAMES = {
+    DEVICE_GRINDER: "grinder",
+    DEVICE_COFFEE: "coffee",
+    DEVICE_ICE: "ice",
+    DEVICE_ROBOT: "robot",
+}
+
+# 操作编号
+OP_WRITE_REGISTERS = 1  # Modbus 写保持寄存器，负载: 起始地址(H) + 寄存器值(H...)
+OP_TCP_DATA = 2         # 咖啡机 TCP 报文，负载: 原始字节
+OP_DB_WRITE = 3         # S7 DB 写入，负载: DB号(H) + 起始字节(H) + 数据
+OP_MQTT_MESSAGE = 4     # MQTT 消息，负载: 话题长度(H) + 话题 + 消息体
+
+RECORD_FILE = os.getenv("SIM_RECORD_FILE", "")
+
+Record = namedtuple("Record", ["ts", "device", "op", "session", "payload"])
+
+
+class Recorder:
+    """追加写入录制文件，write 可在任意线程调用；已有文件的格式版本不同时抛出 ValueError"""
+    def __init__(self, path):
+        self.path = path
+        try:
+            # 只有创建文件的进程写文件头，共用同一文件的其他进程直接追加
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            os.write(self.fd, FILE_HEADER.pack(MAGIC, VERSION))
+        except FileExistsError:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            if os.fstat(self.fd).st_size == 0:
+                os.write(self.fd, FILE_HEADER.pack(MAGIC, VERSION))
+            else:
+                try:
+                    with open(path, "rb") as f:
+                        _check_file_header(f)
+                except ValueError:
+                    os.close(self.fd)
+                    raise
+        self.count = 0
+        self.errors = 0
+
+    def write(self, device, op, session, payload):
+        """追加一条记录，失败时只记录日志，返回是否写入"""
+        try:
+            # 头部与负载拼成一次 write，O_APPEND 保证多线程追加不交错
+            os.write(self.fd, HEADER.pack(time.time(), device, op, session & 0xFFFFFFFF, len(payload)) + payload)
+        except (OSError, struct.error) as e:
+            self.errors += 1
+            logger.warning("录制 %s 的 %d 字节请求失败（累计 %d 次）：%s",
+                           DEVICE_NAMES.get(device, device), len(payload), self.errors, e)
+            return False
+        self.count += 1
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """未设置 SIM_RECORD_FILE 时返回 None；同一进程中的所有设备共享一个 Recorder"""
+    global _recorder
+    if not RECORD_FILE:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder(RECORD_FILE)
+    return _recorder
+
+
+def _check_file_header(f):
+    head = f.read(FILE_HEADER.size)
+    magic, version = FILE_HEADER.unpack(head) if len(head) == FILE_HEADER.size else (None, None)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{f.name} 不是版本 {VERSION} 的录制文件，请用当前版本的模拟器重新录制")
+
+
+def read_records(path):
+    """逐条读取录制文件，末尾不完整的记录（例如进程被强制结束）会被忽略；格式版本不符时抛出 ValueError"""
+    with open(path, "rb") as f:
+        _check_file_header(f)
+        while True:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                return
+            ts, device, op, session, length = HEADER.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield Record(ts, device, op, session, payload)
+
+
+# ----------------- 各协议负载编解码
+def encode_registers(address, words):
+    return struct.pack(f"<H{len(words)}H", address, *words)
+
+
+def decode_registers(payload):
+    values = struct.unpack(f"<{len(payload) // 2}H", payload)
+    return values[0], list(values[1:])
+
+
+def encode_db_write(db_number, start, data):
+    return struct.pack("<HH", db_number, start) + bytes(data)
+
+
+def decode_db_write(payload):
+    db_number, start = struct.unpack_from("<HH", payload)
+    return db_number, start, payload[4:]
+
+
+def encode_mqtt(topic, message):
+    topic_bytes = topic.encode("utf-8")
+    return struct.pack("<H", len(topic_bytes)) + topic_bytes + bytes(message)
+
+
+def decode_mqtt(payload):
+    (length,) = struct.unpack_from("<H", payload)
+    return payload[2:2 + length].decode("utf-8"), payload[2 + length:]
@@ -0,0 +1,114 @@
+'''
+送餐机器人 MQTT 消息编码
+- 按话题选择编码：<基础话题> 为 JSON（原有格式），<基础话题>/msgpack 为 MessagePack，<基础话题>/struct 为定长二进制
+- 任意编码都支持批量：JSON/MessagePack 使用订单数组，定长二进制把多条记录直接拼接
+- 单条 JSON 指令与状态的格式保持不变，原有客户端无需修改
+
+定长二进制布局（小端）：
+| 消息 | 字段 |
+|------|------|
+| 指令 | order_id uint32, table_number uint16, need_ice uint8, coffee_type 16 字节 UTF-8（不足补 0） |
+| 状态 | order_id uint32, table_number uint16, status uint8（见 STATUS_CODES） |
+'''
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:     # 只在使用 msgpack 话题时需要
+    msgpack = None
+
+ENCODINGS = ("json", "msgpack", "struct")
+
+COFFEE_TYPE_SIZE = 16
+COMMAND_STRUCT = struct.Struct(f"<IHB{COFFEE_TYPE_SIZE}s")
+STATUS_STRUCT = struct.Struct("<IHB")
+STATUS_CODES = {"RECEIVED": 1, "DELIVERY_COMPLETE": 2, "DELIVERY_FAILED": 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def topic_encoding(topic, base):
+    """根据话题后缀返回编码名，未知后缀抛出 ValueError"""
+    if topic == base:
+        return "json"
+    suffix = topic[len(base) + 1:] if topic.startswith(base + "/") else ""
+    if suffix not in ENCODINGS:
+        raise ValueError(f"未知编码话题: {topic}")
+    return suffix
+
+
+def encoding_topic(base, encoding):
+    """编码名对应的话题"""
+    return base if encoding == "json" else f"{base}/{encoding}"
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise ValueError("未安装 msgpack，无法使用 msgpack 编码")
+
+
+def _unpack_records(layout, payload):
+    if len(payload) % layout.size:
+        raise ValueError(f"二进制消息长度 {len(payload)} 不是记录长度 {layout.size} 的整数倍")
+    return layout.iter_unpack(payload)
+
+
+def decode_commands(encoding, payload):
+    """解码指令消息，返回订单字典列表（单条消息也返回长度为 1 的列表）"""
+    if encoding == "struct":
+        return [
+            {"order_id": order_id, "table_number": table_number, "need_ice": bool(need_ice),
+             "coffee_type": coffee_type.rstrip(b"\0").decode("utf-8")}
+            for order_id, table_number, need_ice, coffee_type in _unpack_records(COMMAND_STRUCT, payload)
+        ]
+    if encoding == "msgpack":
+        _require_msgpack()
+        try:
+            data = msgpack.unpackb(payload)
+        except Exception as e:
+            raise ValueError(f"无效的 msgpack 消息: {e}") from e
+    else:
+        data = json.loads(payload)
+    orders = data if isinstance(data, list) else [data]
+    if not all(isinstance(order, dict) for order in orders):
+        raise ValueError("消息必须是对象或对象数组")
+    return orders
+
+
+def encode_commands(encoding, orders):
+    """编码一条或多条指令；JSON/MessagePack 单条时编码为对象，多条时编码为数组"""
+    if encoding == "struct":
+        return b"".join(
+            COMMAND_STRUCT.pack(order["order_id"], order["table_number"], bool(order.get("need_ice")),
+                                order.get("coffee_type", "").encode("utf-8")[:COFFEE_TYPE_SIZE])
+            for order in orders
+        )
+    data = orders[0] if len(orders) == 1 else list(orders)
+    if encoding == "msgpack":
+        _require_msgpack()
+        return msgpack.packb(data)
+    return json.dumps(data)
+
+
+def decode_statuses(encoding, payload):
+    """解码状态消息，返回状态字典列表"""
+    if encoding == "struct":
+        return [
+            {"order_id": order_id, "status": STATUS_NAMES.get(code, str(code)), "table_number": table_number}
+            for order_id, table_number, code in _unpack_records(STATUS_STRUCT, payload)
+        ]
+    return decode_commands(encoding, payload)
+
+
+def encode_statuses(encoding, statuses):
+    """编码一条或多条状态"""
+    if encoding == "struct":
+        return b"".join(
+            STATUS_STRUCT.pack(s["order_id"], s["table_number"], STATUS_CODES[s["status"]])
+            for s in statuses
+        )
+    data = statuses[0] if len(statuses) == 1 else list(statuses)
+    if encoding == "msgpack":
+        _require_msgpack()
+        return msgpack.packb(data)
+    return json.dumps(data)
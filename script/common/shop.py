@@ -0,0 +1,39 @@
+'''
+多门店分片：按 SHOP_ID 划分端口、MQTT 话题、状态文件与订单行
+- 每家门店运行自己的一组模拟器、网关与流水线，只处理 orders 表中 shop_id 等于本店的订单，
+  门店之间不共享设备与队列，可以分布在不同机器上各自扩展
+- SHOP_ID 缺省为 1，门店 1 的端口、话题与文件名与单店部署完全相同
+- 端口：未显式设置 GRINDER_PORT 等环境变量时，默认端口加上 (SHOP_ID - 1) * SHOP_PORT_STRIDE（默认 1000），
+  同一台机器上的多家门店互不冲突，例如门店 2 的磨粉机/咖啡机/制冰机为 1502/9888/1102
+- 话题：门店 1 为 test/delivery_robot/...，其他门店为 shop/<SHOP_ID>/delivery_robot/...，机器人的 MQTT 客户端 ID 也带门店后缀，可共用一个 Broker
+- 状态与就绪文件：其他门店的文件名带 -shop<SHOP_ID> 后缀，可共用 SIM_STATE_DIR / SIM_READY_DIR
+用法：
+    SHOP_ID=2 python script/all_in_one/smartshop_sim.py all
+    SHOP_ID=2 python script/pipeline_demo/send_order.py
+'''
+import os
+
+DEFAULT_SHOP = 1
+SHOP_ID = int(os.getenv("SHOP_ID", str(DEFAULT_SHOP)))
+PORT_STRIDE = int(os.getenv("SHOP_PORT_STRIDE", "1000"))
+
+if SHOP_ID < 1:
+    raise ValueError(f"SHOP_ID 必须为正整数: {SHOP_ID}")
+
+
+def shop_port(env_name, base, shop_id=SHOP_ID):
+    """环境变量 env_name 显式设置时使用其值，否则为门店偏移后的默认端口"""
+    value = os.getenv(env_name)
+    if value:
+        return int(value)
+    return base + (shop_id - DEFAULT_SHOP) * PORT_STRIDE
+
+
+def topic_prefix(shop_id=SHOP_ID):
+    """MQTT 话题前缀"""
+    return "test" if shop_id == DEFAULT_SHOP else f"shop/{shop_id}"
+
+
+def scoped(name, shop_id=SHOP_ID):
+    """状态、就绪文件等按门店区分的名称"""
+    return name if shop_id == DEFAULT_SHOP else f"{name}-shop{shop_id}"
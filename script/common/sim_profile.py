@@ -0,0 +1,162 @@
+'''
+模拟器的时延、抖动与故障注入配置
+- SIM_PROFILE=<json文件> 指定配置文件，SIM_SEED=<整数> 指定随机种子（优先于文件中的 seed）
+- 每台设备的每种操作、丢弃与故障判定各自使用独立的随机数流（由种子、设备名与流名派生），
+  相同种子与相同的指令序列产生相同的时间线，增加一种操作或开启故障注入不会影响其他流的取值
+- 操作名可带子类，例如 "make:LATTE"：配置了子类时使用子类，否则使用 "make"，都未配置时使用模拟器中的默认模型
+- 未配置时保持各模拟器原有的固定/均匀分布服务时间，不注入延迟与故障
+
+配置文件示例（所有字段可选）：
+{
+  "seed": 42,
+  "grinder": {
+    "service_time": {"grind": {"dist": "lognormal", "median": 5, "sigma": 0.4}},
+    "connection_delay": {"dist": "uniform", "low": 0, "high": 0.05},
+    "drop_rate": 0.01,
+    "fault_rate": 0.02,
+    "fault_duration": 3
+  }
+}
+
+分布写法：
+- 数字                                                固定值
+- {"dist": "fixed", "value": v}                       固定值
+- {"dist": "uniform", "low": a, "high": b}            连续均匀分布
+- {"dist": "randint", "low": a, "high": b}            整数均匀分布（原模拟器的 random.randint）
+- {"dist": "exponential", "mean": m}                  指数分布
+- {"dist": "lognormal", "median": m, "sigma": s}      对数正态分布
+- {"dist": "pareto", "scale": xm, "alpha": a}         帕累托重尾分布
+任意分布都可加 "max": 上限（秒），用于截断重尾
+'''
+import json
+import math
+import os
+import random
+import threading
+
+PROFILE_FILE = os.getenv("SIM_PROFILE", "")
+SEED = os.getenv("SIM_SEED", "")
+
+
+class Distribution:
+    """按配置采样的一维分布"""
+    def __init__(self, spec):
+        if isinstance(spec, (int, float)):
+            spec = {"dist": "fixed", "value": spec}
+        self.spec = spec
+        self.kind = spec.get("dist", "fixed")
+        self.cap = spec.get("max")
+        if self.kind not in ("fixed", "uniform", "randint", "exponential", "lognormal", "pareto"):
+            raise ValueError(f"未知分布类型: {self.kind}")
+
+    def sample(self, rng):
+        spec = self.spec
+        if self.kind == "fixed":
+            value = spec["value"]
+        elif self.kind == "uniform":
+            value = rng.uniform(spec["low"], spec["high"])
+        elif self.kind == "randint":
+            value = rng.randint(spec["low"], spec["high"])
+        elif self.kind == "exponential":
+            value = rng.expovariate(1.0 / spec["mean"])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(spec["median"]), spec["sigma"])
+        else:
+            value = spec["scale"] * rng.paretovariate(spec["alpha"])
+        if self.cap is not None:
+            value = min(value, self.cap)
+        return value
+
+    def mean(self):
+        """分布的期望（用于估算排队时间）；有上限时按上限截断，重尾分布期望不存在时返回上限或 inf"""
+        spec = self.spec
+        if self.kind == "fixed":
+            value = spec["value"]
+        elif self.kind in ("uniform", "randint"):
+            value = (spec["low"] + spec["high"]) / 2
+        elif self.kind == "exponential":
+            value = spec["mean"]
+        elif self.kind == "lognormal":
+            value = spec["median"] * math.exp(spec["sigma"] ** 2 / 2)
+        else:
+            value = spec["scale"] * spec["alpha"] / (spec["alpha"] - 1) if spec["alpha"] > 1 else math.inf
+        if self.cap is not None:
+            value = min(value, self.cap)
+        return value
+
+
+class DeviceProfile:
+    """
+    单台设备的时延/故障配置
+    输入：name (str) - 设备名，对应配置文件中的键，例如 "grinder"
+         spec (dict) - 该设备的配置
+         seed - 全局种子，None 表示不固定
+    """
+    def __init__(self, name, spec=None, seed=None):
+        spec = spec or {}
+        self.name = name
+        self.seed = seed
+        self.streams = {}
+        self.streams_lock = threading.Lock()
+        self.service_times = {op: Distribution(s) for op, s in spec.get("service_time", {}).items()}
+        self.connection_delay_dist = Distribution(spec["connection_delay"]) if "connection_delay" in spec else None
+        self.drop_rate = float(spec.get("drop_rate", 0))
+        self.fault_rate = float(spec.get("fault_rate", 0))
+        self.fault_duration_dist = Distribution(spec.get("fault_duration", 3))
+
+    def stream(self, name):
+        """按名称获取独立的随机数流，由全局种子、设备名与流名派生；未设置种子时不固定"""
+        rng = self.streams.get(name)
+        if rng is None:
+            with self.streams_lock:
+                rng = self.streams.get(name)
+                if rng is None:
+                    seed = f"{self.seed}:{self.name}:{name}" if self.seed is not None else None
+                    rng = self.streams[name] = random.Random(seed)
+        return rng
+
+    def service_time(self, op, default):
+        """
+        采样一次操作的服务时间（秒）
+        输入：op (str) - 操作名，例如 "grind"、"make:LATTE"（冒号前为操作族）
+             default - 未配置时使用的分布（模拟器中的默认模型）
+        """
+        return self.service_dist(op, default).sample(self.stream(op))
+
+    def mean_service_time(self, op, default):
+        """一次操作服务时间的期望（秒），配置解析方式同 service_time，不消耗随机数"""
+        return self.service_dist(op, default).mean()
+
+    def service_dist(self, op, default):
+        dist = self.service_times.get(op)
+        if dist is None:
+            family = op.split(":", 1)[0]
+            dist = self.service_times[op] = self.service_times.get(family) or Distribution(default)
+        return dist
+
+    def connection_delay(self):
+        """每个请求的连接级延迟（秒），未配置时为 0"""
+        if self.connection_delay_dist is None:
+            return 0
+        return self.connection_delay_dist.sample(self.stream("connection_delay"))
+
+    def drop(self):
+        """本次请求是否丢弃响应"""
+        return self.drop_rate > 0 and self.stream("drop").random() < self.drop_rate
+
+    def fault(self):
+        """本次操作是否发生瞬时故障，返回故障持续时间（秒），0 表示无故障"""
+        rng = self.stream("fault")
+        if self.fault_rate > 0 and rng.random() < self.fault_rate:
+            return self.fault_duration_dist.sample(rng)
+        return 0
+
+
+def load_profile(name):
+    """读取 SIM_PROFILE 中指定设备的配置，文件缺失或未设置时返回默认配置"""
+    config = {}
+    if PROFILE_FILE:
+        with open(PROFILE_FILE, encoding="utf-8") as f:
+            config = json.load(f)
+    seed = SEED if SEED else config.get("seed")
+    return DeviceProfile(name, config.get(name), seed)
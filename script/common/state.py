@@ -0,0 +1,125 @@
+'''
+模拟器设备状态的内存映射持久化
+- 设置 SIM_STATE_DIR=<目录> 后，每台设备的状态保存在 <目录>/<设备名>.state（门店 1 以外带 -shop<SHOP_ID> 后缀），重启后从上次一致的状态继续
+- 未设置时使用匿名内存映射，行为与原模拟器一致（每次启动恢复出厂状态）
+- 状态是固定的一组整数字段，直接 pack 到映射内存中，没有额外的序列化步骤
+
+文件布局（小端）：
+| 偏移 | 类型     | 描述 |
+|------|----------|------|
+| 0    | 4s       | 魔数 b"SIMS" |
+| 4    | uint32   | 字段布局校验（字段名的 CRC32），字段变化后旧文件作废 |
+| 8    | 槽 A     | uint32 提交序号 + uint32 CRC32 + N 个 int64 字段值 |
+| ...  | 槽 B     | 同槽 A |
+每次更新写入较旧的槽并最后写入其序号与校验，进程在写入中途被杀死时另一个槽仍然完整；
+加载时选择校验通过且序号最大的槽
+'''
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from common.shop import scoped
+
+STATE_DIR = os.getenv("SIM_STATE_DIR", "")
+
+MAGIC = b"SIMS"
+FILE_HEADER = struct.Struct("<4sI")
+SLOT_HEADER = struct.Struct("<II")
+
+
+class DeviceState:
+    """
+    一台设备的持久化状态
+    输入：name (str) - 设备名，决定文件名
+         defaults (dict) - 字段名 -> 出厂默认值（整数），字段顺序即存储顺序
+         path (str) - 状态文件路径，None 表示不持久化
+    """
+    def __init__(self, name, defaults, path=None):
+        self.name = name
+        self.fields = list(defaults)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.values_struct = struct.Struct(f"<{len(self.fields)}q")
+        self.slot_size = SLOT_HEADER.size + self.values_struct.size
+        self.layout = zlib.crc32(",".join(self.fields).encode("utf-8"))
+        self.path = path
+        self.lock = threading.Lock()
+
+        size = FILE_HEADER.size + 2 * self.slot_size
+        if path:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, size)
+            self.mm = mmap.mmap(self.fd, size)
+        else:
+            self.fd = None
+            self.mm = mmap.mmap(-1, size)
+
+        self.seq, self.slot, values = self._load()
+        self.restored = values is not None
+        if values is None:
+            values = [int(defaults[field]) for field in self.fields]
+            FILE_HEADER.pack_into(self.mm, 0, MAGIC, self.layout)
+            self.seq, self.slot = 0, 1
+            self._commit(values)
+        self.values = values
+
+    def _slot_offset(self, slot):
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def _load(self):
+        """返回 (序号, 槽号, 字段值)，没有可用状态时字段值为 None"""
+        magic, layout = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or layout != self.layout:
+            return 0, 1, None
+        best = (0, 1, None)
+        for slot in (0, 1):
+            offset = self._slot_offset(slot)
+            seq, crc = SLOT_HEADER.unpack_from(self.mm, offset)
+            body = self.mm[offset + SLOT_HEADER.size:offset + self.slot_size]
+            if seq and crc == zlib.crc32(body) and seq > best[0]:
+                best = (seq, slot, list(self.values_struct.unpack(body)))
+        return best
+
+    def _commit(self, values):
+        # 先写字段值，再写序号与校验，切换到另一个槽完成提交
+        slot = 1 - self.slot
+        offset = self._slot_offset(slot)
+        self.values_struct.pack_into(self.mm, offset + SLOT_HEADER.size, *values)
+        body = self.mm[offset + SLOT_HEADER.size:offset + self.slot_size]
+        self.seq += 1
+        SLOT_HEADER.pack_into(self.mm, offset, self.seq, zlib.crc32(body))
+        self.slot = slot
+
+    def __getitem__(self, field):
+        return self.values[self.index[field]]
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.values))
+
+    def update(self, values=None, **kwargs):
+        """原子地更新一个或多个字段，可传入字典或关键字参数"""
+        changes = dict(values or {}, **kwargs)
+        with self.lock:
+            new_values = list(self.values)
+            for field, value in changes.items():
+                new_values[self.index[field]] = int(value)
+            if new_values == self.values:
+                return
+            self._commit(new_values)
+            self.values = new_values
+
+    def close(self):
+        self.mm.close()
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+def load_state(name, defaults):
+    """按 SIM_STATE_DIR 打开设备状态文件，未设置时返回不持久化的状态"""
+    path = None
+    if STATE_DIR:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        path = os.path.join(STATE_DIR, f"{scoped(name)}.state")
+    return DeviceState(name, defaults, path)
@@ -0,0 +1,12 @@
+'''
+压测、剖析与统计脚本共用的统计函数
+'''
+import math
+
+
+def percentile(values, q):
+    """最近秩法分位数，q 为 0~100，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
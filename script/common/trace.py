@@ -0,0 +1,82 @@
+'''
+按订单关联的设备操作区间（span）记录
+- 网关在指令中携带订单号（trace），各模拟器在设置 SIM_TRACE_FILE=<路径> 后把每次操作的开始/结束时间追加写入该文件
+- 每行一个 JSON 对象，使用 O_APPEND 一次 write 写入，多线程/多进程可共用同一文件
+- 未设置时 get_tracer() 返回 None，模拟器不做任何额外工作
+- trace_timeline.py 读取一个或多个文件，按订单拼接各设备的时间线
+
+各协议携带订单号的方式：
+| 设备   | 方式 |
+|--------|------|
+| 磨粉机 | 在同一连接上先写 TRACE_ID_REG=12~13（高 16 位在前），再写 CMD_REG 或命令信箱 |
+| 咖啡机 | MAKE:<咖啡类型>:<订单号>、REFILL:<原料>:<订单号> |
+| 制冰机 | 先写 DB1 第 12~15 字节的 DWORD（大端无符号 32 位），再写指令 |
+| 机器人 | 指令中的 order_id |
+
+记录格式：{"trace": 订单号, "device": 设备名, "span": 操作名, "start": 开始时间, "end": 结束时间, ...附加字段}
+时间为 Unix 时间戳（秒），不同机器上的模拟器需要时钟同步
+'''
+import json
+import os
+import threading
+import time
+
+TRACE_FILE = os.getenv("SIM_TRACE_FILE", "")
+MAX_TRACE_ID = 0xFFFFFFFF   # 寄存器/DB1 中的订单号为 32 位无符号整数
+
+
+def parse_trace_id(text):
+    """解析报文中的订单号，空字符串返回 0（未携带），格式错误抛出 ValueError"""
+    if not text:
+        return 0
+    trace_id = int(text)
+    if not 0 <= trace_id <= MAX_TRACE_ID:
+        raise ValueError(text)
+    return trace_id
+
+
+class Tracer:
+    """追加写入 span 文件，span 可在任意线程调用"""
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.count = 0
+
+    def span(self, trace_id, device, name, start, end=None, **fields):
+        """记录一个区间，end 缺省为当前时间；trace_id 为 0 表示未携带订单号，不记录"""
+        if not trace_id:
+            return
+        line = json.dumps({"trace": trace_id, "device": device, "span": name, "start": start,
+                           "end": time.time() if end is None else end, **fields}, ensure_ascii=False)
+        os.write(self.fd, (line + "\n").encode("utf-8"))
+        self.count += 1
+
+    def close(self):
+        os.close(self.fd)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """未设置 SIM_TRACE_FILE 时返回 None；同一进程中的所有设备共享一个 Tracer"""
+    global _tracer
+    if not TRACE_FILE:
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(TRACE_FILE)
+    return _tracer
+
+
+def read_spans(path):
+    """逐条读取 span 文件，无法解析的行（例如进程被强制结束时写了一半）会被跳过"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(span, dict) and {"trace", "device", "span", "start", "end"} <= span.keys():
+                yield span
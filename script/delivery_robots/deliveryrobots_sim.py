@@ -4,46 +4,216 @@ Last-modified: 2025-09-18
 Used to simulate the delivery robots, using MQTT messages
 '''
 import paho.mqtt.client as mqtt
+import sys
 import time
-import json
 import logging
 import os
-from colorlog import ColoredFormatter
-import random
-
-# ---------------- 设置logger格式
-logger = logging.getLogger("delivery_robot")
-logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-formatter = ColoredFormatter(
-    "%(log_color)s%(asctime)s %(levelname)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red,bg_white',
-    },
-)
-handler.setFormatter(formatter)
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+# 共享模块位于 script/common（容器内与脚本位于同一目录）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger, request_gate
+from common import record
+from common.sim_profile import load_profile
+from common import robot_codec
+from common import ready
+from common.trace import get_tracer
+from common.profiling import get_profiler
+from common.shop import scoped, topic_prefix
+
+# ---------------- 设置logger，格式化与输出在后台线程完成
+logger = get_logger("delivery_robot")
+# 每条消息都会触发的日志经过采样/限流闸门
+request_log = request_gate(logger, logging.INFO)
+# 设置了 SIM_RECORD_FILE 时录制所有收到的指令
+recorder = record.get_recorder()
+# 服务时间、连接延迟与故障注入配置，见 SIM_PROFILE / SIM_SEED
+profile = load_profile("robot")
+# 设置了 SIM_TRACE_FILE 时按 order_id 记录排队与配送区间
+tracer = get_tracer()
+# SIGUSR1 / SIM_PROF 开启性能剖析时记录每条消息的处理耗时，见 common/profiling.py
+profiler = get_profiler()
 
 # ---------------- 配置服务器
 # 在容器网络中应使用服务名访问Broker，支持环境变量覆盖
 # 本地运行默认使用 localhost，避免未设置环境变量时的连接失败
 MQTT_BROKER_HOST = os.getenv("MQTT_HOST", "localhost")
 MQTT_BROKER_PORT = int(os.getenv("MQTT_PORT", "1883"))
-COMMAND_TOPIC = "test/delivery_robot/command"   # 命令话题，用于接收订单指令
-STATUS_TOPIC = "test/delivery_robot/status"     # 状态话题，用于发送配送状态
+BROKER_WAIT = float(os.getenv("MQTT_WAIT", "10"))  # 启动时等待 Broker 端口可连接的最长时间（秒）
+# 话题按门店区分，多家门店可共用一个 Broker（见 common/shop.py）
+COMMAND_TOPIC = f"{topic_prefix()}/delivery_robot/command"   # 命令话题，用于接收订单指令
+STATUS_TOPIC = f"{topic_prefix()}/delivery_robot/status"     # 状态话题，用于发送配送状态
+
+# 配送各阶段时间模型（秒），SIM_PROFILE 中同名操作可覆盖；离线容量仿真复用这些参数
+LEG_TIMES = {
+    "to_pickup": {"dist": "randint", "low": 2, "high": 4},
+    "to_table": {"dist": "randint", "low": 3, "high": 5},
+    "return": {"dist": "randint", "low": 2, "high": 5},
+}
+# 预计单次配送耗时（秒）的初值，取各阶段服务时间的期望之和；之后按实际耗时滑动平均，用于估算排队订单的开始时间
+DELIVERY_ESTIMATE = sum(profile.mean_service_time(leg, spec) for leg, spec in LEG_TIMES.items())
+ESTIMATE_WEIGHT = 0.2   # 滑动平均中最新一次配送的权重
+# 重复指令抑制：排队或配送中的订单一直保留；完成的订单记住其最终状态，超过条数上限淘汰最久未访问的（重复指令也算访问），有效期内未被访问的视为新订单
+DEDUP_SIZE = int(os.getenv("ROBOT_DEDUP_SIZE", "4096"))
+DEDUP_TTL = float(os.getenv("ROBOT_DEDUP_TTL", "600"))
 
 
 # -----------------------------------------------------
 # MQTT 通信逻辑
-# 命令话题输入 ： {"order_id": <订单号>, "coffee_type": <咖啡类型>, "need_ice": <是否需要冰>, "table_number": <桌号>}
-# 状态话题输出 ： {"order_id": <订单号>, "status": <配送状态>, "table_number": <桌号>}
+# 命令话题输入 ： {"order_id": <订单号>, "coffee_type": <咖啡类型>, "need_ice": <是否需要冰>, "table_number": <桌号>,
+#                 "priority": <可选，优先级，越大越先配送，默认 0>, "deadline": <可选，截止时间，Unix 时间戳（秒）>}
+# 状态话题输出 ： {"order_id": <订单号>, "status": <配送状态>, "table_number": <桌号>,
+#                 "queue_depth": <发送时排队中的订单数>, "expected_start": <仅 RECEIVED，预计开始配送的 Unix 时间戳>,
+#                 "suppressed": <启动以来抑制的重复指令数>}
 # 输入和输出都使用 json格式
+# 收到指令后立即确认并放入调度队列，由配送线程逐单执行：优先级高者先配送，同优先级截止时间早者先配送
+# （未给截止时间的排在后面），其余按到达顺序；网关可根据排队数与预计开始时间提前分流或放弃订单
+# 紧凑编码与批量（见 script/common/robot_codec.py）：
+#   command/msgpack、command/struct 话题分别使用 MessagePack 与定长二进制，状态回复到 status/msgpack、status/struct
+#   一条消息可携带多条订单（数组或拼接的记录），整批的接收确认合并为一条状态消息
+#   定长二进制没有 priority/deadline/queue_depth/expected_start 字段，按默认优先级排队
+# 重复指令：QoS 1 的重投（重连、未收到 PUBACK）与网关超时重试会再次送来同一 order_id，
+#   排队或配送中的订单以及有效期内完成的订单不再配送，而是回复该订单最近一次的状态（RECEIVED 或最终状态），JSON/MessagePack 中带 "duplicate": true；
+#   未携带订单号（缺省或为 0）的指令不做去重
 # -----------------------------------------------------
 
+# ---------------- 调度队列
+class DispatchQueue:
+    """
+    待配送订单的优先队列，收到指令的线程入队，配送线程出队
+    元素为 (排序键, 订单, 回复状态所需的信息)，排序键见 dispatch_key
+    """
+    def __init__(self, estimate=DELIVERY_ESTIMATE):
+        self.heap = []
+        self.arrivals = itertools.count()
+        self.cond = threading.Condition()
+        self.estimate = estimate        # 预计单次配送耗时（秒）
+        self.busy_until = None          # 正在进行的配送的预计结束时间，空闲时为 None
+
+    def __len__(self):
+        with self.cond:
+            return len(self.heap)
+
+    def push(self, orders, reply):
+        """
+        一批订单共用同一回复信息入队，返回入队后的 (排队数, 各订单的预计开始时间 {id(订单): 时间戳})
+        整批入队后只估算一次开始时间，避免每单都对整个队列排序
+        """
+        with self.cond:
+            for order_details in orders:
+                heapq.heappush(self.heap, (dispatch_key(order_details, next(self.arrivals)), order_details, reply))
+            self.cond.notify(len(orders))
+            return len(self.heap), self.expected_starts()
+
+    def pop(self):
+        """阻塞直到有订单，取出排在最前的一单并标记为配送中"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.heap)
+            _, order_details, reply = heapq.heappop(self.heap)
+            self.busy_until = time.time() + self.estimate
+            return order_details, reply
+
+    def done(self, duration):
+        """一单配送结束，按实际耗时更新预计配送耗时"""
+        with self.cond:
+            self.estimate += ESTIMATE_WEIGHT * (duration - self.estimate)
+            self.busy_until = None
+
+    def expected_starts(self):
+        """按当前排序估算每个排队订单的开始时间（需持有 cond）"""
+        now = time.time()
+        start = max(now, self.busy_until) if self.busy_until is not None else now
+        return {id(order_details): start + k * self.estimate
+                for k, (_, order_details, _) in enumerate(sorted(self.heap, key=lambda item: item[0]))}
+
+
+def dispatch_key(order_details, arrival):
+    """排序键：(-优先级, 是否没有截止时间, 截止时间, 到达序号)；字段无效时按缺省处理"""
+    try:
+        priority = float(order_details.get("priority") or 0)
+    except (TypeError, ValueError):
+        logger.warning("订单 %s 的优先级无效: %r", order_details.get("order_id", "N/A"), order_details.get("priority"))
+        priority = 0
+    try:
+        deadline = float(order_details["deadline"]) if order_details.get("deadline") is not None else None
+    except (TypeError, ValueError):
+        logger.warning("订单 %s 的截止时间无效: %r", order_details.get("order_id", "N/A"), order_details.get("deadline"))
+        deadline = None
+    return (-priority, deadline is None, deadline or 0.0, arrival)
+
+
+dispatcher = DispatchQueue()
+
+
+# ---------------- 重复指令抑制
+class RecentOrders:
+    """
+    重复指令抑制：未完成订单的订单号 -> 状态，以及已完成订单的有界 LRU（条目在 ttl 秒内没有被访问即过期）
+    claim 在收到指令时登记订单，已登记则返回其最新状态并计入 suppressed；配送线程用 finish 写入最终状态，
+    此后订单才进入 LRU，排队或配送中的订单不会因过期或淘汰而被再次执行；
+    重复指令命中 LRU 时刷新该条目，超过条数上限时淘汰最久未访问的订单
+    """
+    def __init__(self, size=DEDUP_SIZE, ttl=DEDUP_TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.active = {}                # 排队或配送中的订单号 -> 状态
+        self.entries = OrderedDict()    # 已完成的订单号 -> (访问时间, 最终状态)，按访问时间从旧到新
+        self.lock = threading.Lock()
+        self.suppressed = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.active) + len(self.entries)
+
+    def _expire(self, now):
+        while self.entries:
+            updated, _ = next(iter(self.entries.values()))
+            if now - updated < self.ttl and len(self.entries) <= self.size:
+                break
+            self.entries.popitem(last=False)
+
+    def claim(self, order_id, status):
+        """新订单登记为 status 并返回 None；有效期内的重复订单返回最近一次的状态"""
+        now = self.clock()
+        with self.lock:
+            self._expire(now)
+            if order_id in self.active:
+                self.suppressed += 1
+                return self.active[order_id]
+            if order_id in self.entries:
+                self.suppressed += 1
+                status = self.entries[order_id][1]
+                # 刷新访问时间并移到末尾，保持按访问时间排序
+                self.entries[order_id] = (now, status)
+                self.entries.move_to_end(order_id)
+                return status
+            self.active[order_id] = status
+            return None
+
+    def finish(self, order_id, status):
+        """订单配送结束，记住最终状态 ttl 秒"""
+        now = self.clock()
+        with self.lock:
+            self.active.pop(order_id, None)
+            self.entries.pop(order_id, None)
+            self.entries[order_id] = (now, status)
+            self._expire(now)
+
+
+def dedup_key(order_details):
+    """去重使用的订单号，未携带订单号时返回 None"""
+    order_id = order_details.get("order_id")
+    if order_id is None or order_id == 0 or order_id == "N/A":
+        return None
+    return str(order_id)
+
+
+recent_orders = RecentOrders()
+
 # ---------------- 模拟配送
 def simulate_delivery(table_number: int):
     """
@@ -55,19 +225,78 @@ def simulate_delivery(table_number: int):
     destination_table = f"Table{table_number}"
 
 
-    # 开始模拟配送过程
-    logging.info(f"收到任务：配送到 {destination_table}")
-    logging.info(f"- 正在前往取餐点 ...")
-    time.sleep(random.randint(2,4))
-    logging.info(f"-已取到 咖啡")
-    logging.info(f"-正在前往 {destination_table} 号桌 ...")    
-    time.sleep(random.randint(3,5))
-    logging.info(f"-已送达 咖啡 到 {destination_table} 号桌")
-    logging.info(f"-配送完成, 正在返回...")
-    time.sleep(random.randint(2,5))
-    logging.info(f"已返回, 进入待命状态")
+    # 开始模拟配送过程，整次配送只判断一次是否输出日志
+    verbose = request_log()
+    if verbose:
+        logger.info("收到任务：配送到 %s", destination_table)
+        logger.info("- 正在前往取餐点 ...")
+    time.sleep(profile.service_time("to_pickup", LEG_TIMES["to_pickup"]))
+    fault_duration = profile.fault()
+    if fault_duration:
+        # 注入瞬时故障：机器人停滞一段时间后放弃本次配送
+        logger.warning("配送到 %s 时发生瞬时故障", destination_table)
+        time.sleep(fault_duration)
+        return "Failed"
+    if verbose:
+        logger.info("-已取到 咖啡")
+        logger.info("-正在前往 %s 号桌 ...", destination_table)
+    time.sleep(profile.service_time("to_table", LEG_TIMES["to_table"]))
+    if verbose:
+        logger.info("-已送达 咖啡 到 %s 号桌", destination_table)
+        logger.info("-配送完成, 正在返回...")
+    time.sleep(profile.service_time("return", LEG_TIMES["return"]))
+    if verbose:
+        logger.info("已返回, 进入待命状态")
     return "Done"
 
+def trace_delivery(order_details, received_at, start, status):
+    """记录一单的排队（收到指令到开始配送）与配送区间，order_id 不是整数时不记录"""
+    try:
+        trace_id = int(order_details.get("order_id"))
+    except (TypeError, ValueError):
+        return
+    tracer.span(trace_id, "robot", "robot_queue", received_at, start)
+    tracer.span(trace_id, "robot", "deliver", start, table=order_details.get("table_number"),
+                result="done" if status == "Done" else "failed")
+
+def delivery_worker(client):
+    """配送线程：按调度队列的顺序逐单配送，每单完成后发送最终状态"""
+    while True:
+        order_details, (encoding, status_topic, received_at) = dispatcher.pop()
+        try:
+            start = time.time()
+            deadline = order_details.get("deadline")
+            if isinstance(deadline, (int, float)) and start > deadline:
+                logger.warning("订单 %s 开始配送时已超过截止时间 %.1f s", order_details.get("order_id", "N/A"), start - deadline)
+            try:
+                status = simulate_delivery(order_details.get("table_number", 0))
+            finally:
+                # 配送异常时同样结束配送中状态，避免预计开始时间一直按过期的 busy_until 计算
+                dispatcher.done(time.time() - start)
+            if tracer:
+                trace_delivery(order_details, received_at, start, status)
+            final_result = "DELIVERY_COMPLETE" if status == "Done" else "DELIVERY_FAILED"
+            final_status = {
+                "order_id": order_details.get("order_id", "N/A"),
+                "status": final_result,
+                "table_number": order_details.get("table_number", "N/A"),
+            }
+            key = dedup_key(order_details)
+            if key is not None:
+                recent_orders.finish(key, final_status)
+            final_payload = robot_codec.encode_statuses(encoding, [dict(final_status, queue_depth=len(dispatcher),
+                                                                        suppressed=recent_orders.suppressed)])
+            client.publish(status_topic, final_payload, qos=1)
+            if request_log():
+                logger.info("订单 %s 配送结果 %s 已发送到话题 %s", order_details.get("order_id", "N/A"), final_result, status_topic)
+        except Exception as e:
+            logger.error(f"配送订单 {order_details.get('order_id', 'N/A')} 时发生错误: {e}")
+            key = dedup_key(order_details)
+            if key is not None:
+                # 未能完成的订单不再保留为配送中，重复指令收到失败状态
+                recent_orders.finish(key, {"order_id": order_details.get("order_id"), "status": "DELIVERY_FAILED",
+                                           "table_number": order_details.get("table_number", "N/A")})
+
 def on_connect(client, userdata, flags, rc, properties=None):
     '''
     连接到MQTT代理时的回调函数
@@ -76,72 +305,117 @@ def on_connect(client, userdata, flags, rc, properties=None):
     rc=1,代表连接失败, 服务器拒绝连接
     '''
     if rc == 0:
-        logging.info("已成功连接到MQTT代理")
-        client.subscribe(COMMAND_TOPIC, qos=1)
+        logger.info("已成功连接到MQTT代理")
+        client.subscribe([(COMMAND_TOPIC, 1), (COMMAND_TOPIC + "/+", 1)])
     else:
-        logging.error(f"连接失败, 错误码: {rc}")
+        logger.error(f"连接失败, 错误码: {rc}")
+
+def on_subscribe(client, userdata, mid, reason_codes, properties=None):
+    '''
+    订阅完成的回调函数，此时才能收到配送指令
+    '''
+    ready.ready("robot")
 
 def on_message(client, userdata, msg):
     '''
     当客户端收到MQTT消息时的回调函数
     当客户端订阅的话题收到消息时调用
     '''
+    received_at = time.time()
+    t0 = time.perf_counter() if profiler.on else 0
     try:
-        # 从消息中解码收到的信息
-        payload_str = msg.payload.decode('utf-8')
-        logging.info(f"从话题 {msg.topic} 收到消息: {payload_str}")
+        if recorder:
+            recorder.write(record.DEVICE_ROBOT, record.OP_MQTT_MESSAGE, 0, record.encode_mqtt(msg.topic, msg.payload))
+        # 按话题确定编码，解码出本条消息携带的全部订单
+        encoding = robot_codec.topic_encoding(msg.topic, COMMAND_TOPIC)
+        status_topic = robot_codec.encoding_topic(STATUS_TOPIC, encoding)
+        if request_log():
+            logger.info("从话题 %s 收到消息: %r", msg.topic, msg.payload)
+        orders = robot_codec.decode_commands(encoding, msg.payload)
 
-        # 解析订单详情
-        order_details = json.loads(payload_str)
+        accepted, duplicates = [], []
+        for order_details in orders:
+            if profile.drop():
+                # 注入丢弃：不确认也不执行本条指令
+                logger.warning("丢弃订单 %s", order_details.get("order_id", "N/A"))
+                continue
+            key = dedup_key(order_details)
+            if key is not None:
+                last_status = recent_orders.claim(key, {
+                    "order_id": order_details.get("order_id"),
+                    "status": "RECEIVED",
+                    "table_number": order_details.get("table_number", "N/A"),
+                })
+                if last_status is not None:
+                    # 重投或重试：不再配送，回复最近一次的状态
+                    logger.warning("订单 %s 重复，回复状态 %s（累计抑制 %d 条重复指令）", order_details.get("order_id"),
+                                   last_status["status"], recent_orders.suppressed)
+                    duplicates.append(last_status)
+                    continue
+            accepted.append(order_details)
+        if not accepted and not duplicates:
+            return
+        delay = profile.connection_delay()
+        if delay:
+            time.sleep(delay)
 
-        # 立即发送接收确认，便于上游快速得到ACK
-        ack_payload = json.dumps({
+        # 放入调度队列后立即发送接收确认，确认中带上排队数与预计开始时间；整批订单与重复订单的状态合并为一条确认
+        if accepted:
+            depth, expected = dispatcher.push(accepted, (encoding, status_topic, received_at))
+        else:
+            depth, expected = len(dispatcher), {}
+        ack_payload = robot_codec.encode_statuses(encoding, [{
             "order_id": order_details.get("order_id", "N/A"),
             "status": "RECEIVED",
             "table_number": order_details.get("table_number", "N/A"),
-        })
-        client.publish(STATUS_TOPIC, ack_payload, qos=1)
-        logging.info(f"已发送接收确认到话题 {STATUS_TOPIC}: {ack_payload}")
-
-        # 开始模拟配送流程并在完成后发送最终状态
-        status = simulate_delivery(order_details.get("table_number", 0))
-        final_result = "DELIVERY_COMPLETE" if status == "Done" else "DELIVERY_FAILED"
-        final_payload = json.dumps({
-            "order_id": order_details.get("order_id", "N/A"),
-            "status": final_result,
-            "table_number": order_details.get("table_number", "N/A"),
-        })
-        client.publish(STATUS_TOPIC, final_payload, qos=1)
-        logging.info(f"已发送配送完成到话题 {STATUS_TOPIC}: {final_payload}")
-    
-    except json.JSONDecodeError:
-        logging.error(f"从话题 {msg.topic} 收到的消息不是有效的JSON格式: {payload_str}")
+            "queue_depth": depth,
+            "expected_start": round(expected.get(id(order_details), time.time()), 3),
+            "suppressed": recent_orders.suppressed,
+        } for order_details in accepted] + [
+            dict(last_status, duplicate=True, queue_depth=depth, suppressed=recent_orders.suppressed)
+            for last_status in duplicates
+        ])
+        client.publish(status_topic, ack_payload, qos=1)
+        if request_log():
+            logger.info("已发送 %d 条接收确认、%d 条重复订单状态到话题 %s，排队 %d 单", len(accepted), len(duplicates),
+                        status_topic, depth)
+
+    except ValueError as e:
+        # 包括 JSON/MessagePack 解析失败、二进制长度不正确、未知编码话题
+        logger.error(f"从话题 {msg.topic} 收到的消息无效: {e}")
     except Exception as e:
-        logging.error(f"处理消息时发生错误: {e}")
+        logger.error(f"处理消息时发生错误: {e}")
+    finally:
+        if t0:
+            profiler.record("robot.on_message", t0)
 
-def main():
+def run(host=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT):
+    """连接 MQTT Broker 并处理配送指令（阻塞）"""
     # 初始化MQTT客户端
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="delivery_robot_sim")
+    # 客户端 ID 按门店区分，共用一个 Broker 的多家门店不会互相挤掉连接
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=scoped("delivery_robot_sim"))
     client.on_connect = on_connect  # 连接成功回调
     client.on_message = on_message  # 收到消息回调
+    client.on_subscribe = on_subscribe  # 订阅完成后报告就绪
+    ready.starting("robot")
+    # 配送在独立线程中按调度队列执行，消息回调只负责确认与入队
+    threading.Thread(target=delivery_worker, args=(client,), name="robot-dispatch", daemon=True).start()
 
-    logging.info("正在连接到MQTT Broker...")
-    # 连接到MQTT代理，增加重试以等待Broker就绪
-    max_attempts = 5
-    for attempt in range(1, max_attempts + 1):
-        try:
-            client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
-            logging.info("已成功连接到MQTT Broker")
-            break
-        except Exception as e:
-            if attempt == max_attempts:
-                logging.error(f"连接MQTT Broker失败: {e}")
-                return
-            logging.warning(f"连接失败，第{attempt}次重试，原因: {e}")
-            time.sleep(2)
+    logger.info("正在连接到MQTT Broker...")
+    # 每 50 ms 探测一次 Broker 端口，端口可连接后立即连接，而不是固定间隔重试
+    try:
+        ready.wait_ready([f"tcp:{host}:{port}"], timeout=BROKER_WAIT)
+        client.connect(host, port, 60)
+        logger.info("已成功连接到MQTT Broker")
+    except Exception as e:
+        logger.error(f"连接MQTT Broker失败: {e}")
+        return
     
     # 保持连接并处理消息
     client.loop_forever()
 
+def main():
+    run()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
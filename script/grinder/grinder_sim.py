@@ -4,23 +4,71 @@ Last-modified: 2025-09-17
 Used to simulate the grinder, using modbus TCP
 '''
 
+import os
+import sys
 import time
-import random
-from pyModbusTCP.server import ModbusServer
-import logging
+import threading
+from collections import deque
+from pyModbusTCP.server import ModbusServer, DataHandler
+from pyModbusTCP.constants import EXP_NONE, EXP_DATA_VALUE, EXP_SLAVE_DEVICE_BUSY
 
-# 设置logging
-logging.basicConfig(
-	level = logging.DEBUG,
-	format = "%(asctime)s %(levelname)s %(message)s",
-	datefmt = "%Y-%m-%d %H:%M:%S",
-)
+# 共享模块位于 script/common（容器内与脚本位于同一目录）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+from common import record
+from common.sim_profile import load_profile
+from common.state import load_state
+from common import ready
+from common.modbus_async import AsyncModbusServer
+from common.trace import get_tracer
+from common.profiling import get_profiler
+from common.shop import shop_port
+
+# 设置logging，格式化与输出在后台线程完成
+logger = get_logger("grinder_sim")
+
+# 服务设置，端口支持环境变量覆盖，未设置时按 SHOP_ID 偏移（见 common/shop.py）
+HOST = "0.0.0.0"
+PORT = shop_port("GRINDER_PORT", 502)
+# Modbus 服务实现：threaded 为 pyModbusTCP 每连接一个线程，asyncio 为单线程事件循环（适合大量并发轮询）
+TRANSPORT = os.getenv("GRINDER_TRANSPORT", "threaded")
+server = None       # Modbus 服务实例，由 run() 创建
+# 服务时间、连接延迟与故障注入配置，见 SIM_PROFILE / SIM_SEED
+profile = load_profile("grinder")
+
+# 设备模型（离线容量仿真 script/capacity/shop_des.py 复用这些参数）
+GRIND_TIME = 5          # 每份磨粉时间（秒），SIM_PROFILE 中的 "grind"
+ADD_BEAN_TIME = 2       # 补豆时间（秒），SIM_PROFILE 中的 "add_bean"
+BEAN_USE = (5, 10)      # 每份消耗豆量范围
+MIN_BEAN_LEVEL = 10     # 低于该豆量无法磨粉
+FULL_BEAN_LEVEL = 100   # 补豆后的豆量
+
+# 豆量保存在内存映射文件中，设置 SIM_STATE_DIR 后重启可继续
+state = load_state("grinder", {"bean_level": FULL_BEAN_LEVEL})
 
 # 寄存器设置
 CMD_REG = 0         # command register
 STATUS_REG = 1      # status register
 BEAN_LEVEL_REG = 2  # bean level register
 ERROR_CODE_REG = 3  # error code register
+DOSE_COUNT_REG = 4  # dose count register
+DOSES_DONE_REG = 5  # completed dose counter
+MB_CMD_REG = 6          # mailbox command slot
+MB_DOSES_REG = 7        # mailbox dose count
+MB_SEQ_REG = 8          # mailbox sequence number, writing it submits the slot
+MB_ACK_SEQ_REG = 9      # last completed sequence number
+MB_QUEUE_LEN_REG = 10   # mailbox queue length
+MB_QUEUE_DEPTH_REG = 11 # mailbox queue capacity
+TRACE_ID_REG = 12       # order/trace id, 2 registers (high word first)
+MB_NEXT_SEQ_REG = 14    # reading it allocates a fresh mailbox sequence number
+MB_ACK_HISTORY_REG = 16 # recently completed sequence numbers, newest first
+MAILBOX_DEPTH = int(os.getenv("GRINDER_MAILBOX_DEPTH", "8"))
+MB_ACK_RESULT_REG = MB_ACK_HISTORY_REG + MAILBOX_DEPTH  # results of the completed commands, same order
+# 命令结果码，0~2 与 ERROR_CODE_REG 的取值一致
+RESULT_OK = 0
+RESULT_NO_BEANS = 1
+RESULT_FAULT = 2
+RESULT_DROPPED = 3      # 故障注入丢弃了该命令，未执行
 
 # ----------
 # CMD_REG 命令寄存器
@@ -37,68 +85,320 @@ ERROR_CODE_REG = 3  # error code register
 # 范围: 0 ~ 100
 # ----------
 # ERROR_CODE_REG 故障代码寄存器
+# 2: 瞬时故障（故障注入，持续一段时间后自动恢复）
 # 1: 咖啡豆不足
 # 0: 无故障
 # ----------
+# DOSE_COUNT_REG 本次磨粉份数
+# 写入 CMD_REG=1 前设置，N 表示连续磨 N 份；0 或 1 表示单份
+# 命令处理结束后重置为0
+# ----------
+# DOSES_DONE_REG 本次已完成份数
+# 每完成一份加1，新命令开始时清零
+# ----------
+# 命令信箱（与 CMD_REG 并存，命令不会被覆盖丢失）
+# MB_CMD_REG / MB_DOSES_REG / MB_SEQ_REG 组成一个命令槽，建议用一次写多个寄存器(FC16)写入 6~8
+#   写入非0的 MB_SEQ_REG 即提交：命令按先进先出排队执行，重复提交同一序号会被忽略
+#   序号应读取 MB_NEXT_SEQ_REG 获得：每次读取都由设备分配一个未被排队、执行中或最近完成的命令占用的序号，
+#   多个网关进程或网关重启后都不会与已有序号冲突（客户端自行编号时重复的序号会被当作已提交而忽略）
+#   队列已满时本次写入返回 Modbus 异常 0x06（设备忙），客户端可稍后重试
+#   MB_CMD_REG 取值同 CMD_REG（1: 磨粉，2: 补充豆子），MB_DOSES_REG 同 DOSE_COUNT_REG
+# MB_ACK_SEQ_REG      最近完成的命令序号
+# MB_QUEUE_LEN_REG    当前排队的命令数（不含正在执行的命令）
+# MB_QUEUE_DEPTH_REG  队列容量，默认 8，可用 GRINDER_MAILBOX_DEPTH 设置
+# MB_NEXT_SEQ_REG     读取时分配一个新序号（读取范围包含该寄存器即分配，请单独读取）
+# MB_ACK_HISTORY_REG  起始的 MAILBOX_DEPTH 个寄存器，最近完成的序号（最新在前），
+#                     并发客户端在其中找到自己的序号即表示命令已执行结束
+# MB_ACK_RESULT_REG   紧随其后的 MAILBOX_DEPTH 个寄存器，对应序号的结果码：
+#                     0: 成功，1: 咖啡豆不足，2: 瞬时故障（同 ERROR_CODE_REG），3: 注入丢弃，未执行
+# ----------
+# TRACE_ID_REG 订单号（可选，2 个寄存器，高 16 位在前）
+# 在同一连接上先写订单号，再写 CMD_REG 或命令信箱，该命令即关联到这个订单
+# 订单号按连接记录，并发客户端互不影响；设置 SIM_TRACE_FILE 时记录命令的执行区间
+# ----------
+
+class CommandMailbox:
+    """有界的先进先出命令队列，提交在 Modbus 服务线程，取出在主循环"""
+    def __init__(self, depth):
+        self.depth = depth
+        self.queue = deque()
+        self.history = deque(maxlen=depth)  # (序号, 结果码)，最新在前
+        self.running = 0                    # 正在执行的命令序号
+        self.last_seq = 0                   # 最近分配的序号
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()     # 有新命令提交时唤醒主循环
+        self.data_bank = None
+
+    def attach(self, data_bank):
+        self.data_bank = data_bank
+        data_bank.set_holding_registers(MB_QUEUE_DEPTH_REG, [self.depth])
+        data_bank.set_holding_registers(MB_QUEUE_LEN_REG, [0])
+        data_bank.set_holding_registers(MB_ACK_SEQ_REG, [0])
+        data_bank.set_holding_registers(MB_ACK_HISTORY_REG, [0] * (2 * self.depth))
+
+    def in_use(self, seq):
+        """序号是否被排队、执行中或最近完成的命令占用（需持有 lock）"""
+        return (seq == self.running or any(done == seq for done, _ in self.history)
+                or any(item[2] == seq for item in self.queue))
+
+    def allocate(self):
+        """分配一个非 0 且未被占用的 16 位序号"""
+        with self.lock:
+            seq = self.last_seq
+            while True:
+                seq = seq % 0xFFFF + 1
+                if not self.in_use(seq):
+                    self.last_seq = seq
+                    return seq
+
+    def submit(self, command, doses, seq, trace_id=0):
+        """提交命令，队列已满返回 False；重复序号视为已提交"""
+        with self.lock:
+            if self.in_use(seq):
+                return True
+            if len(self.queue) >= self.depth:
+                return False
+            self.queue.append((command, doses, seq, trace_id))
+            self.data_bank.set_holding_registers(MB_QUEUE_LEN_REG, [len(self.queue)])
+            self.wakeup.set()
+            return True
+
+    def pop(self):
+        with self.lock:
+            if not self.queue:
+                return None
+            item = self.queue.popleft()
+            self.running = item[2]
+            self.data_bank.set_holding_registers(MB_QUEUE_LEN_REG, [len(self.queue)])
+            return item
+
+    def ack(self, seq, result=RESULT_OK):
+        """命令执行结束，result 为结果码"""
+        with self.lock:
+            self.running = 0
+            self.history.appendleft((seq, result))
+            padding = [0] * (self.depth - len(self.history))
+            seqs = [done for done, _ in self.history] + padding
+            results = [code for _, code in self.history] + padding
+            self.data_bank.set_holding_registers(MB_ACK_HISTORY_REG, seqs + results)
+            self.data_bank.set_holding_registers(MB_ACK_SEQ_REG, [seq])
+
+mailbox = CommandMailbox(MAILBOX_DEPTH)
+# 设置了 SIM_TRACE_FILE 时记录带订单号命令的执行区间
+tracer = get_tracer()
+# SIGUSR1 / SIM_PROF 开启性能剖析时记录主循环每次处理命令的耗时，见 common/profiling.py
+profiler = get_profiler()
+
+
+class SimDataHandler(DataHandler):
+    """
+    在服务线程处理客户端请求时注入连接级延迟，
+    并在设置了 SIM_RECORD_FILE 时把写保持寄存器请求写入录制文件
+    inject_delay=False 时由服务端自行注入延迟（asyncio 服务端不能在处理器中阻塞）
+    """
+    def __init__(self, recorder=None, inject_delay=True):
+        super().__init__()
+        self.recorder = recorder
+        self.inject_delay = inject_delay
+        self.client_traces = {}     # (地址, 端口) -> 该连接最近写入的订单号
+        self.cmd_trace = 0          # 最近一次写 CMD_REG 的连接携带的订单号
 
-def grind():
-    logging.debug("开始磨粉")
+    def update_trace(self, address, words_l, client):
+        """写入范围覆盖 TRACE_ID_REG 时记录该连接的订单号"""
+        words = self.data_bank.get_holding_registers(TRACE_ID_REG, 2)
+        for i, word in enumerate(words_l):
+            if TRACE_ID_REG <= address + i <= TRACE_ID_REG + 1:
+                words[address + i - TRACE_ID_REG] = word
+        self.client_traces[client] = words[0] << 16 | words[1]
+
+    def submit_mailbox(self, address, words_l, trace_id=0):
+        """写入范围覆盖 MB_SEQ_REG 时提交命令槽，返回 Modbus 异常码"""
+        slot = self.data_bank.get_holding_registers(MB_CMD_REG, 3)
+        for i, word in enumerate(words_l):
+            if MB_CMD_REG <= address + i <= MB_SEQ_REG:
+                slot[address + i - MB_CMD_REG] = word
+        command, doses, seq = slot
+        if seq == 0:
+            return EXP_NONE
+        if command not in (1, 2):
+            return EXP_DATA_VALUE
+        if not mailbox.submit(command, doses, seq, trace_id):
+            return EXP_SLAVE_DEVICE_BUSY
+        return EXP_NONE
+
+    def read_h_regs(self, address, count, srv_info):
+        delay = self.inject_delay and profile.connection_delay()
+        if delay:
+            time.sleep(delay)
+        ret = super().read_h_regs(address, count, srv_info)
+        if ret.ok and address <= MB_NEXT_SEQ_REG < address + count:
+            # 分配的序号只出现在本次应答中，并发读取的客户端各得到不同的序号
+            ret.data[MB_NEXT_SEQ_REG - address] = mailbox.allocate()
+        return ret
+
+    def write_h_regs(self, address, words_l, srv_info):
+        if self.recorder:
+            self.recorder.write(record.DEVICE_GRINDER, record.OP_WRITE_REGISTERS,
+                                srv_info.client.port, record.encode_registers(address, words_l))
+        delay = self.inject_delay and profile.connection_delay()
+        if delay:
+            time.sleep(delay)
+        client = (srv_info.client.address, srv_info.client.port)
+        if address <= TRACE_ID_REG + 1 and TRACE_ID_REG < address + len(words_l):
+            self.update_trace(address, words_l, client)
+        if address <= MB_SEQ_REG < address + len(words_l):
+            exp_code = self.submit_mailbox(address, words_l, self.client_traces.pop(client, 0))
+            if exp_code != EXP_NONE:
+                return DataHandler.Return(exp_code=exp_code)
+        if address <= CMD_REG < address + len(words_l) and words_l[CMD_REG - address]:
+            self.cmd_trace = self.client_traces.pop(client, 0)
+        return super().write_h_regs(address, words_l, srv_info)
+
+def grind(doses=None):
+    """连续磨 doses 份粉（默认取 DOSE_COUNT_REG），每份更新豆量与已完成份数，返回结果码"""
+    if doses is None:
+        doses = server.data_bank.get_holding_registers(DOSE_COUNT_REG, 1)[0]
+    doses = max(1, doses)
+    logger.debug("开始磨粉，共 %d 份", doses)
+    server.data_bank.set_holding_registers(DOSES_DONE_REG, [0])
     server.data_bank.set_holding_registers(STATUS_REG, [1]) 
+    for done in range(doses):
+        result = grind_dose()
+        if result != RESULT_OK:
+            return result
+        server.data_bank.set_holding_registers(DOSES_DONE_REG, [done + 1])
+    server.data_bank.set_holding_registers(STATUS_REG, [0])
+    return RESULT_OK
+
+def grind_dose():
+    """磨一份粉，返回结果码；豆量不足或故障时设置状态寄存器"""
     current_bean_level = server.data_bank.get_holding_registers(BEAN_LEVEL_REG, 1)[0]
 
     # 判断豆量是否大于10
-    if current_bean_level < 10:
-        logging.error("豆量不足！")
+    if current_bean_level < MIN_BEAN_LEVEL:
+        logger.error("豆量不足！")
         server.data_bank.set_holding_registers(STATUS_REG, [2])
         server.data_bank.set_holding_registers(ERROR_CODE_REG, [1])
-        return
+        return RESULT_NO_BEANS
     else:
-        logging.debug("豆量充足，开始磨粉")
-        current_bean_level = current_bean_level - random.randint(5, 10)
-        time.sleep(5)
+        fault_duration = profile.fault()
+        if fault_duration:
+            # 注入瞬时故障：保持故障状态一段时间后自动恢复，本次磨粉不完成
+            logger.warning("磨粉机发生瞬时故障，%.1f 秒后恢复", fault_duration)
+            server.data_bank.set_holding_registers(STATUS_REG, [2])
+            server.data_bank.set_holding_registers(ERROR_CODE_REG, [2])
+            time.sleep(fault_duration)
+            server.data_bank.set_holding_registers(ERROR_CODE_REG, [0])
+            server.data_bank.set_holding_registers(STATUS_REG, [0])
+            return RESULT_FAULT
+        logger.debug("豆量充足，开始磨粉")
+        current_bean_level = current_bean_level - profile.stream("bean_use").randint(*BEAN_USE)
+        time.sleep(profile.service_time("grind", GRIND_TIME))
         server.data_bank.set_holding_registers(BEAN_LEVEL_REG, [current_bean_level])
-        logging.debug("磨粉完成，当前豆量: %d%%", current_bean_level)
-        server.data_bank.set_holding_registers(STATUS_REG, [0])
+        state.update(bean_level=current_bean_level)
+        logger.debug("磨粉完成，当前豆量: %d%%", current_bean_level)
+        return RESULT_OK
 
 def add_bean():
-    logging.debug("补充豆子")
+    logger.debug("补充豆子")
     server.data_bank.set_holding_registers(STATUS_REG, [1])
-    time.sleep(2)
+    time.sleep(profile.service_time("add_bean", ADD_BEAN_TIME))
     server.data_bank.set_holding_registers(STATUS_REG, [0])
-    server.data_bank.set_holding_registers(BEAN_LEVEL_REG, [100])
+    server.data_bank.set_holding_registers(BEAN_LEVEL_REG, [FULL_BEAN_LEVEL])
     server.data_bank.set_holding_registers(ERROR_CODE_REG, [0])
+    state.update(bean_level=FULL_BEAN_LEVEL)
+
+    logger.debug("补充豆子完成")
+
+def execute(command, doses=None, trace_id=0):
+    """执行一条命令（1: 磨粉，2: 补充豆子），返回结果码；携带订单号且设置了 SIM_TRACE_FILE 时记录执行区间"""
+    start = time.time()
+    if command == 1:
+        result = grind(doses)
+    elif command == 2:
+        add_bean()
+        result = RESULT_OK
+    else:
+        return RESULT_OK
+    if tracer:
+        tracer.span(trace_id, "grinder", "grind" if command == 1 else "add_bean", start,
+                    doses=max(1, doses or 1) if command == 1 else 0, result="error" if result else "done")
+    return result
+
+def run(host=HOST, port=PORT, transport=TRANSPORT):
+    """启动 Modbus 服务并进入命令轮询循环（阻塞），transport 为 threaded 或 asyncio"""
+    global server
+    ready.starting("grinder")
+    # 创建server，0.0.0.0 表示监听所有IP地址, 502是 ModBus TCP的默认端口
+    # 数据处理器负责命令信箱，设置了 SIM_RECORD_FILE 时录制所有寄存器写入
+    if transport == "asyncio":
+        data_hdl = SimDataHandler(record.get_recorder(), inject_delay=False)
+        server = AsyncModbusServer(host=host, port=port, data_hdl=data_hdl, request_delay=profile.connection_delay)
+    else:
+        data_hdl = SimDataHandler(record.get_recorder())
+        server = ModbusServer(host=host, port=port, no_block = True, data_hdl = data_hdl)
+    mailbox.attach(server.data_bank)
+    logger.debug("磨粉机开始运行")
+
+    try:
+        # 启动服务
+        server.start()
+        logger.debug("磨粉机已启动（%s），监听端口 %d", transport, port)
+
+        # 初始化状态
+        server.data_bank.set_holding_registers(STATUS_REG, [0])       
+        server.data_bank.set_holding_registers(BEAN_LEVEL_REG, [state["bean_level"]])
+        server.data_bank.set_holding_registers(ERROR_CODE_REG, [0])   
+        server.data_bank.set_holding_registers(DOSE_COUNT_REG, [0])
+        server.data_bank.set_holding_registers(DOSES_DONE_REG, [0])
+        if state.restored:
+            logger.info("已从 %s 恢复状态，豆量: %d%%", state.path, state["bean_level"])
+        logger.debug("磨粉机初始状态: 空闲, 豆量: %d%%, 无故障.", state["bean_level"])
+        ready.ready("grinder", port=port)
+
+
+        while True:
+            # 优先处理信箱中的命令，队列非空时不等待轮询间隔
+            item = mailbox.pop()
+            t0 = time.perf_counter() if profiler.on else 0
+            if item:
+                command, doses, seq, trace_id = item
+                if profile.drop():
+                    # 注入丢弃：信箱命令同样不执行，以结果码告知提交方
+                    logger.warning("丢弃信箱命令 %d（序号 %d）", command, seq)
+                    mailbox.ack(seq, RESULT_DROPPED)
+                else:
+                    mailbox.ack(seq, execute(command, doses, trace_id))
+                if t0:
+                    profiler.record("grinder.loop", t0)
+                continue
+
+            # 读取CMD_REG的值，判断是否有命令写入，get方法返回的是一个列表
+            command = server.data_bank.get_holding_registers(CMD_REG, 1)[0]
+            if command != 0 and profile.drop():
+                # 注入丢弃：命令被清除但不执行
+                logger.warning("丢弃命令 %d", command)
+            elif command in (1, 2):
+                doses = server.data_bank.get_holding_registers(DOSE_COUNT_REG, 1)[0]
+                execute(command, doses, data_hdl.cmd_trace)
+            # 循环时间
+            if command != 0:
+                server.data_bank.set_holding_registers(DOSE_COUNT_REG, [0])
+                if t0:
+                    profiler.record("grinder.loop", t0)
+            server.data_bank.set_holding_registers(CMD_REG,[0])
+            # 等待下一个轮询周期，信箱有新命令时立即唤醒
+            mailbox.wakeup.wait(0.5)
+            mailbox.wakeup.clear()
+
+    # 异常处理
+    except Exception as e:
+        logger.error(f"错误:{e}")
+        server.stop()
+        logger.error("服务关闭")
+
+def main():
+    run()
 
-    logging.debug("补充豆子完成")
-
-# 创建server，0.0.0.0 表示监听所有IP地址, 502是 ModBus TCP的默认端口
-server = ModbusServer(host="0.0.0.0", port=502, no_block = True)
-logging.debug("磨粉机开始运行")
-
-try:
-    # 启动服务
-    server.start()
-    logging.debug("磨粉机已启动")
-
-    # 初始化状态
-    server.data_bank.set_holding_registers(STATUS_REG, [0])       
-    server.data_bank.set_holding_registers(BEAN_LEVEL_REG, [100]) 
-    server.data_bank.set_holding_registers(ERROR_CODE_REG, [0])   
-    logging.debug("磨粉机初始状态: 空闲, 豆量: 100%, 无故障.")
-
-
-    while True:
-        # 读取CMD_REG的值，判断是否有命令写入，get方法返回的是一个列表
-        command = server.data_bank.get_holding_registers(CMD_REG, 1)[0]
-        if command == 1:
-            grind()
-        elif command == 2:
-            add_bean()
-        # 循环时间
-        server.data_bank.set_holding_registers(CMD_REG,[0])
-        time.sleep(0.5)
-
-# 异常处理
-except Exception as e:
-    logging.error(f"错误:{e}")
-    server.stop()
-    logging.error("服务关闭")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
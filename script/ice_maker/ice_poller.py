@@ -0,0 +1,125 @@
+'''
+按变化序号轮询多台制冰机
+- 每轮只读取 DB1 的 8~11 字节（变化序号 + 最近完成的指令），序号不变时跳过该设备
+- 序号变化时才读取 0~11 字节并解析全部字段
+- 连接失败的设备在下一轮自动重连
+用法：
+    python ice_poller.py 127.0.0.1:102 192.168.1.20:102 --interval 1
+'''
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+import snap7
+from snap7.util import get_int, get_word
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+
+logger = get_logger("ice_poller")
+
+DB_NUMBER = 1
+SEQ_OFFSET = 8      # 与 icemaker_sim.py 中的 DB1 布局一致
+FULL_SIZE = 12
+
+IceSnapshot = namedtuple("IceSnapshot", ["stock", "status", "command", "amount", "seq", "last_done"])
+
+
+class IceMakerPoller:
+    """
+    输入：endpoints (list) - [(host, port), ...]
+         rack, slot (int) - S7 机架号与插槽号
+    """
+    def __init__(self, endpoints, rack=0, slot=1):
+        self.endpoints = list(endpoints)
+        self.rack = rack
+        self.slot = slot
+        self.clients = {}
+        self.seqs = {}          # endpoint -> 上次看到的变化序号
+        self.snapshots = {}     # endpoint -> 最近一次解析的完整状态
+        self.reads = 0          # 4 字节序号读取次数
+        self.full_reads = 0     # 完整读取次数
+
+    def client(self, endpoint):
+        client = self.clients.get(endpoint)
+        if client is None:
+            client = snap7.client.Client()
+            client.connect(endpoint[0], self.rack, self.slot, endpoint[1])
+            self.clients[endpoint] = client
+        return client
+
+    def poll_one(self, endpoint):
+        """轮询一台设备，状态变化时返回新的 IceSnapshot，否则返回 None"""
+        client = self.client(endpoint)
+        head = client.db_read(DB_NUMBER, SEQ_OFFSET, 4)
+        self.reads += 1
+        if get_word(head, 0) == self.seqs.get(endpoint):
+            return None
+        data = client.db_read(DB_NUMBER, 0, FULL_SIZE)
+        self.full_reads += 1
+        snapshot = IceSnapshot(get_int(data, 0), get_int(data, 2), get_int(data, 4), get_int(data, 6),
+                               get_word(data, SEQ_OFFSET), get_int(data, SEQ_OFFSET + 2))
+        # 使用完整读取中的序号，避免两次读取之间的变化被漏掉
+        self.seqs[endpoint] = snapshot.seq
+        self.snapshots[endpoint] = snapshot
+        return snapshot
+
+    def poll(self):
+        """轮询全部设备，返回 {endpoint: IceSnapshot}，只包含发生变化的设备"""
+        changed = {}
+        for endpoint in self.endpoints:
+            try:
+                snapshot = self.poll_one(endpoint)
+            except Exception as e:
+                logger.error("读取制冰机 %s:%d 失败：%s", endpoint[0], endpoint[1], e)
+                self.drop(endpoint)
+                continue
+            if snapshot is not None:
+                changed[endpoint] = snapshot
+        return changed
+
+    def drop(self, endpoint):
+        client = self.clients.pop(endpoint, None)
+        self.seqs.pop(endpoint, None)
+        if client is not None:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    def close(self):
+        for endpoint in list(self.clients):
+            self.drop(endpoint)
+
+
+def parse_endpoint(text):
+    host, _, port = text.rpartition(":")
+    return (host, int(port)) if host else (text, 102)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按变化序号轮询多台制冰机")
+    parser.add_argument("endpoints", nargs="+", help="host:port，端口默认 102")
+    parser.add_argument("--interval", type=float, default=1.0, help="轮询间隔（秒）")
+    parser.add_argument("--rack", type=int, default=0)
+    parser.add_argument("--slot", type=int, default=1)
+    args = parser.parse_args()
+
+    poller = IceMakerPoller([parse_endpoint(e) for e in args.endpoints], args.rack, args.slot)
+    try:
+        while True:
+            for (host, port), s in poller.poll().items():
+                logger.info("%s:%d 序号 %d 库存 %d 状态 %d 指令 %d 最近完成 %d",
+                            host, port, s.seq, s.stock, s.status, s.command, s.last_done)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        logger.info("共 %d 次序号读取，%d 次完整读取", poller.reads, poller.full_reads)
+    finally:
+        poller.close()
+
+
+if __name__ == "__main__":
+    main()
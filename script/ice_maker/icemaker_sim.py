@@ -3,38 +3,47 @@ Author: Orange horrorange@qq.com
 Last-modified: 2025-09-18
 Used to test the ice makers, using S7 communication over TCP messages
 '''
+import os
+import sys
 import snap7
 from snap7.server import Server
-from snap7.util import set_int, get_int
+from snap7.util import set_int, get_int, set_word, get_word, get_dword
 import time
-import logging
-from colorlog import ColoredFormatter
 import ctypes
 
-# ----------------- 日志配置
-logger = logging.getLogger("icemaker_sim")
-logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-# 设置格式
-formatter = ColoredFormatter(
-    "%(log_color)s%(asctime)s %(levelname)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red,bg_white',
-    },
-)
-handler.setFormatter(formatter)
-
-if not logger.handlers:
-    logger.addHandler(handler)
+# 共享模块位于 script/common（容器内与脚本位于同一目录）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+from common import record
+from common.sim_profile import load_profile
+from common.state import load_state
+from common import ready
+from common.trace import get_tracer
+from common.profiling import get_profiler
+from common.shop import shop_port
+
+# ----------------- 日志配置，格式化与输出在后台线程完成
+logger = get_logger("icemaker_sim")
+
+# 服务时间与故障注入配置，见 SIM_PROFILE / SIM_SEED
+profile = load_profile("ice")
+# 设置了 SIM_TRACE_FILE 时记录带订单号指令的执行区间
+tracer = get_tracer()
+# SIGUSR1 / SIM_PROF 开启性能剖析时记录每条指令的处理耗时，见 common/profiling.py
+profiler = get_profiler()
+# 设备模型（离线容量仿真 script/capacity/shop_des.py 复用这些参数）
+INITIAL_STOCK = 1000    # 出厂冰块库存（克）
+MAKE_ICE_TIME = 10      # 一次制冰时间（秒），SIM_PROFILE 中的 "make_ice"
+ICE_BATCH = 1000        # 一次制冰产量（克）
+ICE_CAPACITY = 1500     # 冰块库存上限（克）
+DISPENSE_TIME = 2       # 出冰时间（秒），SIM_PROFILE 中的 "dispense"
+
+# 冰块库存保存在内存映射文件中，设置 SIM_STATE_DIR 后重启可继续
+state = load_state("ice", {"stock": INITIAL_STOCK, "seq": 0})
 
 # ----------------- 服务器配置
 SERVER_HOST = '0.0.0.0'     # 监听所有网络接口
-SERVER_PORT = 102           # 西门子PLC默认端口
+SERVER_PORT = shop_port("ICE_PORT", 102)  # 西门子PLC默认端口102，支持环境变量覆盖，未设置时按 SHOP_ID 偏移
 RACK = 0                    # 机架号
 SLOT = 1                    # 插槽号
 
@@ -45,19 +54,49 @@ SLOT = 1                    # 插槽号
 # 2    | INT  | 设备状态 (0=待机, 1=正在制冰, 2=出冰中, 3=故障)
 # 4    | INT  | 网关指令 (1=开始制冰, 2=停止制冰, 3=取冰)
 # 6    | INT  | 本次取冰量 (单位:克)
+# 8    | WORD | 变化序号，模拟器每次修改 0~5、10 字节时加1（到 65535 后回到 0）
+# 10   | INT  | 最近完成的指令 (0=无, 1=制冰, 3=取冰)
+# 12   | DWORD| 订单号（可选），网关在写指令前写入，指令完成后模拟器清零；设置 SIM_TRACE_FILE 时按订单记录执行区间
+# 轮询方只需读取 8~11 共 4 字节，序号不变时无需读取和解析其余数据
 
-db1_data = (ctypes.c_ubyte * 20)()    # 数据块DB1，20字节大小
+EVC_DATA_WRITE = 0x00040000    # snap7 服务器事件码：客户端写入数据区
+SEQ_OFFSET = 8
+LAST_DONE_OFFSET = 10
+TRACE_OFFSET = 12
+
+db1_buffer = bytearray(20)            # 数据块DB1，20字节大小
+db1_data = (ctypes.c_ubyte * 20).from_buffer(db1_buffer)    # 与 db1_buffer 共享内存的ctypes视图
 # ----------------- 初始化DB1数据
 # 将ctypes数组转换为bytearray进行初始化
 temp_data = bytearray(20)
-set_int(temp_data, 0, 1000)  # 初始化当前冰块库存为1000克
+set_int(temp_data, 0, state["stock"])  # 初始化当前冰块库存（出厂为1000克）
 set_int(temp_data, 2, 0)     # 初始化设备状态为待机
 set_int(temp_data, 4, 0)     # 初始化网关指令为0
 set_int(temp_data, 6, 0)     # 初始化本次取冰量为0克
+set_word(temp_data, SEQ_OFFSET, state["seq"])  # 变化序号在重启后继续递增，避免轮询方误判为未变化
+set_int(temp_data, LAST_DONE_OFFSET, 0)
 # 将初始化数据复制到ctypes数组
 for i in range(20):
     db1_data[i] = temp_data[i]
 
+def commit(current_data):
+    """
+    把模拟器修改的字段写回 DB1，并递增变化序号
+    只写回模拟器负责的 0~5 与 8~11 字节，不覆盖客户端写入的取冰量
+    """
+    seq = (get_word(current_data, SEQ_OFFSET) + 1) & 0xFFFF
+    set_word(current_data, SEQ_OFFSET, seq)
+    db1_buffer[0:6] = current_data[0:6]
+    db1_buffer[LAST_DONE_OFFSET:LAST_DONE_OFFSET + 2] = current_data[LAST_DONE_OFFSET:LAST_DONE_OFFSET + 2]
+    # 序号最后写入，轮询方看到新序号时其余字段已经更新
+    db1_buffer[SEQ_OFFSET:SEQ_OFFSET + 2] = current_data[SEQ_OFFSET:SEQ_OFFSET + 2]
+    state.update(stock=get_int(current_data, 0), seq=seq)
+
+def clear_trace(trace_id):
+    """指令完成后清除订单号；网关已为下一条指令写入新订单号时保持不变"""
+    if trace_id and get_dword(db1_buffer, TRACE_OFFSET) == trace_id:
+        db1_buffer[TRACE_OFFSET:TRACE_OFFSET + 4] = bytes(4)
+
 def process_command():
     """处理指令的函数"""
     # 将ctypes数组转换为bytearray进行处理
@@ -67,53 +106,97 @@ def process_command():
     
     status = get_int(current_data, 2)
     command = get_int(current_data, 4)
+    trace_id = get_dword(current_data, TRACE_OFFSET)
 
     if command != 0:
-        logger.info(f"收到网关指令：{command}")
-        if command == 1:    # 开始制冰
+        start = time.time()
+        t0 = time.perf_counter() if profiler.on else 0
+        logger.info("收到网关指令：%d", command)
+        dropped = profile.drop()
+        fault_duration = 0 if dropped else profile.fault()
+        if dropped:
+            # 注入丢弃：指令被清除但不执行
+            logger.warning("  -> 丢弃指令 %d", command)
+        elif fault_duration:
+            # 注入瞬时故障：保持故障状态一段时间后恢复，本次指令不完成
+            logger.warning("  -> 发生瞬时故障，%.1f 秒后恢复", fault_duration)
+            set_int(current_data, 2, 3)      # 设备状态设为故障
+            commit(current_data)
+            time.sleep(fault_duration)
+        elif command == 1:    # 开始制冰
             logger.info("  -> 开始制冰...")
             set_int(current_data, 2, 1)      # 设备状态设为正在制冰
-            # 更新ctypes数组
-            for i in range(20):
-                db1_data[i] = current_data[i]
-            time.sleep(10)
+            commit(current_data)
+            time.sleep(profile.service_time("make_ice", MAKE_ICE_TIME))
 
             current_ice = get_int(current_data, 0)
-            new_ice = min(current_ice + 1000, 1500)
+            new_ice = min(current_ice + ICE_BATCH, ICE_CAPACITY)
             set_int(current_data, 0, new_ice)  # 更新当前冰块库存
+            set_int(current_data, LAST_DONE_OFFSET, command)
             logger.info(f"  -> 制冰完成，当前库存：{new_ice}克")
+            if tracer:
+                tracer.span(trace_id, "ice", "make_ice", start, stock=new_ice)
         
         elif command == 3:  # 取冰
             dispense_ice = get_int(current_data, 6)
             logger.info(f"  -> 取冰：{dispense_ice}克")
             set_int(current_data, 2, 2)      # 设备状态设为出冰中
-            # 更新ctypes数组
-            for i in range(20):
-                db1_data[i] = current_data[i]
-            time.sleep(2)
+            commit(current_data)
+            time.sleep(profile.service_time("dispense", DISPENSE_TIME))
 
             current_ice = get_int(current_data, 0)
             new_ice = max(current_ice - dispense_ice, 0)
             if new_ice == 0:
                 logger.warning("冰块已经消耗完成！")
             set_int(current_data, 0, new_ice)
+            set_int(current_data, LAST_DONE_OFFSET, command)
             logger.info(f"  -> 取冰完成，当前库存：{new_ice}克")
+            if tracer:
+                tracer.span(trace_id, "ice", "dispense", start, amount=dispense_ice, stock=new_ice)
         
         # 指令处理完成后，重置指令位
         set_int(current_data, 4, 0)
         set_int(current_data, 2, 0)
-        # 更新ctypes数组
-        for i in range(20):
-            db1_data[i] = current_data[i]
+        commit(current_data)
+        clear_trace(trace_id)
+        if t0:
+            profiler.record("ice.process_command", t0)
 
-def main():
+def make_record_callback(recorder):
+    """
+    创建 snap7 事件回调：客户端写入 DB1 后，把写入区间的数据追加到录制文件
+    事件参数：EvtParam2=DB号，EvtParam3=起始字节，EvtParam4=长度
+    """
+    def on_event(event):
+        if event.EvtCode != EVC_DATA_WRITE or event.EvtParam2 != 1:
+            return
+        start, size = event.EvtParam3, event.EvtParam4
+        recorder.write(record.DEVICE_ICE, record.OP_DB_WRITE, event.EvtSender,
+                       record.encode_db_write(1, start, bytes(db1_data[start:start + size])))
+    return on_event
+
+def run(port=SERVER_PORT):
+    """启动 S7 服务并进入指令处理循环（阻塞）"""
+    ready.starting("ice")
     server = Server()
-    server.register_area(snap7.SrvArea.DB, 1, db1_data)
+    try:
+        # python-snap7 2.x 及以上会复制 ctypes 数组，需直接注册 bytearray 才能共享内存
+        server.register_area(snap7.SrvArea.DB, 1, db1_buffer)
+    except TypeError:
+        # python-snap7 1.x 只接受 ctypes 缓冲区
+        server.register_area(snap7.SrvArea.DB, 1, db1_data)
+    # 设置了 SIM_RECORD_FILE 时录制所有 DB1 写入
+    recorder = record.get_recorder()
+    if recorder:
+        server.set_events_callback(make_record_callback(recorder))
 
-    logger.info(f"S7服务器已启动，监听地址：{SERVER_HOST}:{SERVER_PORT}")
+    logger.info(f"S7服务器已启动，监听地址：{SERVER_HOST}:{port}")
+    if state.restored:
+        logger.info("已从 %s 恢复状态，冰块库存：%d克", state.path, state["stock"])
     try:
-        server.start()
+        server.start(port)
         logger.info("S7服务器已成功启动, 等待连接...")
+        ready.ready("ice", port=port)
         while True:
             process_command()
             time.sleep(0.5)
@@ -126,6 +209,9 @@ def main():
         server.stop()
         logger.debug("S7服务器已停止")
 
+def main():
+    run()
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,149 @@
+'''
+订单 SLA 统计（流式，内存占用与订单数量无关）
+- 吞吐：每分钟完成/失败订单数，使用命名服务端游标逐批读取
+- 时延：finish_time - create_time 按 coffee_type、bool_ice 分组的 P50/P90/P99，由数据库聚合
+- 错误：按 error_msg 分组计数，由数据库聚合
+- 已执行 order_archive.py migrate 时同时统计 orders 与 orders_history
+- 各项统计都按 shop_id 分组，--shop 只统计一家门店
+用法：
+    python order_analytics.py --format csv --out sla_report       # 输出 throughput.csv、latency.csv、errors.csv
+    python order_analytics.py --format json --out sla.json --since "7 days"
+    python order_analytics.py --shop 2 --out sla_shop2
+'''
+import argparse
+import csv
+import json
+import os
+import sys
+
+from send_order import get_conn
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+
+logger = get_logger("order_analytics")
+
+ORDER_COLUMNS = "shop_id, coffee_type, bool_ice, status, create_time, finish_time, error_msg"
+FETCH_SIZE = 2000   # 服务端游标每次取回的行数
+
+THROUGHPUT_SQL = '''
+SELECT shop_id, date_trunc('minute', finish_time) AS minute,
+       COUNT(*) FILTER (WHERE status = 'done') AS done,
+       COUNT(*) FILTER (WHERE status = 'error') AS error
+FROM {source}
+WHERE finish_time IS NOT NULL AND finish_time >= NOW() - %(since)s::interval AND {shop_filter}
+GROUP BY 1, 2
+ORDER BY 1, 2
+'''
+
+LATENCY_SQL = '''
+SELECT shop_id, coffee_type, bool_ice, COUNT(*) AS orders,
+       percentile_cont(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (ORDER BY latency) AS pct,
+       AVG(latency) AS mean, MAX(latency) AS max
+FROM (
+  SELECT shop_id, coffee_type, bool_ice, EXTRACT(EPOCH FROM finish_time - create_time)::float8 AS latency
+  FROM {source}
+  WHERE status = 'done' AND finish_time >= NOW() - %(since)s::interval AND {shop_filter}
+) t
+GROUP BY shop_id, coffee_type, bool_ice
+ORDER BY shop_id, coffee_type, bool_ice
+'''
+
+ERRORS_SQL = '''
+SELECT shop_id, COALESCE(error_msg, '') AS error_msg, COUNT(*) AS orders
+FROM {source}
+WHERE status = 'error' AND finish_time >= NOW() - %(since)s::interval AND {shop_filter}
+GROUP BY 1, 2
+ORDER BY 1, 3 DESC
+'''
+
+REPORTS = {
+    "throughput": (THROUGHPUT_SQL, ["shop_id", "minute", "done", "error"]),
+    "latency": (LATENCY_SQL, ["shop_id", "coffee_type", "bool_ice", "orders", "p50_s", "p90_s", "p99_s", "mean_s",
+                              "max_s"]),
+    "errors": (ERRORS_SQL, ["shop_id", "error_msg", "orders"]),
+}
+SHOP_FILTER = "(%(shop)s::int IS NULL OR shop_id = %(shop)s)"
+
+
+def order_source(cur):
+    """orders 与（若存在）orders_history 的并集"""
+    cur.execute("SELECT to_regclass('orders_history') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return f"(SELECT {ORDER_COLUMNS} FROM orders UNION ALL SELECT {ORDER_COLUMNS} FROM orders_history) o"
+    return "orders"
+
+
+def flatten(report, row):
+    """把数据库返回的一行转换为可写入 CSV/JSON 的值"""
+    if report == "throughput":
+        shop_id, minute, done, error = row
+        return [shop_id, minute.isoformat(), done, error]
+    if report == "latency":
+        shop_id, coffee_type, bool_ice, orders, pct, mean, max_latency = row
+        return [shop_id, coffee_type, bool_ice, orders] + [round(float(v), 3) for v in (*pct, mean, max_latency)]
+    return list(row)
+
+
+def stream_report(conn, source, report, since, shop=None):
+    """用命名服务端游标执行统计，逐批产出行，客户端只保留一批数据；shop 为 None 时统计全部门店"""
+    sql, _ = REPORTS[report]
+    with conn.cursor(name=f"sla_{report}") as cur:
+        cur.itersize = FETCH_SIZE
+        cur.execute(sql.format(source=source, shop_filter=SHOP_FILTER), {"since": since, "shop": shop})
+        for row in cur:
+            yield flatten(report, row)
+
+
+def export_csv(conn, source, since, out_dir, shop=None):
+    os.makedirs(out_dir, exist_ok=True)
+    for report, (_, header) in REPORTS.items():
+        path = os.path.join(out_dir, f"{report}.csv")
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in stream_report(conn, source, report, since, shop):
+                writer.writerow(row)
+                count += 1
+        logger.info("%s: %d 行 -> %s", report, count, path)
+
+
+def export_json(conn, source, since, path, shop=None):
+    # 逐行写出 JSON，避免在内存中构造整个报告
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i, (report, (_, header)) in enumerate(REPORTS.items()):
+            f.write(f'{"," if i else ""}\n  {json.dumps(report)}: [')
+            count = 0
+            for row in stream_report(conn, source, report, since, shop):
+                f.write(("," if count else "") + "\n    " + json.dumps(dict(zip(header, row)), ensure_ascii=False))
+                count += 1
+            f.write("\n  ]")
+            logger.info("%s: %d 行", report, count)
+        f.write("\n}\n")
+    logger.info("报告已写入 %s", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="订单吞吐、时延分位数与错误统计")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--out", help="csv 为输出目录（默认 sla_report），json 为输出文件（默认 sla_report.json）")
+    parser.add_argument("--since", default="100 years", help="统计最近多长时间（PostgreSQL interval），默认全部")
+    parser.add_argument("--shop", type=int, help="只统计指定门店，默认全部门店（按门店分组）")
+    args = parser.parse_args()
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            source = order_source(cur)
+        # 命名游标需要在事务中使用，统计结束后整体回滚即可
+        if args.format == "csv":
+            export_csv(conn, source, args.since, args.out or "sla_report", args.shop)
+        else:
+            export_json(conn, source, args.since, args.out or "sla_report.json", args.shop)
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    main()
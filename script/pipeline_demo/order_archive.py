@@ -0,0 +1,196 @@
+'''
+orders 表的冷热分离与归档
+- 热表 orders 只保留未完成订单与刚完成的订单，轮询 (PollPending) 使用部分索引
+  idx_orders_shop_pending (shop_id, create_time) WHERE status='pending'，代价不随历史订单增长
+- 已完成 (done/error) 的订单由后台归档任务按批移入 orders_history，
+  该表按 finish_time 以月为单位分区，另有 DEFAULT 分区兜底；新建月分区时先把 DEFAULT 中属于该月的行移入新表再挂载
+- finish_time 为空的已完成订单按 create_time 归档，并把 create_time 写入历史表的 finish_time
+- 每批在一个事务内 DELETE ... RETURNING 后插入历史表，SKIP LOCKED 避免与流水线互相等待
+- --shop 只归档一家门店的订单，各门店可以各自运行归档任务
+用法：
+    python order_archive.py migrate                     # 建立历史表、分区与索引（可重复执行）
+    python order_archive.py archive --min-age "1 hour"  # 归档一次
+    python order_archive.py run --interval 60           # 后台周期归档
+    python order_archive.py run --shop 2                # 只归档门店 2
+'''
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import psycopg
+
+from send_order import get_conn, ensure_schema
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+
+logger = get_logger("order_archive")
+
+FINISHED_STATUSES = ("done", "error")
+HISTORY_COLUMNS = "id, shop_id, coffee_type, bool_ice, table_num, status, create_time, finish_time, error_msg"
+# 已完成订单的归档时间：finish_time 为空（例如直接改为 error 的订单）时使用 create_time
+FINISHED_AT = "COALESCE(finish_time, create_time)"
+
+
+def month_start(d):
+    return datetime.date(d.year, d.month, 1)
+
+
+def next_month(d):
+    return datetime.date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def ensure_history_schema(cur):
+    """创建按 finish_time 分区的历史表、DEFAULT 分区以及热表上的索引"""
+    ensure_schema(cur)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS orders_history (
+      id BIGINT NOT NULL,
+      shop_id INT NOT NULL DEFAULT 1,
+      coffee_type VARCHAR(32) NOT NULL,
+      bool_ice BOOLEAN NOT NULL,
+      table_num INT NOT NULL,
+      status VARCHAR(16) NOT NULL,
+      create_time TIMESTAMPTZ NOT NULL,
+      finish_time TIMESTAMPTZ NOT NULL,
+      error_msg TEXT,
+      PRIMARY KEY (id, finish_time)
+    ) PARTITION BY RANGE (finish_time);
+    ''')
+    cur.execute("ALTER TABLE orders_history ADD COLUMN IF NOT EXISTS shop_id INT NOT NULL DEFAULT 1")
+    cur.execute("CREATE TABLE IF NOT EXISTS orders_history_default PARTITION OF orders_history DEFAULT")
+    # 归档任务查找已完成订单使用的索引，热表很小，维护代价可以忽略；
+    # 索引表达式与归档查询一致，替换早期只按 finish_time 建立的 idx_orders_finished
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_orders_finished_at ON orders(({FINISHED_AT})) WHERE status IN ('done', 'error')")
+    cur.execute("DROP INDEX IF EXISTS idx_orders_finished")
+
+
+def ensure_partitions(cur, start, months_ahead=2):
+    """
+    创建从 start 所在月份到当前月份之后 months_ahead 个月的月分区
+    DEFAULT 分区中已有该月的行时 PostgreSQL 拒绝直接 CREATE ... PARTITION OF，
+    因此先建普通表，把这些行从 DEFAULT 移入后再 ATTACH；调用方负责提交
+    """
+    # 多个门店的归档任务可能同时建分区，用事务级 advisory 锁串行化
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('orders_history_partitions'))")
+    month = month_start(start)
+    end = month_start(datetime.date.today())
+    for _ in range(months_ahead):
+        end = next_month(end)
+    while month <= end:
+        upper = next_month(month)
+        name = f"orders_history_{month:%Y%m}"
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            lower_bound, upper_bound = f"{month:%Y-%m-%d}", f"{upper:%Y-%m-%d}"
+            cur.execute(f"CREATE TABLE {name} (LIKE orders_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(f'''
+            WITH moved AS (
+              DELETE FROM orders_history_default WHERE finish_time >= %s AND finish_time < %s
+              RETURNING {HISTORY_COLUMNS}
+            )
+            INSERT INTO {name} ({HISTORY_COLUMNS}) SELECT {HISTORY_COLUMNS} FROM moved
+            ''', (lower_bound, upper_bound))
+            if cur.rowcount:
+                logger.info("从 DEFAULT 分区移入 %s %d 条订单", name, cur.rowcount)
+            cur.execute(f"ALTER TABLE orders_history ATTACH PARTITION {name} "
+                        f"FOR VALUES FROM ('{lower_bound}') TO ('{upper_bound}')")
+        month = upper
+
+
+def migrate(conn, months_ahead=2):
+    """建立冷热分离的表结构；历史表分区覆盖热表中最早的已完成订单"""
+    with conn.cursor() as cur:
+        ensure_history_schema(cur)
+        cur.execute(f"SELECT MIN({FINISHED_AT}) FROM orders WHERE status IN ('done', 'error')")
+        oldest = cur.fetchone()[0]
+        ensure_partitions(cur, oldest.date() if oldest else datetime.date.today(), months_ahead)
+    conn.commit()
+    logger.info("表结构迁移完成")
+
+
+def archive_batch(cur, batch_size, min_age, shop_id=None):
+    """
+    移动一批完成时间早于 min_age 的订单到历史表，shop_id 为 None 时不区分门店，返回移动条数
+    finish_time 为空的订单按 create_time 判断，并以 create_time 作为历史表中的 finish_time
+    """
+    cur.execute(f'''
+    WITH moved AS (
+      DELETE FROM orders WHERE id IN (
+        SELECT id FROM orders
+        WHERE status IN ('done', 'error') AND {FINISHED_AT} < NOW() - %s::interval
+          AND (%s::int IS NULL OR shop_id = %s)
+        ORDER BY {FINISHED_AT}
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING id, shop_id, coffee_type, bool_ice, table_num, status, create_time, {FINISHED_AT} AS finish_time, error_msg
+    )
+    INSERT INTO orders_history ({HISTORY_COLUMNS})
+    SELECT {HISTORY_COLUMNS} FROM moved
+    ''', (min_age, shop_id, shop_id, batch_size))
+    return cur.rowcount
+
+
+def archive(conn, batch_size=1000, min_age="1 hour", months_ahead=2, shop_id=None):
+    """按批归档直到没有满足条件的订单，每批单独提交，返回总条数"""
+    with conn.cursor() as cur:
+        ensure_partitions(cur, datetime.date.today(), months_ahead)
+    conn.commit()
+    total = 0
+    while True:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            moved = archive_batch(cur, batch_size, min_age, shop_id)
+        conn.commit()
+        total += moved
+        if moved:
+            logger.info("归档 %d 条订单，用时 %.0f ms", moved, (time.perf_counter() - start) * 1000)
+        if moved < batch_size:
+            return total
+
+
+def run(interval, batch_size, min_age, months_ahead, shop_id=None):
+    """后台周期归档，数据库异常时记录日志并在下一周期重试"""
+    logger.info("归档任务已启动，周期 %d 秒，批大小 %d，保留 %s", interval, batch_size, min_age)
+    while True:
+        try:
+            with get_conn() as conn:
+                total = archive(conn, batch_size, min_age, months_ahead, shop_id)
+            logger.debug("本轮归档 %d 条订单", total)
+        except psycopg.Error as e:
+            logger.error("归档失败：%s", e)
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="orders 表冷热分离与归档")
+    parser.add_argument("action", choices=["migrate", "archive", "run"])
+    parser.add_argument("--batch-size", type=int, default=1000, help="每个事务移动的订单数")
+    parser.add_argument("--min-age", default="1 hour", help="完成多久之后归档（PostgreSQL interval）")
+    parser.add_argument("--interval", type=int, default=60, help="run 模式的归档周期（秒）")
+    parser.add_argument("--months-ahead", type=int, default=2, help="预先创建的未来月分区数")
+    parser.add_argument("--shop", type=int, help="只归档指定门店的订单，默认全部门店")
+    args = parser.parse_args()
+
+    if args.action == "run":
+        with get_conn() as conn:
+            migrate(conn, args.months_ahead)
+        try:
+            run(args.interval, args.batch_size, args.min_age, args.months_ahead, args.shop)
+        except KeyboardInterrupt:
+            logger.info("归档任务已停止")
+        return
+    with get_conn() as conn:
+        if args.action == "migrate":
+            migrate(conn, args.months_ahead)
+        else:
+            total = archive(conn, args.batch_size, args.min_age, args.months_ahead, args.shop)
+            logger.info("归档完成，共 %d 条订单", total)
+
+
+if __name__ == "__main__":
+    main()
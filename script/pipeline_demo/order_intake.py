@@ -0,0 +1,356 @@
+'''
+面向 POS 终端的订单接入服务（asyncio HTTP + PostgreSQL 组提交）
+- POST /orders 接收一单 {"coffee_type": "LATTE", "need_ice": true, "table_number": 8} 或订单数组，
+  返回 201 {"id": 订单号} / {"ids": [...]}；字段与网关 deliver 请求一致
+- 请求不直接写库：订单先进入缓冲区，写入协程等待第一单到达后再收集 --window 毫秒（或凑满 --max-batch 单），
+  整批在一个事务中先取号（nextval）再用一次 COPY 写入 orders，只提交一次，然后把订单号返回给各请求
+- 每个服务只接收一家门店（--shop，默认 SHOP_ID）的订单，写入的行带 shop_id，背压也只看本店的积压；
+  未指定 --port 时端口按门店偏移（默认 8180，门店 2 为 9180，见 common/shop.py；
+  8180 + 1000*k 不会与设备端口、MQTT、网关 HTTP 9090 等已用端口重合）
+- 背压：后台每 --backlog-interval 秒查询一次本店 pending 订单数（走部分索引 idx_orders_shop_pending），
+  pending 数 + 缓冲中的订单数超过 --max-pending 时返回 503 与 Retry-After，让 POS 稍后重试，
+  避免流水线处理不过来时订单在表中无限堆积
+- GET /health 返回 {"shop_id": ..., "pending": ..., "buffered": ..., "accepting": ...}
+- 写入失败（数据库或其他异常）时本批所有请求返回 500，写入协程按需重新连接后继续
+用法：
+    python order_intake.py serve --port 8180 --window 5 --max-pending 200
+    python order_intake.py bench --url http://localhost:8180 --clients 50 --requests 2000
+    SHOP_ID=2 python order_intake.py serve              # 门店 2，监听 9180
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+import psycopg
+
+from send_order import conn_params, ensure_schema, get_conn
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger, request_gate
+from common.shop import SHOP_ID, shop_port
+from common.stats import percentile
+
+logger = get_logger("order_intake")
+batch_log = request_gate(logger)
+
+MAX_BODY = 1 << 20          # 请求体上限（字节）
+MAX_COFFEE_TYPE = 32        # 与 orders.coffee_type VARCHAR(32) 一致
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+RESERVE_IDS_SQL = "SELECT nextval(pg_get_serial_sequence('orders', 'id')) FROM generate_series(1, %s)"
+COPY_SQL = "COPY orders (id, shop_id, coffee_type, bool_ice, table_num) FROM STDIN"
+PENDING_SQL = "SELECT COUNT(*) FROM orders WHERE status = 'pending' AND shop_id = %s"
+
+
+class Backpressure(Exception):
+    """积压过多，暂不接收订单"""
+
+
+def parse_order(item):
+    """校验并转换一单，返回 (coffee_type, bool_ice, table_num)，字段无效时抛出 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError("订单必须是对象")
+    coffee_type = item.get("coffee_type")
+    if not isinstance(coffee_type, str) or not 0 < len(coffee_type.strip()) <= MAX_COFFEE_TYPE:
+        raise ValueError("coffee_type 无效")
+    need_ice = item.get("need_ice", False)
+    if not isinstance(need_ice, bool):
+        raise ValueError("need_ice 必须是布尔值")
+    table_number = item.get("table_number")
+    if isinstance(table_number, bool) or not isinstance(table_number, int) or not 0 <= table_number < 2 ** 31:
+        raise ValueError("table_number 必须是非负整数")
+    return coffee_type.strip().upper(), need_ice, table_number
+
+
+class OrderIntake:
+    """
+    订单缓冲与组提交
+    输入：window (float) - 第一单到达后继续收集的时间（秒）
+         max_batch (int) - 每批最多写入的订单数
+         max_pending (int) - pending 订单数 + 缓冲中的订单数上限，超过时拒绝新订单
+         backlog_interval (float) - 查询 pending 订单数的间隔（秒）
+         shop_id (int) - 订单所属门店
+    """
+    def __init__(self, window=0.005, max_batch=500, max_pending=200, backlog_interval=0.5, shop_id=SHOP_ID):
+        self.shop_id = shop_id
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.backlog_interval = backlog_interval
+        self.queue = asyncio.Queue()
+        self.buffered = 0       # 已接收、尚未提交的订单数
+        self.pending = 0        # 最近一次查询的 pending 订单数，之后每提交一批累加
+        self.batches = 0
+        self.committed = 0
+
+    def accepting(self, count=1):
+        return self.pending + self.buffered + count <= self.max_pending
+
+    async def submit(self, orders):
+        """缓冲一个请求的订单并等待所在批次提交，返回订单号列表；积压过多时抛出 Backpressure"""
+        if not self.accepting(len(orders)):
+            raise Backpressure()
+        future = asyncio.get_running_loop().create_future()
+        self.buffered += len(orders)
+        self.queue.put_nowait((orders, future))
+        return await future
+
+    async def collect(self):
+        """等待第一单，再在时间窗口内收集更多请求，返回 [(订单列表, future), ...]"""
+        batch = [await self.queue.get()]
+        rows = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.window
+        while rows < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    async def write_batch(self, conn, batch):
+        """一个事务：取号 + 一次 COPY + 一次提交，返回与订单顺序一致的订单号"""
+        rows = [order for orders, _ in batch for order in orders]
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                await cur.execute(RESERVE_IDS_SQL, (len(rows),))
+                ids = [row[0] for row in await cur.fetchall()]
+                async with cur.copy(COPY_SQL) as copy:
+                    for order_id, (coffee_type, bool_ice, table_num) in zip(ids, rows):
+                        await copy.write_row((order_id, self.shop_id, coffee_type, bool_ice, table_num))
+        return ids
+
+    async def writer(self):
+        """写入协程：逐批写库并唤醒等待的请求，写入出错时本批失败，必要时重新连接，协程本身继续运行"""
+        conn = None
+        while True:
+            batch = await self.collect()
+            rows = sum(len(orders) for orders, _ in batch)
+            start = time.perf_counter()
+            try:
+                if conn is None or conn.closed:
+                    conn = await psycopg.AsyncConnection.connect(**conn_params())
+                ids = await self.write_batch(conn, batch)
+            except Exception as e:
+                # 任何异常都只让本批失败；非数据库异常时连接状态未知，关闭后重新连接
+                logger.error("写入 %d 单失败：%s", rows, e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None and not conn.closed and (conn.broken or not isinstance(e, psycopg.Error)):
+                    await conn.close()
+                continue
+            finally:
+                self.buffered -= rows
+            self.pending += rows
+            self.batches += 1
+            self.committed += rows
+            offset = 0
+            for orders, future in batch:
+                if not future.done():
+                    future.set_result(ids[offset:offset + len(orders)])
+                offset += len(orders)
+            if batch_log():
+                logger.debug("提交 %d 个请求共 %d 单，用时 %.1f ms", len(batch), rows, (time.perf_counter() - start) * 1000)
+
+    async def watch_backlog(self):
+        """周期查询 pending 订单数，查询出错时关闭连接，下一周期重新连接，协程本身继续运行"""
+        conn = None
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = await psycopg.AsyncConnection.connect(**conn_params(), autocommit=True)
+                cur = await conn.execute(PENDING_SQL, (self.shop_id,))
+                self.pending = (await cur.fetchone())[0]
+            except Exception as e:
+                logger.warning("查询 pending 订单数失败：%s", e)
+                if conn is not None and not conn.closed:
+                    try:
+                        await conn.close()
+                    except Exception as close_error:
+                        logger.debug("关闭连接失败：%s", close_error)
+                conn = None
+            await asyncio.sleep(self.backlog_interval)
+
+
+# ----------------- HTTP
+def response(status, body, keep_alive=True, headers=None):
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}", "Content-Type: application/json",
+             f"Content-Length: {len(payload)}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+
+
+async def read_request(reader):
+    """读取一个 HTTP 请求，连接关闭时返回 None；返回 (方法, 路径, 版本, 头部, 请求体)"""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b""
+    return method, path, version, headers, body
+
+
+async def handle_post(intake, body):
+    try:
+        data = json.loads(body)
+        orders = [parse_order(item) for item in (data if isinstance(data, list) else [data])]
+    except ValueError as e:
+        return 400, {"error": str(e)}, None
+    if not orders:
+        return 400, {"error": "订单为空"}, None
+    try:
+        ids = await intake.submit(orders)
+    except Backpressure:
+        return 503, {"error": "backlog", "pending": intake.pending, "buffered": intake.buffered}, {"Retry-After": 1}
+    except Exception as e:
+        return 500, {"error": str(e)}, None
+    return 201, ({"ids": ids} if isinstance(data, list) else {"id": ids[0]}), None
+
+
+async def handle_connection(intake, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except OverflowError:
+                writer.write(response(413, {"error": "请求体过大"}, keep_alive=False))
+                break
+            except ValueError:
+                writer.write(response(400, {"error": "请求格式错误"}, keep_alive=False))
+                break
+            if request is None:
+                break
+            method, path, version, headers, body = request
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            path = path.split("?", 1)[0]
+            extra = None
+            if path == "/orders":
+                if method == "POST":
+                    status, result, extra = await handle_post(intake, body)
+                else:
+                    status, result = 405, {"error": "只支持 POST"}
+            elif path == "/health" and method == "GET":
+                status, result = 200, {"shop_id": intake.shop_id, "pending": intake.pending,
+                                       "buffered": intake.buffered, "accepting": intake.accepting(),
+                                       "batches": intake.batches, "committed": intake.committed}
+            else:
+                status, result = 404, {"error": "not found"}
+            writer.write(response(status, result, keep_alive, extra))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    intake = OrderIntake(args.window / 1000, args.max_batch, args.max_pending, args.backlog_interval, args.shop)
+    server = await asyncio.start_server(lambda r, w: handle_connection(intake, r, w), args.host, args.port,
+                                        backlog=1024)
+    logger.info("门店 %d 订单接入服务已启动，监听 %s:%d，窗口 %.1f ms，每批最多 %d 单，pending 上限 %d",
+                args.shop, args.host, args.port, args.window, args.max_batch, args.max_pending)
+    async with server:
+        await asyncio.gather(server.serve_forever(), intake.writer(), intake.watch_backlog())
+
+
+# ----------------- 压测
+async def bench_client(host, port, count, latencies, statuses, rng):
+    """一个 POS 终端：保持一个连接，逐个提交订单"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            body = json.dumps({"coffee_type": rng.choice(["LATTE", "AMERICANO", "ESPRESSO", "MOCHA"]),
+                               "need_ice": rng.random() < 0.3, "table_number": rng.randint(1, 20)}).encode()
+            start = time.perf_counter()
+            writer.write(f"POST /orders HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            status_line = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            status = int(status_line.split()[1])
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def bench(args):
+    url = urlsplit(args.url)
+    latencies, statuses = [], {}
+    per_client = max(1, args.requests // args.clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(bench_client(url.hostname, url.port or 80, per_client, latencies, statuses,
+                                        random.Random(args.seed + i)) for i in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    print(f"{len(latencies)} 个请求，用时 {elapsed:.2f} s，{len(latencies) / elapsed:.0f} 请求/秒")
+    print(f"P50 {percentile(latencies, 50) * 1000:.1f} ms，P99 {percentile(latencies, 99) * 1000:.1f} ms，"
+          f"最大 {max(latencies) * 1000:.1f} ms")
+    print("状态码：" + "，".join(f"{k}×{v}" for k, v in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POS 订单接入服务（组提交到 PostgreSQL）")
+    parser.add_argument("action", choices=["serve", "bench"])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=shop_port("INTAKE_PORT", 8180))
+    parser.add_argument("--shop", type=int, default=SHOP_ID, help="接收订单的门店，默认 SHOP_ID")
+    parser.add_argument("--window", type=float, default=5, help="收集一批订单的时间窗口（毫秒）")
+    parser.add_argument("--max-batch", type=int, default=500, help="每批最多写入的订单数")
+    parser.add_argument("--max-pending", type=int, default=200, help="pending 订单数 + 缓冲订单数上限")
+    parser.add_argument("--backlog-interval", type=float, default=0.5, help="查询 pending 订单数的间隔（秒）")
+    parser.add_argument("--url", default=f"http://localhost:{shop_port('INTAKE_PORT', 8180)}", help="bench 的目标地址")
+    parser.add_argument("--clients", type=int, default=50, help="bench 并发终端数")
+    parser.add_argument("--requests", type=int, default=2000, help="bench 总请求数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.action == "bench":
+        asyncio.run(bench(args))
+        return
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            ensure_schema(cur)
+        conn.commit()
+    if sys.platform == "win32":
+        # psycopg 的异步连接不支持 Windows 默认的 ProactorEventLoop
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        logger.info("订单接入服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,32 @@
 import os
+import sys
 import time
 import psycopg
 
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.shop import SHOP_ID
+
 def env(k, d):
     v = os.environ.get(k)
     return v if v else d
 
-def get_conn():
+def conn_params():
     host = env('PG_HOST','localhost')
     port = env('PG_PORT','5432')
     db = env('PG_DB','smartshop')
     user = env('PG_USER','postgres')
     pw = env('PG_PASS','885658')
-    return psycopg.connect(host=host, port=port, dbname=db, user=user, password=pw)
+    return dict(host=host, port=port, dbname=db, user=user, password=pw)
+
+def get_conn():
+    return psycopg.connect(**conn_params())
 
 def ensure_schema(cur):
     cur.execute('''
     CREATE TABLE IF NOT EXISTS orders (
       id BIGSERIAL PRIMARY KEY,
+      shop_id INT NOT NULL DEFAULT 1,
       coffee_type VARCHAR(32) NOT NULL,
       bool_ice BOOLEAN NOT NULL,
       table_num INT NOT NULL,
@@ -27,8 +36,13 @@ def ensure_schema(cur):
       error_msg TEXT
     );
     ''')
+    # 单店时建立的表补上门店列，已有订单归入门店 1
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS shop_id INT NOT NULL DEFAULT 1")
+    # 每家门店只轮询本店的 pending 订单，部分索引的大小只与待处理订单数相关
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_shop_pending ON orders(shop_id, create_time) WHERE status='pending'")
+    cur.execute("DROP INDEX IF EXISTS idx_orders_pending")
 
-def insert_orders(cur):
+def insert_orders(cur, shop_id=SHOP_ID):
     orders = [
         ('LATTE', True, 7),
         ('AMERICANO', False, 3),
@@ -36,10 +50,10 @@ def insert_orders(cur):
         ('MOCHA', True, 8),
     ]
     for ct, ice, table in orders:
-        cur.execute("INSERT INTO orders(coffee_type, bool_ice, table_num, status, create_time) VALUES(%s,%s,%s,'pending',NOW())", (ct, ice, table))
+        cur.execute("INSERT INTO orders(shop_id, coffee_type, bool_ice, table_num, status, create_time) VALUES(%s,%s,%s,%s,'pending',NOW())", (shop_id, ct, ice, table))
 
-def list_orders(cur):
-    cur.execute("SELECT id, coffee_type, bool_ice, table_num, status, COALESCE(error_msg,'') FROM orders ORDER BY id")
+def list_orders(cur, shop_id=SHOP_ID):
+    cur.execute("SELECT id, coffee_type, bool_ice, table_num, status, COALESCE(error_msg,'') FROM orders WHERE shop_id=%s ORDER BY id", (shop_id,))
     return cur.fetchall()
 
 def main():
@@ -48,7 +62,7 @@ def main():
             ensure_schema(cur)
             insert_orders(cur)
         conn.commit()
-    print('Inserted pending orders.')
+    print(f'Inserted pending orders for shop {SHOP_ID}.')
     # poll
     for _ in range(30):
         with get_conn() as conn:
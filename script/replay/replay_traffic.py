@@ -0,0 +1,204 @@
+'''
+回放模拟器录制的入站流量（录制格式见 script/common/record.py）
+- 按原始时间间隔以 1×、10× 等倍速回放，--speed 0 表示尽可能快
+- 磨粉机：Modbus 写保持寄存器；咖啡机：按原会话建立 TCP 连接发送原始报文；
+  制冰机：S7 写 DB；送餐机器人：MQTT QoS 1 发布
+- 端口默认值与机器人话题按 SHOP_ID 确定，可把一家门店的录制回放到另一家门店（见 common/shop.py）
+- 回放结束后输出各设备发送条数与相对计划时间的最大滞后，便于对比不同版本
+用法：
+    SIM_RECORD_FILE=traffic.bin python script/all_in_one/smartshop_sim.py all   # 录制
+    python script/replay/replay_traffic.py traffic.bin --speed 10              # 10 倍速回放
+'''
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logs import get_logger
+from common import record
+from common.shop import shop_port, topic_prefix
+
+logger = get_logger("replay_traffic")
+
+PUBLISH_TIMEOUT = 10.0      # 回放结束时等待 MQTT 确认的最长时间（秒）
+INFLIGHT_PRUNE = 1000       # 发送中的消息达到该数量时清理已确认的句柄
+
+
+class GrinderTarget:
+    def __init__(self, args):
+        from pyModbusTCP.client import ModbusClient
+        self.client = ModbusClient(host=args.host, port=args.grinder_port, auto_open=True)
+
+    def send(self, rec):
+        address, words = record.decode_registers(rec.payload)
+        if len(words) == 1:
+            return self.client.write_single_register(address, words[0])
+        return self.client.write_multiple_registers(address, words)
+
+    def close(self):
+        self.client.close()
+
+
+class CoffeeTarget:
+    """每个录制会话对应一条 TCP 连接，后台线程读取并丢弃响应，避免阻塞发送"""
+    def __init__(self, args):
+        self.host = args.host
+        self.port = args.coffee_port
+        self.sessions = {}
+
+    def _drain(self, conn):
+        try:
+            while conn.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def send(self, rec):
+        conn = self.sessions.get(rec.session)
+        if conn is None:
+            conn = socket.create_connection((self.host, self.port))
+            threading.Thread(target=self._drain, args=(conn,), daemon=True).start()
+            self.sessions[rec.session] = conn
+        conn.sendall(rec.payload)
+        return True
+
+    def close(self):
+        for conn in self.sessions.values():
+            conn.close()
+
+
+class IceTarget:
+    def __init__(self, args):
+        import snap7
+        self.client = snap7.client.Client()
+        self.client.connect(args.host, 0, 1, args.ice_port)
+
+    def send(self, rec):
+        db_number, start, data = record.decode_db_write(rec.payload)
+        self.client.db_write(db_number, start, bytearray(data))
+        return True
+
+    def close(self):
+        self.client.disconnect()
+
+
+def retarget_topic(topic):
+    """把录制时门店的话题前缀（test/ 或 shop/<id>/）换成当前 SHOP_ID 的前缀"""
+    parts = topic.split("/")
+    if parts[0] == "shop" and len(parts) > 2:
+        rest = parts[2:]
+    elif parts[0] == "test":
+        rest = parts[1:]
+    else:
+        return topic
+    return "/".join([topic_prefix()] + rest)
+
+
+class RobotTarget:
+    """QoS 1 发布，结束时等待 Broker 确认仍在发送中的消息，未确认的条数不计入发送数"""
+    def __init__(self, args):
+        import paho.mqtt.client as mqtt
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="traffic_replay")
+        self.client.connect(args.mqtt_host, args.mqtt_port, 60)
+        self.client.loop_start()
+        self.inflight = []      # 尚未确认的 MQTTMessageInfo
+
+    def send(self, rec):
+        topic, message = record.decode_mqtt(rec.payload)
+        self.inflight.append(self.client.publish(retarget_topic(topic), message, qos=1))
+        if len(self.inflight) >= INFLIGHT_PRUNE:
+            self.inflight = [info for info in self.inflight if not info.is_published()]
+        return True
+
+    def close(self):
+        """等待发送中的消息确认后断开，返回未确认的条数"""
+        deadline = time.monotonic() + PUBLISH_TIMEOUT
+        lost = 0
+        for info in self.inflight:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except (RuntimeError, ValueError):
+                pass    # 连接已断开或消息被拒绝
+            if not info.is_published():
+                lost += 1
+        if lost:
+            logger.warning("%d 条 MQTT 消息在 %.0f s 内未得到确认", lost, PUBLISH_TIMEOUT)
+        self.client.disconnect()
+        self.client.loop_stop()
+        return lost
+
+
+TARGETS = {
+    record.DEVICE_GRINDER: GrinderTarget,
+    record.DEVICE_COFFEE: CoffeeTarget,
+    record.DEVICE_ICE: IceTarget,
+    record.DEVICE_ROBOT: RobotTarget,
+}
+
+
+def replay(path, args):
+    devices = set(args.device or record.DEVICE_NAMES.values())
+    targets = {}
+    sent = Counter()
+    max_lag = 0.0
+    t0 = None
+    start = time.perf_counter()
+    try:
+        for rec in record.read_records(path):
+            name = record.DEVICE_NAMES.get(rec.device)
+            if name not in devices:
+                continue
+            if t0 is None:
+                t0 = rec.ts
+            # 按倍速计算计划发送时间
+            if args.speed > 0:
+                due = (rec.ts - t0) / args.speed
+                delay = due - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            target = targets.get(rec.device)
+            if target is None:
+                target = targets[rec.device] = TARGETS[rec.device](args)
+            if target.send(rec):
+                sent[name] += 1
+    finally:
+        for device, target in targets.items():
+            # close 返回未确认送达的条数（只有 MQTT 有确认），从发送数中扣除
+            lost = target.close()
+            if lost:
+                sent[record.DEVICE_NAMES[device]] -= lost
+    elapsed = time.perf_counter() - start
+    logger.info("回放完成，用时 %.2f s，最大滞后 %.1f ms", elapsed, max_lag * 1000)
+    for name, count in sorted(sent.items()):
+        logger.info("  %s: %d 条", name, count)
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的设备入站流量")
+    parser.add_argument("file", help="SIM_RECORD_FILE 录制的文件")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示尽可能快")
+    parser.add_argument("--device", action="append", choices=list(record.DEVICE_NAMES.values()),
+                        help="只回放指定设备，可重复，默认全部")
+    parser.add_argument("--host", default="localhost", help="磨粉机/咖啡机/制冰机所在主机")
+    parser.add_argument("--grinder-port", type=int, default=shop_port("GRINDER_PORT", 502))
+    parser.add_argument("--coffee-port", type=int, default=shop_port("COFFEE_PORT", 8888))
+    parser.add_argument("--ice-port", type=int, default=shop_port("ICE_PORT", 102))
+    parser.add_argument("--mqtt-host", default=os.getenv("MQTT_HOST", "localhost"))
+    parser.add_argument("--mqtt-port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    args = parser.parse_args()
+    try:
+        replay(args.file, args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
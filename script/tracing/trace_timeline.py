@@ -0,0 +1,130 @@
+'''
+按订单拼接各设备的 span，生成每单的关键路径时间线
+- 读取一个或多个 SIM_TRACE_FILE 文件（各模拟器可写同一个文件，也可各写一个），按订单号分组
+- 关键路径：从最后结束的 span 开始，逐步向前选择在其开始之前结束、且结束最晚的 span；
+  相邻两段之间的空隙记为"等待"（网关处理、排队与轮询间隔）
+- 输出各阶段耗时统计、等待占比最高的订单以及单个订单的详细时间线
+用法：
+    python trace_timeline.py spans.jsonl                        # 汇总 + 最慢的 10 单
+    python trace_timeline.py grinder.jsonl coffee.jsonl ice.jsonl robot.jsonl --order 1024
+    python trace_timeline.py spans.jsonl --json timelines.json --top 0
+'''
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+# 共享模块位于 script/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.stats import percentile
+from common.trace import read_spans
+
+
+def load(paths):
+    """读取全部文件，返回 {订单号: [span, ...]}，每单内按开始时间排序"""
+    orders = defaultdict(list)
+    for path in paths:
+        for span in read_spans(path):
+            orders[span["trace"]].append(span)
+    for spans in orders.values():
+        spans.sort(key=lambda s: (s["start"], s["end"]))
+    return orders
+
+
+def critical_path(spans):
+    """返回关键路径上的 span 列表（按时间顺序）"""
+    remaining = sorted(spans, key=lambda s: s["end"])
+    path = [remaining.pop()]
+    while True:
+        before = [s for s in remaining if s["end"] <= path[-1]["start"]]
+        if not before:
+            break
+        path.append(before[-1])
+        remaining = remaining[:remaining.index(before[-1])]
+    return path[::-1]
+
+
+def timeline(trace_id, spans):
+    """一个订单的时间线：各 span 相对第一个 span 开始的偏移与耗时、关键路径与等待时间"""
+    origin = spans[0]["start"]
+    path = critical_path(spans)
+    on_path = {id(s) for s in path}
+    waits = [max(0.0, b["start"] - a["end"]) for a, b in zip(path, path[1:])]
+    total = max(s["end"] for s in spans) - origin
+    return {
+        "trace": trace_id,
+        "start": origin,
+        "total_s": total,
+        "wait_s": sum(waits),
+        "spans": [{
+            "device": s["device"], "span": s["span"],
+            "offset_s": round(s["start"] - origin, 3), "duration_s": round(s["end"] - s["start"], 3),
+            "critical": id(s) in on_path,
+            **{k: v for k, v in s.items() if k not in ("trace", "device", "span", "start", "end")},
+        } for s in spans],
+    }
+
+
+def stage_summary(timelines):
+    """各阶段（设备/操作）耗时统计，以及等待时间统计"""
+    stages = defaultdict(list)
+    for t in timelines:
+        for s in t["spans"]:
+            stages[f'{s["device"]}/{s["span"]}'].append(s["duration_s"])
+        stages["(等待)"].append(t["wait_s"])
+        stages["(全程)"].append(t["total_s"])
+    return {name: {"count": len(v), "mean": sum(v) / len(v), "p50": percentile(v, 50), "p95": percentile(v, 95),
+                   "max": max(v)} for name, v in stages.items()}
+
+
+def print_summary(summary):
+    print(f"{'阶段':<24}{'次数':>8}{'均值 (s)':>10}{'P50 (s)':>10}{'P95 (s)':>10}{'最大 (s)':>10}")
+    for name, s in sorted(summary.items(), key=lambda kv: kv[0].startswith("(")):
+        print(f"{name:<26}{s['count']:>8}{s['mean']:>10.2f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['max']:>10.2f}")
+
+
+def print_timeline(t):
+    print(f"订单 {t['trace']}：全程 {t['total_s']:.2f} s，其中关键路径上的等待 {t['wait_s']:.2f} s")
+    for s in t["spans"]:
+        mark = "*" if s["critical"] else " "
+        bar = " " * min(60, int(s["offset_s"])) + "#" * max(1, min(60, int(s["duration_s"])))
+        print(f"  {mark} {s['offset_s']:>8.2f} {s['duration_s']:>7.2f}  {s['device'] + '/' + s['span']:<20} {bar}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按订单拼接设备 span，生成关键路径时间线")
+    parser.add_argument("files", nargs="+", help="SIM_TRACE_FILE 文件")
+    parser.add_argument("--order", type=int, help="只输出指定订单的时间线")
+    parser.add_argument("--top", type=int, default=10, help="输出全程最长的 N 单的时间线")
+    parser.add_argument("--json", help="把全部订单的时间线与阶段统计写入 JSON 文件")
+    args = parser.parse_args()
+
+    orders = load(args.files)
+    if not orders:
+        print("没有可用的 span")
+        return 1
+    if args.order is not None:
+        if args.order not in orders:
+            print(f"没有订单 {args.order} 的 span")
+            return 1
+        print_timeline(timeline(args.order, orders[args.order]))
+        return 0
+
+    timelines = [timeline(trace_id, spans) for trace_id, spans in orders.items()]
+    summary = stage_summary(timelines)
+    print(f"共 {len(timelines)} 单")
+    print_summary(summary)
+    for t in sorted(timelines, key=lambda t: t["total_s"], reverse=True)[:args.top]:
+        print()
+        print_timeline(t)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "orders": sorted(timelines, key=lambda t: t["start"])},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
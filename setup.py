@@ -139,6 +139,7 @@ setup(
     # 控制台脚本入口点
     entry_points={
         "console_scripts": [
+            "smartshop-sim=script.all_in_one.smartshop_sim:main",
             "grinder-sim=script.grinder.grinder_sim:main",
             "coffeemachine-sim=script.coffeemachine.coffeemachine_sim:main",
             "grinder-client=test.grinder.client_test:main",
@@ -10,16 +10,21 @@ import (
 )
 
 func main() {
+    // 每家门店运行一条流水线：SHOP_ID 决定领取的订单、设备默认端口、机器人话题与 AMQP 队列
+    // 默认端口与模拟器一致（script/common/shop.py），门店 1 本机的磨粉机 502 仍由 gateway.New 映射到容器端口 5021
+    shop := gateway.ShopID()
     cfg := gateway.Config{
         CoffeeHost: env("COFFEE_HOST", "localhost"),
-        CoffeePort: envInt("COFFEE_PORT", 8888),
+        CoffeePort: gateway.ShopPort("COFFEE_PORT", 8888),
         GrinderHost: env("GRINDER_HOST", "localhost"),
-        GrinderPort: envInt("GRINDER_PORT", 5021),
+        GrinderPort: gateway.ShopPort("GRINDER_PORT", 502),
         IceHost: env("ICE_HOST", "localhost"),
+        IcePort: gateway.ShopPort("ICE_PORT", 102),
         IceRack: envInt("ICE_RACK", 0),
         IceSlot: envInt("ICE_SLOT", 2),
         MqttHost: env("MQTT_HOST", "localhost"),
         MqttPort: envInt("MQTT_PORT", 1883),
+        TopicPrefix: gateway.TopicPrefix(shop),
     }
     g := gateway.New(cfg)
 
@@ -43,7 +48,7 @@ func main() {
 
     for {
         time.Sleep(2 * time.Second)
-        fmt.Println("-- progress snapshot --")
+        fmt.Println("-- progress snapshot shop", shop, "--")
         for _, o := range db.All() {
             if o.Status == "error" {
                 fmt.Println(o.ID, o.CoffeeType, o.BoolIce, o.TableNum, o.Status, o.ErrorMsg)
@@ -4,6 +4,8 @@ import (
 	"bufio"
 	"errors"
 	"net"
+	"sort"
+	"strconv"
 	"strings"
 	"time"
 )
@@ -63,12 +65,25 @@ func (c *CoffeeMachine) send(cmd string) (string, error) {
 }
 
 func (c *CoffeeMachine) Make(t string) error {
+	return c.MakeTraced(t, 0)
+}
+
+// traced 为指令附加订单号后缀（MAKE:LATTE:1024），trace 为 0 时保持原格式
+func traced(cmd string, trace int) string {
+	if trace <= 0 {
+		return cmd
+	}
+	return cmd + ":" + itoa(trace)
+}
+
+// MakeTraced 与 Make 相同，制作与补料指令都携带订单号 trace
+func (c *CoffeeMachine) MakeTraced(t string, trace int) error {
 	conn, err := c.conn()
 	if err != nil {
 		return err
 	}
 	defer conn.Close()
-	if _, err = conn.Write([]byte("MAKE:" + t + "\n")); err != nil {
+	if _, err = conn.Write([]byte(traced("MAKE:"+t, trace) + "\n")); err != nil {
 		return err
 	}
 	r := bufio.NewReader(conn)
@@ -79,11 +94,11 @@ func (c *CoffeeMachine) Make(t string) error {
 		}
 		line = strings.TrimSpace(line)
 		if strings.HasPrefix(line, "ERROR:INSUFFICIENT_INGREDIENT") {
-			if err := c.RefillAll(); err != nil {
+			if err := c.refillAll(trace); err != nil {
 				return err
 			}
 			time.Sleep(500 * time.Millisecond)
-			if _, err = conn.Write([]byte("MAKE:" + t + "\n")); err != nil {
+			if _, err = conn.Write([]byte(traced("MAKE:"+t, trace) + "\n")); err != nil {
 				return err
 			}
 			continue
@@ -98,7 +113,11 @@ func (c *CoffeeMachine) Make(t string) error {
 }
 
 func (c *CoffeeMachine) RefillAll() error {
-	resp, err := c.send("REFILL:ALL")
+	return c.refillAll(0)
+}
+
+func (c *CoffeeMachine) refillAll(trace int) error {
+	resp, err := c.send(traced("REFILL:ALL", trace))
 	if err != nil {
 		return err
 	}
@@ -107,3 +126,52 @@ func (c *CoffeeMachine) RefillAll() error {
 	}
 	return nil
 }
+
+// MaxServings 查询按当前库存每种咖啡最多还能做的杯数，-1 表示不消耗原料（不限）
+func (c *CoffeeMachine) MaxServings() (map[string]int, error) {
+	resp, err := c.send("PLAN:MAX")
+	if err != nil {
+		return nil, err
+	}
+	if !strings.HasPrefix(resp, "PLAN:MAX:") {
+		return nil, errors.New(resp)
+	}
+	return parsePlanCounts(strings.TrimPrefix(resp, "PLAN:MAX:"))
+}
+
+// Plan 查询订单组合 {咖啡类型: 杯数} 能否用当前库存完成，不可行时返回各原料缺口
+func (c *CoffeeMachine) Plan(mix map[string]int) (bool, map[string]int, error) {
+	items := make([]string, 0, len(mix))
+	for t, n := range mix {
+		items = append(items, t+"="+itoa(n))
+	}
+	sort.Strings(items)
+	resp, err := c.send("PLAN:" + strings.Join(items, ","))
+	if err != nil {
+		return false, nil, err
+	}
+	if resp == "PLAN:FEASIBLE" {
+		return true, nil, nil
+	}
+	if strings.HasPrefix(resp, "PLAN:INFEASIBLE:") {
+		shortage, err := parsePlanCounts(strings.TrimPrefix(resp, "PLAN:INFEASIBLE:"))
+		return false, shortage, err
+	}
+	return false, nil, errors.New(resp)
+}
+
+func parsePlanCounts(s string) (map[string]int, error) {
+	out := map[string]int{}
+	for _, item := range strings.Split(s, ",") {
+		k, v, ok := strings.Cut(item, "=")
+		if !ok {
+			return nil, errors.New("invalid plan item: " + item)
+		}
+		n, err := strconv.Atoi(v)
+		if err != nil {
+			return nil, err
+		}
+		out[k] = n
+	}
+	return out, nil
+}
@@ -1,6 +1,7 @@
 package gateway
 
 import (
+	"encoding/binary"
 	"errors"
 	"time"
 
@@ -30,6 +31,21 @@ const (
 	cmdReg       = 0
 	statusReg    = 1
 	beanLevelReg = 2
+	doseCountReg = 4
+	dosesDoneReg = 5
+	mbCmdReg     = 6
+	mbQueueDepth = 11
+	traceIDReg   = 12 // 订单号，2 个寄存器，高 16 位在前；按连接生效，只关联随后的一条命令
+	mbNextSeq    = 14 // 读取时由设备分配新的信箱序号
+	mbAckHistory = 16 // 最近完成的序号，之后 depth 个寄存器为对应的结果码
+)
+
+// 信箱命令结果码，与 ERROR_CODE_REG 一致
+const (
+	mbResultOK      = 0
+	mbResultNoBeans = 1
+	mbResultFault   = 2
+	mbResultDropped = 3 // 模拟器故障注入丢弃，命令未执行
 )
 
 func (g *Grinder) readU16(c modbus.Client, addr uint16) (uint16, error) {
@@ -45,6 +61,17 @@ func (g *Grinder) writeU16(c modbus.Client, addr uint16, val uint16) error {
 	return err
 }
 
+// writeTrace 在同一连接上写入订单号，随后写入的命令关联到该订单；trace 为 0 时不写
+func (g *Grinder) writeTrace(c modbus.Client, trace int) error {
+	if trace <= 0 {
+		return nil
+	}
+	b := make([]byte, 4)
+	binary.BigEndian.PutUint32(b, uint32(trace))
+	_, err := c.WriteMultipleRegisters(traceIDReg, 2, b)
+	return err
+}
+
 func (g *Grinder) Restock() error {
 	c, close, err := g.client()
 	if err != nil {
@@ -68,6 +95,11 @@ func (g *Grinder) Restock() error {
 }
 
 func (g *Grinder) GrindAuto() error {
+	return g.GrindAutoTraced(0)
+}
+
+// GrindAutoTraced 与 GrindAuto 相同，补豆与磨粉命令都携带订单号 trace
+func (g *Grinder) GrindAutoTraced(trace int) error {
 	c, close, err := g.client()
 	if err != nil {
 		return err
@@ -82,6 +114,9 @@ func (g *Grinder) GrindAuto() error {
 		return err
 	}
 	if s == 2 || level < 10 {
+		if err := g.writeTrace(c, trace); err != nil {
+			return err
+		}
 		if err := g.writeU16(c, cmdReg, 2); err != nil {
 			return err
 		}
@@ -96,6 +131,9 @@ func (g *Grinder) GrindAuto() error {
 			time.Sleep(200 * time.Millisecond)
 		}
 	}
+	if err := g.writeTrace(c, trace); err != nil {
+		return err
+	}
 	if err := g.writeU16(c, cmdReg, 1); err != nil {
 		return err
 	}
@@ -111,3 +149,158 @@ func (g *Grinder) GrindAuto() error {
 	}
 	return errors.New("grind_timeout")
 }
+
+// GrindDoses 一次命令连续磨 n 份粉：写入份数寄存器后下发磨粉命令，只轮询一次直至空闲
+// 豆量不足时先自动补豆；返回前检查已完成份数，不足 n 份视为失败
+func (g *Grinder) GrindDoses(n int) error {
+	if n < 1 {
+		return errors.New("invalid_dose_count")
+	}
+	c, close, err := g.client()
+	if err != nil {
+		return err
+	}
+	defer close()
+	level, err := g.readU16(c, beanLevelReg)
+	if err != nil {
+		return err
+	}
+	s, err := g.readU16(c, statusReg)
+	if err != nil {
+		return err
+	}
+	if s == 2 || level < 10 {
+		if err := g.writeU16(c, cmdReg, 2); err != nil {
+			return err
+		}
+		for {
+			s2, err := g.readU16(c, statusReg)
+			if err != nil {
+				return err
+			}
+			if s2 == 0 {
+				break
+			}
+			time.Sleep(200 * time.Millisecond)
+		}
+	}
+	if err := g.writeU16(c, doseCountReg, uint16(n)); err != nil {
+		return err
+	}
+	if err := g.writeU16(c, cmdReg, 1); err != nil {
+		return err
+	}
+	// 模拟器在命令处理结束后才把命令寄存器清零，以此判断本次命令已完成
+	for i := 0; i < 50*n; i++ {
+		s3, err := g.readU16(c, statusReg)
+		if err != nil {
+			return err
+		}
+		if s3 == 2 {
+			return errors.New("grind_fault")
+		}
+		cmd, err := g.readU16(c, cmdReg)
+		if err != nil {
+			return err
+		}
+		if s3 == 0 && cmd == 0 {
+			done, err := g.readU16(c, dosesDoneReg)
+			if err != nil {
+				return err
+			}
+			if int(done) < n {
+				return errors.New("grind_partial")
+			}
+			return nil
+		}
+		time.Sleep(200 * time.Millisecond)
+	}
+	return errors.New("grind_timeout")
+}
+
+// submitMailbox 向设备申请序号并用一次 FC16 写入命令槽(命令/份数/序号)，返回序号；
+// 序号由设备分配，多个网关进程或网关重启后都不会与排队中或最近完成的命令冲突；信箱满(异常 0x06)时稍后重试
+func (g *Grinder) submitMailbox(c modbus.Client, cmd, n uint16) (uint16, error) {
+	seq, err := g.readU16(c, mbNextSeq)
+	if err != nil {
+		return 0, err
+	}
+	if seq == 0 {
+		return 0, errors.New("mailbox_seq_unavailable")
+	}
+	slot := make([]byte, 6)
+	binary.BigEndian.PutUint16(slot[0:], cmd)
+	binary.BigEndian.PutUint16(slot[2:], n)
+	binary.BigEndian.PutUint16(slot[4:], seq)
+	for i := 0; ; i++ {
+		_, err := c.WriteMultipleRegisters(mbCmdReg, 3, slot)
+		if err == nil {
+			return seq, nil
+		}
+		var me *modbus.ModbusError
+		if !errors.As(err, &me) || me.ExceptionCode != modbus.ExceptionCodeServerDeviceBusy || i >= 50 {
+			return 0, err
+		}
+		time.Sleep(200 * time.Millisecond)
+	}
+}
+
+// GrindQueued 通过命令信箱提交 n 份磨粉，命令排队执行不会被其他 worker 覆盖
+// 豆量不足或处于故障时先在信箱中排入补豆命令（先进先出，补豆先于本次磨粉执行）；
+// 在最近完成序号列表中出现本序号即表示执行结束，结果码非 0 时返回错误
+func (g *Grinder) GrindQueued(n int) error {
+	if n < 1 {
+		return errors.New("invalid_dose_count")
+	}
+	c, close, err := g.client()
+	if err != nil {
+		return err
+	}
+	defer close()
+	level, err := g.readU16(c, beanLevelReg)
+	if err != nil {
+		return err
+	}
+	s, err := g.readU16(c, statusReg)
+	if err != nil {
+		return err
+	}
+	if s == 2 || level < 10 {
+		if _, err := g.submitMailbox(c, 2, 0); err != nil {
+			return err
+		}
+	}
+	seq, err := g.submitMailbox(c, 1, uint16(n))
+	if err != nil {
+		return err
+	}
+	depth, err := g.readU16(c, mbQueueDepth)
+	if err != nil {
+		return err
+	}
+	for i := 0; i < 50*n*int(depth+1); i++ {
+		b, err := c.ReadHoldingRegisters(mbAckHistory, 2*depth)
+		if err != nil {
+			return err
+		}
+		for j := 0; j < int(depth) && 2*(int(depth)+j)+1 < len(b); j++ {
+			if binary.BigEndian.Uint16(b[2*j:]) != seq {
+				continue
+			}
+			switch binary.BigEndian.Uint16(b[2*(int(depth)+j):]) {
+			case mbResultOK:
+				return nil
+			case mbResultNoBeans:
+				return errors.New("grind_no_beans")
+			case mbResultFault:
+				return errors.New("grind_fault")
+			case mbResultDropped:
+				return errors.New("grind_dropped")
+			default:
+				return errors.New("grind_failed")
+			}
+		}
+		time.Sleep(200 * time.Millisecond)
+	}
+	return errors.New("grind_timeout")
+}
@@ -2,6 +2,7 @@ package gateway
 
 import (
     "encoding/binary"
+    "net"
     "time"
     gos7 "github.com/robinson/gos7"
 )
@@ -9,14 +10,26 @@ import (
 // IceMaker 通过 S7 协议访问制冰机的 DB1
 // DB1 布局（偏移字节）:
 // 0: 库存(int)  2: 状态(int)  4: 指令(int)  6: 出冰量(int)
+// 8: 变化序号(word)  10: 最近完成的指令(int)
+// 12: 订单号(dword，写指令前写入，完成后由设备清零)
+// Port 为 0 时使用 S7 默认端口 102；多门店时门店 N 的制冰机端口为 102 + 1000*(N-1)，见 ShopPort
 type IceMaker struct {
     Host string
+    Port int
     Rack int
     Slot int
 }
 
+func (i *IceMaker) addr() string {
+    port := i.Port
+    if port == 0 {
+        port = 102
+    }
+    return net.JoinHostPort(i.Host, itoa(port))
+}
+
 func (i *IceMaker) handler() (*gos7.TCPClientHandler, error) {
-    h := gos7.NewTCPClientHandler(i.Host, i.Rack, i.Slot)
+    h := gos7.NewTCPClientHandler(i.addr(), i.Rack, i.Slot)
     h.Timeout = 10 * time.Second
     h.IdleTimeout = 10 * time.Second
     if err := h.Connect(); err != nil {
@@ -39,7 +52,31 @@ func (i *IceMaker) writeInt(client gos7.Client, db int, start int, v int) error
     return client.AGWriteDB(db, start, 2, b)
 }
 
+// readChange 只读取变化序号与最近完成的指令，序号不变时无需读取其他字段
+func (i *IceMaker) readChange(client gos7.Client) (int, int, error) {
+    buf := make([]byte, 4)
+    if err := client.AGReadDB(1, 8, 4, buf); err != nil {
+        return 0, 0, err
+    }
+    return int(binary.BigEndian.Uint16(buf[0:2])), int(int16(binary.BigEndian.Uint16(buf[2:4]))), nil
+}
+
+// writeTrace 在写指令前写入订单号，trace 为 0 时不写
+func (i *IceMaker) writeTrace(client gos7.Client, trace int) error {
+    if trace <= 0 {
+        return nil
+    }
+    b := make([]byte, 4)
+    binary.BigEndian.PutUint32(b, uint32(trace))
+    return client.AGWriteDB(1, 12, 4, b)
+}
+
 func (i *IceMaker) ProduceUntil(min int) error {
+    return i.ProduceUntilTraced(min, 0)
+}
+
+// ProduceUntilTraced 与 ProduceUntil 相同，制冰指令携带订单号 trace
+func (i *IceMaker) ProduceUntilTraced(min int, trace int) error {
     h, err := i.handler()
     if err != nil {
         return err
@@ -53,6 +90,9 @@ func (i *IceMaker) ProduceUntil(min int) error {
     if inv >= min {
         return nil
     }
+    if err := i.writeTrace(c, trace); err != nil {
+        return err
+    }
     if err := i.writeInt(c, 1, 4, 1); err != nil {
         return err
     }
@@ -70,6 +110,11 @@ func (i *IceMaker) ProduceUntil(min int) error {
 }
 
 func (i *IceMaker) Dispense(amount int) error {
+    return i.DispenseTraced(amount, 0)
+}
+
+// DispenseTraced 与 Dispense 相同，出冰指令携带订单号 trace
+func (i *IceMaker) DispenseTraced(amount int, trace int) error {
     h, err := i.handler()
     if err != nil {
         return err
@@ -79,6 +124,9 @@ func (i *IceMaker) Dispense(amount int) error {
     if err := i.writeInt(c, 1, 6, amount); err != nil {
         return err
     }
+    if err := i.writeTrace(c, trace); err != nil {
+        return err
+    }
     if err := i.writeInt(c, 1, 4, 3); err != nil {
         return err
     }
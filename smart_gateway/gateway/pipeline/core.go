@@ -53,12 +53,12 @@ func (c *Core) release(ch chan struct{}) { ch <- struct{}{} }
 // process 执行四步工序，任一步失败都会发布 error 结果并停止该订单
 func (c *Core) process(ctx context.Context, o Order) {
     fmt.Println("order_start", o.ID, o.CoffeeType, o.BoolIce, o.TableNum)
-    if err := c.stepGrind(); err != nil { fmt.Println("grind_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
+    if err := c.stepGrind(o.ID); err != nil { fmt.Println("grind_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
     fmt.Println("grind_done", o.ID)
-    if err := c.stepBrew(o.CoffeeType); err != nil { fmt.Println("brew_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
+    if err := c.stepBrew(o.CoffeeType, o.ID); err != nil { fmt.Println("brew_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
     fmt.Println("brew_done", o.ID, o.CoffeeType)
     if o.BoolIce {
-        if err := c.stepIce(); err != nil { fmt.Println("ice_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
+        if err := c.stepIce(o.ID); err != nil { fmt.Println("ice_error", o.ID, err.Error()); _ = c.Q.PublishResult(Result{ID: o.ID, BoolIsDone: false, FinishTime: time.Now(), ErrorMsg: err.Error()}); return }
         fmt.Println("ice_done", o.ID, c.IceDispense)
     }
     if err := c.stepDeliver(o); err != nil {
@@ -76,27 +76,28 @@ func (c *Core) process(ctx context.Context, o Order) {
     fmt.Println("order_done", o.ID)
 }
 
-// stepGrind 占用磨豆机并进行自动磨豆
-func (c *Core) stepGrind() error {
+// stepGrind 占用磨豆机并进行自动磨豆，各设备指令都携带订单号，便于按订单拼接时间线
+func (c *Core) stepGrind(id int) error {
     c.acquire(c.grinder); defer c.release(c.grinder)
-    return c.Grinder.GrindAuto()
+    return c.Grinder.GrindAutoTraced(id)
 }
 
 // stepBrew 占用咖啡机进行制作
-func (c *Core) stepBrew(coffeeType string) error {
+func (c *Core) stepBrew(coffeeType string, id int) error {
     c.acquire(c.brewer); defer c.release(c.brewer)
-    return c.Coffee.Make(coffeeType)
+    return c.Coffee.MakeTraced(coffeeType, id)
 }
 
 // stepIce 占用制冰机，先补足库存再按指定量出冰
-func (c *Core) stepIce() error {
+func (c *Core) stepIce(id int) error {
     c.acquire(c.icemaker); defer c.release(c.icemaker)
-    if err := c.Ice.ProduceUntil(c.IceMin); err != nil { return err }
-    return c.Ice.Dispense(c.IceDispense)
+    if err := c.Ice.ProduceUntilTraced(c.IceMin, id); err != nil { return err }
+    return c.Ice.DispenseTraced(c.IceDispense, id)
 }
 
 // stepDeliver 占用送餐机器人并发送配送任务（3s 内未回执视为超时）
 func (c *Core) stepDeliver(o Order) error {
     c.acquire(c.robot); defer c.release(c.robot)
-    return c.Robot.Deliver(o.CoffeeType, o.BoolIce, o.TableNum)
+    _, err := c.Robot.DeliverOrder(o.ID, o.CoffeeType, o.BoolIce, o.TableNum, 0, time.Time{})
+    return err
 }
\ No newline at end of file
@@ -5,13 +5,16 @@ import (
     "database/sql"
     "fmt"
     "os"
+    "smart_gateway/gateway"
     "time"
     _ "github.com/go-sql-driver/mysql"
 )
 
+// SQLDB 只处理 SHOP_ID 指定门店的订单，各门店的流水线可独立部署扩容
 type SQLDB struct {
     db     *sql.DB
     driver string
+    shop   int
 }
 
 func NewSQLDB() (*SQLDB, error) {
@@ -34,7 +37,7 @@ func NewSQLDB() (*SQLDB, error) {
     }
     if err != nil { return nil, err }
     if err = db.Ping(); err != nil { return nil, err }
-    s := &SQLDB{db: db, driver: driver}
+    s := &SQLDB{db: db, driver: driver, shop: gateway.ShopID()}
     if err = s.ensureSchema(context.Background()); err != nil { return nil, err }
     return s, nil
 }
@@ -43,6 +46,7 @@ func (s *SQLDB) ensureSchema(ctx context.Context) error {
     if s.driver == "mysql" {
         if _, err := s.db.ExecContext(ctx, `CREATE TABLE IF NOT EXISTS orders (
   id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  shop_id INT NOT NULL DEFAULT 1,
   coffee_type VARCHAR(32) NOT NULL,
   bool_ice TINYINT(1) NOT NULL,
   table_num INT NOT NULL,
@@ -51,12 +55,12 @@ func (s *SQLDB) ensureSchema(ctx context.Context) error {
   finish_time TIMESTAMP NULL,
   error_msg TEXT
 )`); err != nil { return err }
-        if _, err := s.db.ExecContext(ctx, `CREATE INDEX idx_orders_status_ctime ON orders(status, create_time)`); err != nil { return err }
-        return nil
+        return s.migrateMySQL(ctx)
     }
     ddl := `
 CREATE TABLE IF NOT EXISTS orders (
   id BIGSERIAL PRIMARY KEY,
+  shop_id INT NOT NULL DEFAULT 1,
   coffee_type VARCHAR(32) NOT NULL,
   bool_ice BOOLEAN NOT NULL,
   table_num INT NOT NULL,
@@ -65,19 +69,51 @@ CREATE TABLE IF NOT EXISTS orders (
   finish_time TIMESTAMPTZ,
   error_msg TEXT
 );
-CREATE INDEX IF NOT EXISTS idx_orders_status_ctime ON orders(status, create_time DESC);`
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS shop_id INT NOT NULL DEFAULT 1;
+CREATE INDEX IF NOT EXISTS idx_orders_status_ctime ON orders(status, create_time DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_shop_pending ON orders(shop_id, create_time) WHERE status='pending';
+DROP INDEX IF EXISTS idx_orders_pending;`
     _, err := s.db.ExecContext(ctx, ddl)
     return err
 }
 
+// migrateMySQL 补齐单店时建立的 MySQL 表：MySQL 不支持 ADD COLUMN/CREATE INDEX IF NOT EXISTS，
+// 先查 information_schema 再执行；轮询索引加入 shop_id 后改名为 idx_orders_shop_status_ctime，并删除旧索引
+func (s *SQLDB) migrateMySQL(ctx context.Context) error {
+    exists := func(query string, args ...interface{}) (bool, error) {
+        var n int
+        if err := s.db.QueryRowContext(ctx, query, args...).Scan(&n); err != nil { return false, err }
+        return n > 0, nil
+    }
+    hasColumn, err := exists(`SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='orders' AND COLUMN_NAME='shop_id'`)
+    if err != nil { return err }
+    if !hasColumn {
+        if _, err := s.db.ExecContext(ctx, `ALTER TABLE orders ADD COLUMN shop_id INT NOT NULL DEFAULT 1 AFTER id`); err != nil { return err }
+    }
+    indexExists := func(name string) (bool, error) {
+        return exists(`SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='orders' AND INDEX_NAME=?`, name)
+    }
+    hasIndex, err := indexExists("idx_orders_shop_status_ctime")
+    if err != nil { return err }
+    if !hasIndex {
+        if _, err := s.db.ExecContext(ctx, `CREATE INDEX idx_orders_shop_status_ctime ON orders(shop_id, status, create_time)`); err != nil { return err }
+    }
+    hasOld, err := indexExists("idx_orders_status_ctime")
+    if err != nil { return err }
+    if hasOld {
+        if _, err := s.db.ExecContext(ctx, `DROP INDEX idx_orders_status_ctime ON orders`); err != nil { return err }
+    }
+    return nil
+}
+
 func (s *SQLDB) PollPending(limit int) ([]Order, error) {
     tx, err := s.db.Begin()
     if err != nil { return nil, err }
     var rows *sql.Rows
     if s.driver == "mysql" {
-        rows, err = tx.Query(`SELECT id, coffee_type, bool_ice, table_num, create_time FROM orders WHERE status='pending' ORDER BY create_time ASC LIMIT ? FOR UPDATE`, limit)
+        rows, err = tx.Query(`SELECT id, coffee_type, bool_ice, table_num, create_time FROM orders WHERE status='pending' AND shop_id=? ORDER BY create_time ASC LIMIT ? FOR UPDATE`, s.shop, limit)
     } else {
-        rows, err = tx.Query(`SELECT id, coffee_type, bool_ice, table_num, create_time FROM orders WHERE status='pending' ORDER BY create_time ASC FOR UPDATE SKIP LOCKED LIMIT $1`, limit)
+        rows, err = tx.Query(`SELECT id, coffee_type, bool_ice, table_num, create_time FROM orders WHERE status='pending' AND shop_id=$1 ORDER BY create_time ASC FOR UPDATE SKIP LOCKED LIMIT $2`, s.shop, limit)
     }
     if err != nil { tx.Rollback(); return nil, err }
     var res []Order
@@ -87,6 +123,7 @@ func (s *SQLDB) PollPending(limit int) ([]Order, error) {
         var ct time.Time
         if err = rows.Scan(&o.ID, &o.CoffeeType, &o.BoolIce, &o.TableNum, &ct); err != nil { rows.Close(); tx.Rollback(); return nil, err }
         o.CreateTime = ct
+        o.ShopID = s.shop
         o.Status = "pending"
         res = append(res, o)
         ids = append(ids, o.ID)
@@ -119,15 +156,19 @@ func (s *SQLDB) UpdateResult(res Result) error {
 func (s *SQLDB) Seed(orders []Order) {
     for i := range orders {
         if s.driver == "mysql" {
-            _, _ = s.db.Exec(`INSERT INTO orders(coffee_type, bool_ice, table_num, status, create_time) VALUES(?,?,?,'pending',NOW())`, orders[i].CoffeeType, orders[i].BoolIce, orders[i].TableNum)
+            _, _ = s.db.Exec(`INSERT INTO orders(shop_id, coffee_type, bool_ice, table_num, status, create_time) VALUES(?,?,?,?,'pending',NOW())`, s.shop, orders[i].CoffeeType, orders[i].BoolIce, orders[i].TableNum)
         } else {
-            _, _ = s.db.Exec(`INSERT INTO orders(coffee_type, bool_ice, table_num, status, create_time) VALUES($1,$2,$3,'pending',NOW())`, orders[i].CoffeeType, orders[i].BoolIce, orders[i].TableNum)
+            _, _ = s.db.Exec(`INSERT INTO orders(shop_id, coffee_type, bool_ice, table_num, status, create_time) VALUES($1,$2,$3,$4,'pending',NOW())`, s.shop, orders[i].CoffeeType, orders[i].BoolIce, orders[i].TableNum)
         }
     }
 }
 
 func (s *SQLDB) All() []Order {
-    rows, err := s.db.Query(`SELECT id, coffee_type, bool_ice, table_num, status, create_time, finish_time, COALESCE(error_msg,'') FROM orders ORDER BY id`)
+    query := `SELECT id, coffee_type, bool_ice, table_num, status, create_time, finish_time, COALESCE(error_msg,'') FROM orders WHERE shop_id=$1 ORDER BY id`
+    if s.driver == "mysql" {
+        query = `SELECT id, coffee_type, bool_ice, table_num, status, create_time, finish_time, COALESCE(error_msg,'') FROM orders WHERE shop_id=? ORDER BY id`
+    }
+    rows, err := s.db.Query(query, s.shop)
     if err != nil { return nil }
     defer rows.Close()
     var res []Order
@@ -138,6 +179,7 @@ func (s *SQLDB) All() []Order {
         var em string
         if err = rows.Scan(&o.ID, &o.CoffeeType, &o.BoolIce, &o.TableNum, &o.Status, &ct, &ft, &em); err != nil { return res }
         o.CreateTime = ct
+        o.ShopID = s.shop
         if ft.Valid { o.FinishTime = ft.Time }
         o.ErrorMsg = em
         res = append(res, o)
@@ -6,6 +6,7 @@ import "time"
 // Status: pending→queued→done/error；FinishTime/ErrorMsg 用于记录结果
 type Order struct {
     ID int
+    ShopID int
     CoffeeType string
     BoolIce bool
     TableNum int
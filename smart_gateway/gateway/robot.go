@@ -8,24 +8,74 @@ import (
 )
 
 // DeliveryRobot 通过 MQTT 与送餐机器人交互
-// 发布主题: test/delivery_robot/command ；确认主题: test/delivery_robot/status
+// 发布主题: <TopicPrefix>/delivery_robot/command ；确认主题: <TopicPrefix>/delivery_robot/status
+// TopicPrefix 为空时使用门店 1 的 "test"
 type DeliveryRobot struct {
     Host string
     Port int
+    TopicPrefix string
 }
 
 func (d *DeliveryRobot) broker() string {
     return fmt.Sprintf("tcp://%s:%d", d.Host, d.Port)
 }
 
+func (d *DeliveryRobot) topic(name string) string {
+    prefix := d.TopicPrefix
+    if prefix == "" {
+        prefix = TopicPrefix(DefaultShop)
+    }
+    return prefix + "/delivery_robot/" + name
+}
+
+// DeliveryStatus 机器人状态消息；QueueDepth 为机器人调度队列中的排队数，
+// ExpectedStart 为 RECEIVED 确认中给出的预计开始配送时间（Unix 秒）；
+// Duplicate 表示机器人已收到过该订单，Status 为该订单最近一次的状态，本次指令没有再次执行；
+// Suppressed 为机器人启动以来抑制的重复指令数
+type DeliveryStatus struct {
+    OrderID       int     `json:"order_id"`
+    Status        string  `json:"status"`
+    TableNumber   int     `json:"table_number"`
+    QueueDepth    int     `json:"queue_depth"`
+    ExpectedStart float64 `json:"expected_start"`
+    Duplicate     bool    `json:"duplicate"`
+    Suppressed    int     `json:"suppressed"`
+}
+
+// parseStatuses 解析状态消息（单个对象或批量数组）
+func parseStatuses(b []byte) []DeliveryStatus {
+    var many []DeliveryStatus
+    if err := json.Unmarshal(b, &many); err == nil {
+        return many
+    }
+    var one DeliveryStatus
+    if err := json.Unmarshal(b, &one); err == nil {
+        return []DeliveryStatus{one}
+    }
+    return nil
+}
+
+// Deliver 发送不带订单号的配送任务（order_id 为 0，机器人不做重复指令抑制）
 func (d *DeliveryRobot) Deliver(coffeeType string, needIce bool, table int) error {
-    ack := make(chan struct{}, 1)
+    _, err := d.DeliverOrder(0, coffeeType, needIce, table, 0, time.Time{})
+    return err
+}
+
+// DeliverOrder 发送配送任务并等待本单的接收确认
+// priority 越大越先配送；deadline 为零值时不设截止时间；返回的确认中带有排队数与预计开始时间，
+// 调用方可据此在超时前分流或放弃订单；超时后用同一 id 重试是安全的，机器人对已收到的订单只回复其最近状态
+func (d *DeliveryRobot) DeliverOrder(id int, coffeeType string, needIce bool, table int, priority int, deadline time.Time) (DeliveryStatus, error) {
+    ack := make(chan DeliveryStatus, 1)
     opts := mqtt.NewClientOptions().AddBroker(d.broker())
     opts.SetAutoReconnect(true)
     opts.SetConnectionLostHandler(func(mqtt.Client, error) {})
     opts.SetOnConnectHandler(func(c mqtt.Client) {
-        st := c.Subscribe("test/delivery_robot/status", 1, func(_ mqtt.Client, _ mqtt.Message) {
-            select { case ack <- struct{}{}: default: }
+        st := c.Subscribe(d.topic("status"), 1, func(_ mqtt.Client, m mqtt.Message) {
+            for _, s := range parseStatuses(m.Payload()) {
+                if s.OrderID == id && (s.Status == "RECEIVED" || s.Duplicate) {
+                    select { case ack <- s: default: }
+                }
+            }
         })
         st.Wait()
     })
@@ -33,27 +83,41 @@ func (d *DeliveryRobot) Deliver(coffeeType string, needIce bool, table int) erro
     ct := c.Connect()
     ct.Wait()
     if ct.Error() != nil {
-        return ct.Error()
+        return DeliveryStatus{}, ct.Error()
     }
     defer c.Disconnect(250)
     payload := map[string]any{
-        "order_id": 1,
+        "order_id": id,
         "coffee_type": coffeeType,
         "need_ice": needIce,
         "table_number": table,
     }
+    if priority != 0 {
+        payload["priority"] = priority
+    }
+    if !deadline.IsZero() {
+        payload["deadline"] = float64(deadline.UnixMilli()) / 1000
+    }
     b, _ := json.Marshal(payload)
     fmt.Println("deliver_publish", string(b))
-    pt := c.Publish("test/delivery_robot/command", 0, false, b)
+    pt := c.Publish(d.topic("command"), 0, false, b)
     pt.Wait()
     if err := pt.Error(); err != nil {
-        return err
+        return DeliveryStatus{}, err
     }
     select {
-    case <-ack:
-        fmt.Println("deliver_ack")
-        return nil
+    case s := <-ack:
+        fmt.Println("deliver_ack", id, "status", s.Status, "duplicate", s.Duplicate, "queue_depth", s.QueueDepth, "expected_start", s.ExpectedStart)
+        // 重复指令的回复为该订单最近一次的状态，只有已接收或已送达才算成功
+        switch s.Status {
+        case "RECEIVED", "DELIVERY_COMPLETE":
+            return s, nil
+        case "DELIVERY_FAILED":
+            return s, fmt.Errorf("deliver_failed")
+        default:
+            return s, fmt.Errorf("deliver_unexpected_status: %s", s.Status)
+        }
     case <-time.After(10 * time.Second):
-        return fmt.Errorf("deliver_timeout")
+        return DeliveryStatus{}, fmt.Errorf("deliver_timeout")
     }
-}
\ No newline at end of file
+}
@@ -19,8 +19,8 @@ func New(cfg Config) *Gateway {
         cfg: cfg,
         coffee: &CoffeeMachine{Host: cfg.CoffeeHost, Port: cfg.CoffeePort},
         grinder: &Grinder{Host: cfg.GrinderHost, Port: cfg.GrinderPort},
-        ice: &IceMaker{Host: cfg.IceHost, Rack: cfg.IceRack, Slot: cfg.IceSlot},
-        robot: &DeliveryRobot{Host: cfg.MqttHost, Port: cfg.MqttPort},
+        ice: &IceMaker{Host: cfg.IceHost, Port: cfg.IcePort, Rack: cfg.IceRack, Slot: cfg.IceSlot},
+        robot: &DeliveryRobot{Host: cfg.MqttHost, Port: cfg.MqttPort, TopicPrefix: cfg.TopicPrefix},
     }
     if g.grinder.Port == 502 && (g.grinder.Host == "localhost" || g.grinder.Host == "127.0.0.1") {
         g.grinder.Port = 5021
@@ -0,0 +1,39 @@
+package gateway
+
+import (
+    "fmt"
+    "os"
+    "strconv"
+)
+
+// 多门店分片，与 script/common/shop.py 保持一致：
+// SHOP_ID 缺省为 1；未显式设置端口环境变量时，默认端口加 (SHOP_ID-1)*SHOP_PORT_STRIDE（默认 1000）；
+// 门店 1 的机器人话题为 test/delivery_robot/...，其他门店为 shop/<SHOP_ID>/delivery_robot/...
+const DefaultShop = 1
+
+func envPositive(k string, d int) int {
+    v, err := strconv.Atoi(os.Getenv(k))
+    if err != nil || v < 1 {
+        return d
+    }
+    return v
+}
+
+// ShopID 返回环境变量 SHOP_ID 指定的门店
+func ShopID() int { return envPositive("SHOP_ID", DefaultShop) }
+
+// ShopPort 环境变量 key 显式设置时使用其值，否则为本店偏移后的默认端口
+func ShopPort(key string, base int) int {
+    if v, err := strconv.Atoi(os.Getenv(key)); err == nil {
+        return v
+    }
+    return base + (ShopID()-DefaultShop)*envPositive("SHOP_PORT_STRIDE", 1000)
+}
+
+// TopicPrefix 返回门店的 MQTT 话题前缀
+func TopicPrefix(shop int) string {
+    if shop == DefaultShop {
+        return "test"
+    }
+    return fmt.Sprintf("shop/%d", shop)
+}
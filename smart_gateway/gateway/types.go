@@ -9,10 +9,12 @@ type Config struct {
     GrinderHost string
     GrinderPort int
     IceHost string
+    IcePort int // 0 表示 S7 默认端口 102
     IceRack int
     IceSlot int
     MqttHost string
     MqttPort int
+    TopicPrefix string // 机器人话题前缀，空时为门店 1 的 "test"，见 TopicPrefix
 }
 
 // UnifiedCommand 为上层统一指令的载体，由HTTP端点接收
@@ -0,0 +1,68 @@
+'''
+咖啡机 PLAN 容量规划的单元测试
+'''
+import pytest
+
+from coffeemachine import coffeemachine_sim as sim
+
+
+@pytest.fixture
+def stock(monkeypatch):
+    """把库存设为给定值（未给出的原料为 0），测试结束后恢复"""
+    def set_stock(**amounts):
+        for ingredient in sim.INGREDIENTS:
+            monkeypatch.setitem(sim.inventory, ingredient, amounts.get(ingredient, 0))
+    return set_stock
+
+
+def servings(max_servings):
+    return dict(zip(sim.VALID_COFFEES, max_servings.tolist()))
+
+
+def shortage_of(shortage):
+    return {i: n for i, n in zip(sim.INGREDIENTS, shortage.tolist()) if n > 0}
+
+
+class TestPlanCapacity:
+    def test_max_servings(self, stock):
+        """每种咖啡的上限取各原料的最小值，不消耗原料的咖啡不限"""
+        stock(MILK=7, CHOCOLATE_SAUCE=1, CARAMEL_SYRUP=5)
+        result = servings(sim.plan_capacity()[0])
+        assert result["LATTE"] == 2
+        assert result["MOCHA"] == 1          # 受巧克力酱限制
+        assert result["MACCHIATO"] == 3      # 受牛奶限制
+        assert result["OAT LATTE"] == 0
+        assert result["ESPRESSO"] == -1
+
+    def test_query_without_mix_has_no_shortage(self, stock):
+        stock()
+        assert not sim.plan_capacity()[1].any()
+
+    def test_feasible_mix(self, stock):
+        stock(MILK=8, CHOCOLATE_SAUCE=1)
+        assert not sim.plan_capacity({"LATTE": 2, "MOCHA": 1, "ESPRESSO": 5})[1].any()
+
+    def test_infeasible_mix_reports_each_shortage(self, stock):
+        """组合中多种咖啡共用的原料按总用量计算缺口"""
+        stock(MILK=8, CHOCOLATE_SAUCE=1)
+        _, shortage = sim.plan_capacity({"LATTE": 2, "MOCHA": 2, "MATCHA LATTE": 1})
+        assert shortage_of(shortage) == {"MILK": 4, "CHOCOLATE_SAUCE": 1, "MATCHA_SAUCE": 1}
+
+    def test_plan_does_not_consume(self, stock):
+        stock(MILK=8)
+        sim.plan_capacity({"LATTE": 10})
+        assert sim.inventory["MILK"] == 8
+
+
+class TestParsePlanMix:
+    def test_parse(self):
+        assert sim.parse_plan_mix("LATTE=2, MOCHA=1,LATTE=3") == {"LATTE": 5, "MOCHA": 1}
+
+    @pytest.mark.parametrize("payload", ["LATTE", "LATTE=", "LATTE=-1", "LATTE=x", ""])
+    def test_invalid(self, payload):
+        with pytest.raises(ValueError):
+            sim.parse_plan_mix(payload)
+
+    def test_unknown_coffee(self):
+        with pytest.raises(KeyError):
+            sim.parse_plan_mix("TEA=1")
@@ -0,0 +1,49 @@
+'''
+按请求日志闸门（RequestLogGate）的单元测试
+'''
+import logging
+
+import pytest
+
+from common.logs import RequestLogGate
+
+
+@pytest.fixture
+def logger():
+    log = logging.getLogger("test_request_gate")
+    log.setLevel(logging.DEBUG)
+    return log
+
+
+def passed(gate, n):
+    return sum(gate() for _ in range(n))
+
+
+def test_sampling(logger):
+    gate = RequestLogGate(logger, sample=4, rate=0)
+    assert passed(gate, 20) == 5
+    assert gate.dropped == 15
+
+
+def test_disabled_level(logger):
+    logger.setLevel(logging.INFO)
+    assert passed(RequestLogGate(logger, sample=1, rate=0), 10) == 0
+
+
+def test_rate_limit(logger):
+    gate = RequestLogGate(logger, sample=1, rate=5)
+    assert passed(gate, 20) == 5        # 初始令牌为一秒的配额
+    gate._last -= 1.0                   # 过去 1 秒，补充 5 个令牌
+    assert passed(gate, 20) == 5
+
+
+def test_rate_below_one_per_second(logger):
+    """每秒不足 1 条时，每 1/rate 秒放行一条"""
+    gate = RequestLogGate(logger, sample=1, rate=0.5)
+    assert passed(gate, 10) == 1
+    gate._last -= 1.0
+    assert passed(gate, 10) == 0
+    gate._last -= 1.0
+    assert passed(gate, 10) == 1
+    gate._last -= 100.0                 # 长时间空闲也只攒 1 个令牌
+    assert passed(gate, 10) == 1
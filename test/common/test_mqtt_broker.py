@@ -0,0 +1,116 @@
+'''
+进程内 MQTT Broker 的单元测试（paho 客户端，3.1.1 与 5.0）
+'''
+import queue
+
+import paho.mqtt.client as mqtt
+import pytest
+
+TIMEOUT = 2
+
+
+class Client:
+    """paho 客户端的简单封装：连接成功后返回，收到的消息放入队列"""
+    def __init__(self, broker, client_id, protocol=mqtt.MQTTv311):
+        self.messages = queue.Queue()
+        self.connected = queue.Queue()
+        self.subscribed = queue.Queue()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=protocol)
+        self.client.on_connect = lambda c, u, flags, rc, props: self.connected.put(rc)
+        self.client.on_subscribe = lambda c, u, mid, codes, props: self.subscribed.put(codes)
+        self.client.on_message = lambda c, u, msg: self.messages.put(msg)
+        self.client.connect(broker.host, broker.port, 60)
+        self.client.loop_start()
+        self.rc = self.connected.get(timeout=TIMEOUT)
+
+    def subscribe(self, topic, qos=0):
+        self.client.subscribe(topic, qos)
+        return self.subscribed.get(timeout=TIMEOUT)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        info.wait_for_publish(TIMEOUT)
+        return info
+
+    def receive(self):
+        return self.messages.get(timeout=TIMEOUT)
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+@pytest.fixture
+def clients(mqtt_broker):
+    """按需创建客户端，用例结束后全部断开"""
+    created = []
+
+    def connect(client_id, protocol=mqtt.MQTTv311):
+        client = Client(mqtt_broker, client_id, protocol)
+        created.append(client)
+        return client
+    yield connect
+    for client in created:
+        client.close()
+
+
+@pytest.mark.parametrize("protocol", [mqtt.MQTTv311, mqtt.MQTTv5])
+def test_connect(clients, protocol):
+    client = clients(f"connect-{protocol}", protocol)
+    assert client.rc == 0
+    assert client.client.is_connected()
+
+
+@pytest.mark.parametrize("protocol", [mqtt.MQTTv311, mqtt.MQTTv5])
+@pytest.mark.parametrize("qos", [0, 1])
+def test_publish_subscribe(clients, protocol, qos):
+    """订阅者按 min(发布 QoS, 订阅 QoS) 收到消息；QoS 1 的发布收到 PUBACK"""
+    topic = f"qos/{protocol}/{qos}"
+    sub = clients(f"sub-{protocol}-{qos}", protocol)
+    assert [getattr(code, "value", code) for code in sub.subscribe(topic, 1)] == [1]
+    pub = clients(f"pub-{protocol}-{qos}", protocol)
+    info = pub.publish(topic, b"hello", qos=qos)
+    assert info.is_published()
+    msg = sub.receive()
+    assert (msg.topic, msg.payload, msg.qos) == (topic, b"hello", qos)
+
+
+def test_retained_delivered_to_late_subscriber(clients):
+    pub = clients("retain-pub")
+    pub.publish("retain/status", b"READY", qos=1, retain=True)
+    sub = clients("retain-sub")
+    sub.subscribe("retain/#", 1)
+    msg = sub.receive()
+    assert (msg.topic, msg.payload, msg.retain) == ("retain/status", b"READY", True)
+
+    # 空负载的保留消息清除保留状态
+    pub.publish("retain/status", b"", qos=1, retain=True)
+    sub.receive()
+    late = clients("retain-late")
+    late.subscribe("retain/#", 1)
+    with pytest.raises(queue.Empty):
+        late.messages.get(timeout=0.2)
+
+
+def test_shared_subscription_round_robin(clients):
+    """同一共享组的订阅者轮流接收，普通订阅者收到全部消息"""
+    members = [clients(f"share-{i}") for i in range(2)]
+    for member in members:
+        member.subscribe("$share/workers/jobs/+", 1)
+    watcher = clients("share-watcher")
+    watcher.subscribe("jobs/#", 1)
+    pub = clients("share-pub")
+    for i in range(6):
+        pub.publish(f"jobs/{i}", str(i).encode(), qos=1)
+
+    assert sorted(watcher.receive().payload for _ in range(6)) == [str(i).encode() for i in range(6)]
+    counts = []
+    for member in members:
+        received = []
+        while True:
+            try:
+                received.append(member.messages.get(timeout=0.2))
+            except queue.Empty:
+                break
+        counts.append(len(received))
+    assert counts == [3, 3]
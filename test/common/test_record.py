@@ -0,0 +1,89 @@
+'''
+录制文件格式与各协议负载编解码的单元测试
+'''
+import pytest
+
+from common import record
+
+
+class TestPayloadCodec:
+    def test_registers_round_trip(self):
+        """Modbus 写寄存器负载编解码"""
+        assert record.decode_registers(record.encode_registers(11, [3, 0, 65535])) == (11, [3, 0, 65535])
+
+    def test_db_write_round_trip(self):
+        """S7 DB 写入负载编解码"""
+        assert record.decode_db_write(record.encode_db_write(1, 12, b"\x00\x01\xff")) == (1, 12, b"\x00\x01\xff")
+
+    def test_mqtt_round_trip(self):
+        """MQTT 负载编解码，话题可含非 ASCII 字符，消息体可为空"""
+        for topic, message in (("test/delivery_robot/command", b'{"order_id": 1}'), ("门店/2", b"")):
+            assert record.decode_mqtt(record.encode_mqtt(topic, message)) == (topic, message)
+
+
+class TestRecordFile:
+    def test_write_and_read(self, tmp_path):
+        """写入的记录按顺序读回，头部字段保持不变"""
+        path = str(tmp_path / "traffic.bin")
+        recorder = record.Recorder(path)
+        recorder.write(record.DEVICE_GRINDER, record.OP_WRITE_REGISTERS, 40000, record.encode_registers(10, [1]))
+        recorder.write(record.DEVICE_COFFEE, record.OP_TCP_DATA, 2 ** 32 + 5, b"MAKE:LATTE\n")
+        recorder.close()
+
+        records = list(record.read_records(path))
+        assert recorder.count == 2
+        assert [(r.device, r.op, r.session, r.payload) for r in records] == [
+            (record.DEVICE_GRINDER, record.OP_WRITE_REGISTERS, 40000, record.encode_registers(10, [1])),
+            (record.DEVICE_COFFEE, record.OP_TCP_DATA, 5, b"MAKE:LATTE\n"),     # 会话号截断为 uint32
+        ]
+        assert records[0].ts <= records[1].ts
+
+    def test_truncated_tail_is_ignored(self, tmp_path):
+        """进程在写入中途被结束时，末尾不完整的记录被忽略"""
+        path = str(tmp_path / "traffic.bin")
+        recorder = record.Recorder(path)
+        recorder.write(record.DEVICE_ICE, record.OP_DB_WRITE, 1, record.encode_db_write(1, 0, b"\x00\x02"))
+        recorder.write(record.DEVICE_ICE, record.OP_DB_WRITE, 1, record.encode_db_write(1, 0, b"\x00\x03"))
+        recorder.close()
+        with open(path, "r+b") as f:
+            f.truncate(f.seek(0, 2) - 1)
+
+        records = list(record.read_records(path))
+        assert len(records) == 1
+        assert record.decode_db_write(records[0].payload) == (1, 0, b"\x00\x02")
+
+    def test_large_payload_round_trip(self, tmp_path):
+        """负载长度为 uint32，超过 65535 字节的批量消息可以录制与读回"""
+        path = str(tmp_path / "traffic.bin")
+        payload = record.encode_mqtt("test/delivery_robot/command", b"x" * 120_000)
+        recorder = record.Recorder(path)
+        assert recorder.write(record.DEVICE_ROBOT, record.OP_MQTT_MESSAGE, 0, payload)
+        recorder.close()
+
+        (rec,) = record.read_records(path)
+        assert record.decode_mqtt(rec.payload) == ("test/delivery_robot/command", b"x" * 120_000)
+
+    def test_append_keeps_single_file_header(self, tmp_path):
+        """再次打开已有文件时直接追加，不重复写文件头"""
+        path = str(tmp_path / "traffic.bin")
+        for data in (b"MAKE:LATTE\n", b"MAKE:MOCHA\n"):
+            recorder = record.Recorder(path)
+            recorder.write(record.DEVICE_COFFEE, record.OP_TCP_DATA, 1, data)
+            recorder.close()
+        assert [r.payload for r in record.read_records(path)] == [b"MAKE:LATTE\n", b"MAKE:MOCHA\n"]
+
+    def test_old_format_is_rejected(self, tmp_path):
+        """没有文件头的旧版本文件既不能读取，也不能继续追加"""
+        path = tmp_path / "traffic.bin"
+        path.write_bytes(b"\x00" * 40)
+        with pytest.raises(ValueError):
+            list(record.read_records(str(path)))
+        with pytest.raises(ValueError):
+            record.Recorder(str(path))
+
+    def test_write_failure_is_not_raised(self, tmp_path):
+        """录制失败只计数并记录日志，不向模拟器抛出异常"""
+        recorder = record.Recorder(str(tmp_path / "traffic.bin"))
+        recorder.close()
+        assert not recorder.write(record.DEVICE_COFFEE, record.OP_TCP_DATA, 1, b"MAKE:LATTE\n")
+        assert recorder.errors == 1
@@ -0,0 +1,75 @@
+'''
+送餐机器人 MQTT 消息编码的单元测试
+'''
+import pytest
+
+from common import robot_codec
+
+BASE = "test/delivery_robot/command"
+ORDERS = [
+    {"order_id": 1024, "table_number": 8, "need_ice": True, "coffee_type": "LATTE"},
+    {"order_id": 1025, "table_number": 3, "need_ice": False, "coffee_type": "MATCHA LATTE"},
+]
+
+STATUSES = [
+    {"order_id": 1024, "status": "RECEIVED", "table_number": 8},
+    {"order_id": 1025, "status": "DELIVERY_FAILED", "table_number": 3},
+]
+
+
+def require(encoding):
+    """msgpack 为可选依赖，未安装时跳过对应用例"""
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+
+
+class TestTopics:
+    @pytest.mark.parametrize("encoding", robot_codec.ENCODINGS)
+    def test_topic_round_trip(self, encoding):
+        assert robot_codec.topic_encoding(robot_codec.encoding_topic(BASE, encoding), BASE) == encoding
+
+    @pytest.mark.parametrize("topic", [BASE + "/xml", BASE + "x", "other/topic"])
+    def test_unknown_topic(self, topic):
+        with pytest.raises(ValueError):
+            robot_codec.topic_encoding(topic, BASE)
+
+
+class TestCodec:
+    @pytest.mark.parametrize("encoding", robot_codec.ENCODINGS)
+    @pytest.mark.parametrize("count", [1, 2])
+    def test_commands_round_trip(self, encoding, count):
+        require(encoding)
+        payload = robot_codec.encode_commands(encoding, ORDERS[:count])
+        assert robot_codec.decode_commands(encoding, payload) == ORDERS[:count]
+
+    @pytest.mark.parametrize("encoding", robot_codec.ENCODINGS)
+    @pytest.mark.parametrize("count", [1, 2])
+    def test_statuses_round_trip(self, encoding, count):
+        require(encoding)
+        payload = robot_codec.encode_statuses(encoding, STATUSES[:count])
+        assert robot_codec.decode_statuses(encoding, payload) == STATUSES[:count]
+
+    def test_single_json_command_is_object(self):
+        """单条 JSON 指令保持原有的对象格式"""
+        assert robot_codec.encode_commands("json", ORDERS[:1]).startswith("{")
+
+    def test_struct_truncates_coffee_type(self):
+        order = dict(ORDERS[0], coffee_type="X" * 20)
+        payload = robot_codec.encode_commands("struct", [order])
+        assert len(payload) == robot_codec.COMMAND_STRUCT.size
+        assert robot_codec.decode_commands("struct", payload)[0]["coffee_type"] == "X" * robot_codec.COFFEE_TYPE_SIZE
+
+    def test_struct_length_mismatch(self):
+        payload = robot_codec.encode_commands("struct", ORDERS)
+        with pytest.raises(ValueError):
+            robot_codec.decode_commands("struct", payload[:-1])
+
+    @pytest.mark.parametrize("encoding, payload", [
+        ("json", "[1, 2]"),
+        ("json", "not json"),
+        ("msgpack", b"\xc1"),
+    ])
+    def test_invalid_payload(self, encoding, payload):
+        require(encoding)
+        with pytest.raises(ValueError):
+            robot_codec.decode_commands(encoding, payload)
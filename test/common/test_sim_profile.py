@@ -0,0 +1,102 @@
+'''
+时延、抖动与故障注入配置的单元测试
+'''
+import math
+import random
+
+import pytest
+
+from common.sim_profile import DeviceProfile, Distribution
+
+SPEC = {
+    "service_time": {"grind": {"dist": "lognormal", "median": 5, "sigma": 0.4},
+                     "make": {"dist": "uniform", "low": 1, "high": 2},
+                     "make:LATTE": 7},
+    "connection_delay": {"dist": "exponential", "mean": 0.01},
+    "drop_rate": 0.3,
+    "fault_rate": 0.3,
+    "fault_duration": {"dist": "uniform", "low": 1, "high": 3},
+}
+
+
+def timeline(profile, n=50):
+    """按固定的调用序列采样，返回全部结果"""
+    return [(profile.service_time("grind", 1), profile.connection_delay(), profile.drop(), profile.fault())
+            for _ in range(n)]
+
+
+class TestDistribution:
+    @pytest.mark.parametrize("spec, expected", [
+        (3, 3),
+        ({"dist": "fixed", "value": 2.5}, 2.5),
+        ({"dist": "uniform", "low": 1, "high": 3}, 2),
+        ({"dist": "randint", "low": 3, "high": 8}, 5.5),
+        ({"dist": "exponential", "mean": 4}, 4),
+        ({"dist": "lognormal", "median": 5, "sigma": 0.4}, 5 * math.exp(0.08)),
+        ({"dist": "pareto", "scale": 1, "alpha": 3}, 1.5),
+        ({"dist": "pareto", "scale": 1, "alpha": 1}, math.inf),
+        ({"dist": "pareto", "scale": 1, "alpha": 1, "max": 20}, 20),
+    ])
+    def test_mean(self, spec, expected):
+        assert Distribution(spec).mean() == pytest.approx(expected)
+
+    def test_cap_truncates_samples(self):
+        """max 截断重尾分布的采样值"""
+        dist = Distribution({"dist": "pareto", "scale": 1, "alpha": 0.5, "max": 10})
+        rng = random.Random(0)
+        samples = [dist.sample(rng) for _ in range(1000)]
+        assert max(samples) == 10
+        assert min(samples) >= 1
+
+    def test_randint_samples_integers(self):
+        dist = Distribution({"dist": "randint", "low": 3, "high": 8})
+        rng = random.Random(0)
+        assert {dist.sample(rng) for _ in range(200)} == set(range(3, 9))
+
+    def test_unknown_kind(self):
+        with pytest.raises(ValueError):
+            Distribution({"dist": "weibull"})
+
+
+class TestDeviceProfile:
+    def test_seeded_profile_is_deterministic(self):
+        """相同种子与相同调用序列产生相同的时间线"""
+        assert timeline(DeviceProfile("grinder", SPEC, seed=42)) == timeline(DeviceProfile("grinder", SPEC, seed=42))
+
+    def test_seed_and_device_change_timeline(self):
+        base = timeline(DeviceProfile("grinder", SPEC, seed=42))
+        assert timeline(DeviceProfile("grinder", SPEC, seed=43)) != base
+        assert timeline(DeviceProfile("coffee", SPEC, seed=42)) != base
+
+    def test_streams_are_independent(self):
+        """开启故障判定、增加其他操作不影响同一种操作的取值"""
+        plain = DeviceProfile("grinder", SPEC, seed=7)
+        busy = DeviceProfile("grinder", SPEC, seed=7)
+        expected = [plain.service_time("grind", 1) for _ in range(20)]
+        actual = []
+        for _ in range(20):
+            busy.fault()
+            busy.drop()
+            busy.service_time("make:MOCHA", 1)
+            actual.append(busy.service_time("grind", 1))
+        assert actual == expected
+
+    def test_service_time_lookup(self):
+        """子类优先，其次操作族，都未配置时使用默认模型"""
+        profile = DeviceProfile("coffee", SPEC, seed=1)
+        assert profile.service_time("make:LATTE", 99) == 7
+        assert 1 <= profile.service_time("make:MOCHA", 99) <= 2
+        assert profile.service_time("refill", 99) == 99
+        assert profile.mean_service_time("make:MOCHA", 99) == pytest.approx(1.5)
+
+    def test_default_profile_injects_nothing(self):
+        profile = DeviceProfile("ice")
+        assert profile.connection_delay() == 0
+        assert not any(profile.drop() for _ in range(100))
+        assert not any(profile.fault() for _ in range(100))
+        assert profile.service_time("make_ice", {"dist": "randint", "low": 2, "high": 2}) == 2
+
+    def test_fault_duration_follows_distribution(self):
+        profile = DeviceProfile("grinder", dict(SPEC, fault_rate=1), seed=3)
+        durations = [profile.fault() for _ in range(50)]
+        assert all(1 <= d <= 3 for d in durations)
@@ -0,0 +1,83 @@
+'''
+内存映射设备状态的单元测试
+'''
+from common.state import FILE_HEADER, SLOT_HEADER, DeviceState
+
+DEFAULTS = {"bean_level": 100, "status": 0}
+
+
+def open_state(tmp_path, defaults=DEFAULTS):
+    return DeviceState("grinder", defaults, str(tmp_path / "grinder.state"))
+
+
+class TestDeviceState:
+    def test_defaults_without_file(self):
+        state = DeviceState("grinder", DEFAULTS)
+        assert not state.restored
+        assert state.as_dict() == DEFAULTS
+        state.close()
+
+    def test_restore_after_reopen(self, tmp_path):
+        state = open_state(tmp_path)
+        assert not state.restored
+        state.update(bean_level=40)
+        state.update({"bean_level": 35, "status": 2})
+        state.close()
+
+        state = open_state(tmp_path)
+        assert state.restored
+        assert state.as_dict() == {"bean_level": 35, "status": 2}
+        assert state["status"] == 2
+        state.close()
+
+    def test_unchanged_update_does_not_commit(self, tmp_path):
+        state = open_state(tmp_path)
+        seq = state.seq
+        state.update(bean_level=100)
+        assert state.seq == seq
+        state.close()
+
+    def test_corrupt_slot_falls_back_to_other_slot(self, tmp_path):
+        """最新的槽写到一半（校验不通过）时，从另一个槽恢复上一次提交的状态"""
+        state = open_state(tmp_path)
+        state.update(bean_level=60)
+        state.update(bean_level=50)
+        offset = FILE_HEADER.size + state.slot * state.slot_size + SLOT_HEADER.size
+        state.close()
+        with open(tmp_path / "grinder.state", "r+b") as f:
+            f.seek(offset)
+            f.write(b"\xff")
+
+        state = open_state(tmp_path)
+        assert state.restored
+        assert state["bean_level"] == 60
+        # 之后的提交写入损坏的槽，重新打开后读到最新值
+        state.update(bean_level=45)
+        state.close()
+        state = open_state(tmp_path)
+        assert state["bean_level"] == 45
+        state.close()
+
+    def test_torn_header_falls_back_to_other_slot(self, tmp_path):
+        """字段值已写入但序号与校验未写入时，该槽不被采用"""
+        state = open_state(tmp_path)
+        state.update(bean_level=60)
+        slot = 1 - state.slot
+        offset = FILE_HEADER.size + slot * state.slot_size
+        state.values_struct.pack_into(state.mm, offset + SLOT_HEADER.size, 10, 1)
+        state.close()
+
+        state = open_state(tmp_path)
+        assert state.as_dict() == {"bean_level": 60, "status": 0}
+        state.close()
+
+    def test_layout_change_resets_to_defaults(self, tmp_path):
+        state = open_state(tmp_path)
+        state.update(bean_level=10)
+        state.close()
+
+        defaults = dict(DEFAULTS, dose_count=0)
+        state = open_state(tmp_path, defaults)
+        assert not state.restored
+        assert state.as_dict() == defaults
+        state.close()
@@ -0,0 +1,17 @@
+'''
+共用统计函数的单元测试
+'''
+from common.stats import percentile
+
+
+def test_percentile_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+    assert percentile(values, 50) == 3
+    assert percentile(values, 0) == 1
+    assert percentile(values, 99) == 5
+    assert percentile(values, 100) == 5
+    assert values == [5, 1, 4, 2, 3]    # 不修改输入
+
+
+def test_percentile_empty():
+    assert percentile([], 50) is None
@@ -0,0 +1,21 @@
+'''
+pytest 公共配置
+- 模拟器按 script/ 为根导入共享模块（from common.xxx import ...），测试同样以 script/ 为根导入
+- mqtt_broker：进程内 MQTT Broker（随机端口），机器人与 Broker 的测试不依赖外部 Mosquitto
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script"))
+
+
+@pytest.fixture(scope="module")
+def mqtt_broker():
+    """同一测试文件共用一个 Broker，各用例使用不同的话题"""
+    from common.mqtt_broker import MQTTBroker
+    broker = MQTTBroker(port=0)
+    broker.start()
+    yield broker
+    broker.stop()
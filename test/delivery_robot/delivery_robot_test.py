@@ -2,17 +2,74 @@
 Author: Orange horrorange@qq.com
 Last-modified: 2025-09-18
 Used to test the delivery robots, using MQTT messages
+- pytest：在进程内 Broker（见 test/conftest.py 的 mqtt_broker）上启动机器人模拟器并检查接收确认，不需要外部 Mosquitto
+- 直接运行：向 localhost:1883 上的 Broker 发送一条指令
 '''
 import paho.mqtt.client as mqtt
 import json
+import queue
 import random
+import threading
 import time
 
+import pytest
+
 # ----------------- MQTT 配置
 MQTT_BROKER_HOST = "localhost"
 MQTT_BROKER_PORT = 1883
 COMMAND_TOPIC = "test/delivery_robot/command"
 
+# ----------------- pytest
+@pytest.fixture(scope="module")
+def robot(mqtt_broker):
+    """在进程内 Broker 上运行机器人模拟器，返回订阅了状态话题的客户端与收到的状态队列"""
+    from delivery_robots import deliveryrobots_sim as sim
+    threading.Thread(target=sim.run, kwargs={"host": mqtt_broker.host, "port": mqtt_broker.port}, daemon=True).start()
+    assert mqtt_broker.wait_subscribed(sim.COMMAND_TOPIC, timeout=5)
+
+    statuses = queue.Queue()
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="delivery_robot_test")
+    client.on_message = lambda c, u, msg: statuses.put(msg)
+    client.connect(mqtt_broker.host, mqtt_broker.port, 60)
+    client.loop_start()
+    client.subscribe([(sim.STATUS_TOPIC, 1), (sim.STATUS_TOPIC + "/+", 1)])
+    assert mqtt_broker.wait_subscribed(sim.STATUS_TOPIC, timeout=5)
+    yield sim, client, statuses
+    client.disconnect()
+    client.loop_stop()
+
+
+def send(robot, encoding, orders):
+    """发送一批指令，返回该批的确认（状态列表）"""
+    sim, client, statuses = robot
+    topic = sim.robot_codec.encoding_topic(sim.COMMAND_TOPIC, encoding)
+    client.publish(topic, sim.robot_codec.encode_commands(encoding, orders), qos=1).wait_for_publish(2)
+    msg = statuses.get(timeout=2)
+    assert msg.topic == sim.robot_codec.encoding_topic(sim.STATUS_TOPIC, encoding)
+    return sim.robot_codec.decode_statuses(encoding, msg.payload)
+
+
+def test_command_is_acknowledged(robot):
+    order = {"order_id": 501, "coffee_type": "Americano", "table_number": 4, "need_ice": False}
+    (ack,) = send(robot, "json", [order])
+    assert (ack["order_id"], ack["status"], ack["table_number"]) == (501, "RECEIVED", 4)
+    assert ack["queue_depth"] >= 0 and ack["expected_start"] > 0
+
+
+def test_duplicate_is_suppressed(robot):
+    order = {"order_id": 502, "coffee_type": "LATTE", "table_number": 2, "need_ice": True}
+    send(robot, "json", [order])
+    (dup,) = send(robot, "json", [order])
+    assert dup["duplicate"] is True and dup["status"] == "RECEIVED"
+    assert dup["suppressed"] >= 1
+
+
+def test_struct_batch(robot):
+    orders = [{"order_id": 503 + i, "coffee_type": "MOCHA", "table_number": i + 1, "need_ice": False} for i in range(3)]
+    acks = send(robot, "struct", orders)
+    assert [(a["order_id"], a["status"]) for a in acks] == [(503 + i, "RECEIVED") for i in range(3)]
+
+
 def main():
     # 初始化MQTT客户端
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="delivery_robot_test")
@@ -0,0 +1,212 @@
+'''
+送餐机器人 MQTT 压测
+- 保持一个连接，按目标速率发布 QoS 1 配送指令
+- 订阅状态话题，按 order_id 关联 RECEIVED 与 DELIVERY_COMPLETE/DELIVERY_FAILED
+- 输出确认时延与完成时延的 P50/P99，以及丢失与重复的消息数
+- --encoding msgpack/struct 使用紧凑编码话题，--batch N 每条消息携带 N 个订单
+用法：
+    python load_test.py --count 2000 --rate 200
+    python load_test.py --count 2000 --rate 2000 --encoding struct --batch 20
+    python load_test.py --embedded        # 在本进程内启动 MQTT Broker 与机器人模拟器，无需外部服务
+    python load_test.py --wait health:localhost:9100/robot   # 先等待机器人模拟器就绪（见 script/common/ready.py）
+    SIM_PROFILE=fast.json python script/delivery_robots/deliveryrobots_sim.py   # 配送时间设为 0 时可测得纯消息链路时延
+'''
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+# 消息编码与模拟器共用 script/common/robot_codec.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "script"))
+from common import robot_codec
+from common.mqtt_broker import MQTTBroker
+from common.ready import wait_ready
+from common.shop import topic_prefix
+from common.stats import percentile
+
+# ----------------- MQTT 配置
+MQTT_BROKER_HOST = "localhost"
+MQTT_BROKER_PORT = 1883
+COMMAND_TOPIC = f"{topic_prefix()}/delivery_robot/command"   # 按 SHOP_ID 压测对应门店的机器人
+STATUS_TOPIC = f"{topic_prefix()}/delivery_robot/status"
+
+FINAL_STATUSES = ("DELIVERY_COMPLETE", "DELIVERY_FAILED")
+
+
+class LoadTest:
+    """
+    记录每个订单的发送时间，并在状态话题回调中计算确认/完成时延
+    order_id 从 base 开始连续编号，便于区分其他客户端的消息
+    """
+    def __init__(self, base, count, encoding="json", batch=1):
+        self.base = base
+        self.count = count
+        self.encoding = encoding
+        self.batch = max(1, batch)
+        self.sent = {}              # order_id -> 发送时间
+        self.ack = {}               # order_id -> 确认时延（秒）
+        self.done = {}              # order_id -> 完成时延（秒）
+        self.failed = set()
+        self.duplicates = Counter() # 状态 -> 重复条数
+        self.foreign = 0            # 不属于本次压测的状态消息
+        self.lock = threading.Lock()
+        self.subscribed = threading.Event()
+        self.finished = threading.Event()
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            client.subscribe(robot_codec.encoding_topic(STATUS_TOPIC, self.encoding), qos=1)
+        else:
+            print(f"连接失败, 错误码: {rc}")
+
+    def on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+        self.subscribed.set()
+
+    def on_message(self, client, userdata, msg):
+        now = time.perf_counter()
+        try:
+            statuses = robot_codec.decode_statuses(self.encoding, msg.payload)
+        except ValueError:
+            self.foreign += 1
+            return
+        for data in statuses:
+            self.on_status(data, now)
+
+    def on_status(self, data, now):
+        try:
+            order_id = int(data["order_id"])
+            status = data["status"]
+        except (ValueError, KeyError, TypeError):
+            self.foreign += 1
+            return
+        with self.lock:
+            sent_at = self.sent.get(order_id)
+            if sent_at is None:
+                self.foreign += 1
+                return
+            if status == "RECEIVED":
+                target = self.ack
+            elif status in FINAL_STATUSES:
+                target = self.done
+                if status == "DELIVERY_FAILED":
+                    self.failed.add(order_id)
+            else:
+                self.foreign += 1
+                return
+            if order_id in target:
+                self.duplicates[status] += 1
+                return
+            target[order_id] = now - sent_at
+            if len(self.done) == self.count:
+                self.finished.set()
+
+    def publish_all(self, client, rate, coffee_type):
+        """按目标速率（订单/秒）发布全部指令，批量时每条消息携带 batch 个订单，返回实际发布用时（秒）"""
+        interval = self.batch / rate if rate > 0 else 0
+        topic = robot_codec.encoding_topic(COMMAND_TOPIC, self.encoding)
+        start = time.perf_counter()
+        for n, first in enumerate(range(0, self.count, self.batch)):
+            due = start + n * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            orders = [{
+                "order_id": self.base + i,
+                "coffee_type": coffee_type,
+                "need_ice": False,
+                "table_number": i % 10 + 1,
+            } for i in range(first, min(first + self.batch, self.count))]
+            payload = robot_codec.encode_commands(self.encoding, orders)
+            now = time.perf_counter()
+            with self.lock:
+                for order in orders:
+                    self.sent[order["order_id"]] = now
+            client.publish(topic, payload, qos=1)
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        def fmt(v):
+            return "   n/a" if v is None else f"{v * 1000:8.1f}"
+        ack = list(self.ack.values())
+        done = list(self.done.values())
+        messages = math.ceil(self.count / self.batch)
+        print(f"发布 {self.count} 个订单（{messages} 条 {self.encoding} 消息），用时 {elapsed:.2f} s，"
+              f"实际速率 {self.count / elapsed if elapsed else 0:.0f} 订单/s")
+        print(f"{'':<12}{'收到':>8}{'丢失':>8}{'P50 (ms)':>10}{'P99 (ms)':>10}{'最大 (ms)':>10}")
+        print(f"{'确认':<12}{len(ack):>8}{self.count - len(ack):>8}{fmt(percentile(ack, 50)):>10}"
+              f"{fmt(percentile(ack, 99)):>10}{fmt(max(ack) if ack else None):>10}")
+        print(f"{'完成':<12}{len(done):>8}{self.count - len(done):>8}{fmt(percentile(done, 50)):>10}"
+              f"{fmt(percentile(done, 99)):>10}{fmt(max(done) if done else None):>10}")
+        print(f"配送失败 {len(self.failed)} 条，重复消息 {dict(self.duplicates) or 0}，无关消息 {self.foreign} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="送餐机器人 MQTT 压测")
+    parser.add_argument("--host", default=MQTT_BROKER_HOST)
+    parser.add_argument("--port", type=int, default=MQTT_BROKER_PORT)
+    parser.add_argument("--count", type=int, default=1000, help="发布的指令数")
+    parser.add_argument("--rate", type=float, default=100, help="目标发布速率（订单/秒），0 表示尽可能快")
+    parser.add_argument("--encoding", choices=robot_codec.ENCODINGS, default="json", help="消息编码")
+    parser.add_argument("--batch", type=int, default=1, help="每条消息携带的订单数")
+    parser.add_argument("--timeout", type=float, default=30, help="发布结束后等待完成消息的最长时间（秒）")
+    parser.add_argument("--base", type=int, default=int(time.time()) % 1000000 * 1000,
+                        help="起始 order_id，默认按当前时间生成以避免与其他压测冲突")
+    parser.add_argument("--coffee-type", default="Americano")
+    parser.add_argument("--embedded", action="store_true",
+                        help="在本进程内启动 MQTT Broker（随机端口）与机器人模拟器，忽略 --host/--port")
+    parser.add_argument("--wait", action="append", default=[], metavar="TARGET",
+                        help="开始前并行等待的就绪目标，可重复；Broker 端口总是会等待")
+    parser.add_argument("--wait-timeout", type=float, default=30, help="等待就绪的最长时间（秒）")
+    args = parser.parse_args()
+
+    if args.embedded:
+        from delivery_robots import deliveryrobots_sim
+        broker = MQTTBroker(port=0)
+        args.host, args.port = "127.0.0.1", broker.start()
+        threading.Thread(target=deliveryrobots_sim.run, args=(args.host, args.port), daemon=True).start()
+        if not broker.wait_subscribed(robot_codec.encoding_topic(COMMAND_TOPIC, args.encoding)):
+            print("机器人模拟器未能订阅指令话题")
+            return
+
+    try:
+        wait_ready([f"tcp:{args.host}:{args.port}"] + args.wait, args.wait_timeout)
+    except TimeoutError as e:
+        print(e)
+        return
+
+    test = LoadTest(args.base, args.count, args.encoding, args.batch)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"delivery_robot_load_{args.base}")
+    client.on_connect = test.on_connect
+    client.on_subscribe = test.on_subscribe
+    client.on_message = test.on_message
+    # 允许足够多的在途 QoS 1 消息，避免客户端本身限制发布速率
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(0)
+
+    print("正在连接到MQTT Broker...")
+    try:
+        client.connect(args.host, args.port, 60)
+    except Exception as e:
+        print(f"连接MQTT Broker失败: {e}")
+        return
+    client.loop_start()
+    try:
+        if not test.subscribed.wait(10):
+            print("订阅状态话题超时")
+            return
+        elapsed = test.publish_all(client, args.rate, args.coffee_type)
+        if not test.finished.wait(args.timeout):
+            print(f"等待 {args.timeout:.0f} s 后仍有订单未完成")
+        test.report(elapsed)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
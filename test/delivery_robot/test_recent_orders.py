@@ -0,0 +1,69 @@
+'''
+送餐机器人重复指令抑制（RecentOrders）的单元测试
+'''
+from delivery_robots.deliveryrobots_sim import RecentOrders
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def received(order_id):
+    return {"order_id": order_id, "status": "RECEIVED"}
+
+
+def complete(order_id):
+    return {"order_id": order_id, "status": "DELIVERY_COMPLETE"}
+
+
+class TestRecentOrders:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.orders = RecentOrders(size=2, ttl=10, clock=self.clock)
+
+    def test_claim_new_and_duplicate(self):
+        assert self.orders.claim("1", received(1)) is None
+        assert self.orders.claim("1", received(1)) == received(1)
+        assert self.orders.suppressed == 1
+
+    def test_finish_replaces_status(self):
+        self.orders.claim("1", received(1))
+        self.orders.finish("1", complete(1))
+        assert self.orders.claim("1", received(1)) == complete(1)
+        assert len(self.orders) == 1
+
+    def test_active_orders_never_expire_or_evict(self):
+        """排队或配送中的订单不受有效期与条数上限影响"""
+        for i in range(5):
+            self.orders.claim(str(i), received(i))
+        self.clock.now += 100
+        for i in range(3):
+            self.orders.finish(str(10 + i), complete(10 + i))
+        assert all(self.orders.claim(str(i), received(i)) == received(i) for i in range(5))
+
+    def test_finished_orders_expire(self):
+        self.orders.claim("1", received(1))
+        self.orders.finish("1", complete(1))
+        self.clock.now += 9
+        assert self.orders.claim("1", received(1)) == complete(1)
+        # 命中刷新访问时间，从最后一次访问起计算有效期
+        self.clock.now += 9
+        assert self.orders.claim("1", received(1)) == complete(1)
+        self.clock.now += 10
+        assert self.orders.claim("1", received(1)) is None
+
+    def test_eviction_is_least_recently_used(self):
+        """超过条数上限时淘汰最久未访问的订单，重复指令命中算作访问"""
+        for i in (1, 2):
+            self.orders.claim(str(i), received(i))
+            self.orders.finish(str(i), complete(i))
+            self.clock.now += 1
+        assert self.orders.claim("1", received(1)) == complete(1)     # 1 变为最近访问
+        self.orders.claim("3", received(3))
+        self.orders.finish("3", complete(3))
+        assert self.orders.claim("1", received(1)) == complete(1)
+        assert self.orders.claim("2", received(2)) is None            # 2 被淘汰，视为新订单
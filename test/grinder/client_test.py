@@ -5,10 +5,16 @@ ModBus Client test
 '''
 
 from re import S
+import os
+import sys
 import time
 from pyModbusTCP.client import ModbusClient
 import logging
 
+# 就绪等待工具位于 script/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "script"))
+from common.ready import wait_ready
+
 # 设置logging
 logging.basicConfig(
 	level = logging.DEBUG,
@@ -25,15 +31,26 @@ ERROR_CODE_REG = 3  # error code register
 SERVER_HOST = "localhost"
 SERVER_PORT = 502  # 修正端口号，与模拟器保持一致
 
-# 连接Modbus服务
-client = ModbusClient(host=SERVER_HOST, port=SERVER_PORT, auto_open=False)
-connection_result = client.open()
+client = None
+
+
+def connect():
+    '''
+    等待模拟器端口可连接（最多 30 秒）后连接 Modbus 服务，模拟器刚启动时无需手动重试
+    '''
+    global client
+    try:
+        wait_ready([f"tcp:{SERVER_HOST}:{SERVER_PORT}"], timeout=30)
+    except TimeoutError as e:
+        logging.error(f"模拟器未就绪: {e}")
+        exit(1)
+
+    client = ModbusClient(host=SERVER_HOST, port=SERVER_PORT, auto_open=False)
+    if not client.open():
+        logging.error(f"无法连接到 {SERVER_HOST}:{SERVER_PORT}")
+        exit(1)
+    logging.debug(f"成功连接到 {SERVER_HOST}:{SERVER_PORT}")
 
-if not connection_result:
-    logging.error(f"无法连接到 {SERVER_HOST}:{SERVER_PORT}")
-    exit(1)
-    
-logging.debug(f"成功连接到 {SERVER_HOST}:{SERVER_PORT}")
 
 def read_status():
     '''
@@ -85,7 +102,13 @@ def grind():
     return status, bean_level
 
 
-for i in range(30):
-    grind()
+def main():
+    # 只在直接运行（或 grinder-client 入口）时连接模拟器，pytest 收集本文件时不会阻塞
+    connect()
+    for i in range(30):
+        grind()
+    client.close()
+
 
-client.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+'''
+磨粉机 Modbus 服务端压测：比较 threaded（pyModbusTCP 每连接一个线程）与 asyncio 两种实现
+- 每种实现在独立子进程中启动磨粉机的寄存器服务（与 grinder_sim 相同的 SimDataHandler 与命令信箱，不运行磨粉主循环）
+- 压测端用 asyncio 模拟 N 个并发轮询方，每个轮询方一个连接、一次一个请求：
+  读取状态寄存器 0~5，按 --write-ratio 比例写 DOSE_COUNT_REG
+- 输出每种实现的请求数/秒与响应时间 P50/P99/最大值；连接被拒绝、断开或单个请求超时（--timeout）均计入错误
+用法：
+    python modbus_bench.py --clients 300 --duration 10
+    python modbus_bench.py --transport asyncio --clients 500
+    python modbus_bench.py --host 127.0.0.1 --port 502 --clients 100   # 压测已运行的磨粉机
+'''
+import argparse
+import asyncio
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+# 共享模块与磨粉机模拟器位于 script/
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "script")
+sys.path.insert(0, SCRIPT_DIR)
+from common.ready import wait_ready
+from common.stats import percentile
+
+TRANSPORTS = ("threaded", "asyncio")
+STATUS_REGS = 6         # 每次轮询读取的寄存器数（CMD_REG ~ DOSES_DONE_REG）
+DOSE_COUNT_REG = 4
+
+
+def serve(transport, port):
+    """子进程：只启动磨粉机的寄存器服务"""
+    from grinder import grinder_sim
+    from common.modbus_async import AsyncModbusServer
+    from pyModbusTCP.server import ModbusServer
+    if transport == "asyncio":
+        data_hdl = grinder_sim.SimDataHandler(inject_delay=False)
+        server = AsyncModbusServer("127.0.0.1", port, data_hdl, request_delay=grinder_sim.profile.connection_delay)
+    else:
+        server = ModbusServer("127.0.0.1", port, no_block=True, data_hdl=grinder_sim.SimDataHandler())
+    grinder_sim.mailbox.attach(server.data_bank)
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def exchange(reader, writer, transaction_id, pdu):
+    writer.write(struct.pack(">HHHB", transaction_id, 0, len(pdu) + 1, 1) + pdu)
+    header = await reader.readexactly(7)
+    tid, _, length, _ = struct.unpack(">HHHB", header)
+    body = await reader.readexactly(length - 1)
+    return tid, body
+
+
+async def poller(host, port, deadline, write_ratio, timeout, latencies, errors, rng):
+    """单个轮询方：保持一个连接，逐个发送请求并等待应答"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        errors["connect"] = errors.get("connect", 0) + 1
+        return
+    transaction_id = 0
+    try:
+        while time.perf_counter() < deadline:
+            transaction_id = (transaction_id + 1) & 0xFFFF
+            if rng.random() < write_ratio:
+                pdu = struct.pack(">BHH", 0x06, DOSE_COUNT_REG, 0)
+            else:
+                pdu = struct.pack(">BHH", 0x03, 0, STATUS_REGS)
+            start = time.perf_counter()
+            tid, body = await asyncio.wait_for(exchange(reader, writer, transaction_id, pdu), timeout)
+            latencies.append(time.perf_counter() - start)
+            if tid != transaction_id or body[0] & 0x80:
+                errors["response"] = errors.get("response", 0) + 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        errors["disconnect"] = errors.get("disconnect", 0) + 1
+    except asyncio.TimeoutError:
+        errors["timeout"] = errors.get("timeout", 0) + 1
+    finally:
+        writer.close()
+
+
+async def bench(host, port, clients, duration, write_ratio, timeout, seed):
+    latencies, errors = [], {}
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        poller(host, port, deadline, write_ratio, timeout, latencies, errors, random.Random(seed + i))
+        for i in range(clients)
+    ))
+    return latencies, errors, time.perf_counter() - start
+
+
+def report(name, clients, latencies, errors, elapsed):
+    def fmt(v):
+        return "   n/a" if v is None else f"{v * 1000:8.2f}"
+    print(f"{name:<10}{clients:>8}{len(latencies):>10}{len(latencies) / elapsed:>12.0f}"
+          f"{fmt(percentile(latencies, 50)):>10}{fmt(percentile(latencies, 99)):>10}"
+          f"{fmt(max(latencies) if latencies else None):>10}   {errors or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="磨粉机 Modbus 服务端吞吐与时延压测")
+    parser.add_argument("--transport", choices=TRANSPORTS + ("both",), default="both")
+    parser.add_argument("--clients", type=int, default=200, help="并发轮询方数量")
+    parser.add_argument("--duration", type=float, default=5, help="每种实现的压测时长（秒）")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="写请求比例")
+    parser.add_argument("--timeout", type=float, default=2, help="单个请求的超时时间（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", help="压测已运行的服务端，此时不启动子进程")
+    parser.add_argument("--port", type=int, default=502)
+    parser.add_argument("--serve", choices=TRANSPORTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    print(f"{'实现':<8}{'并发':>8}{'请求数':>8}{'请求/秒':>10}{'P50 (ms)':>10}{'P99 (ms)':>10}{'最大 (ms)':>10}")
+    if args.host:
+        result = asyncio.run(bench(args.host, args.port, args.clients, args.duration, args.write_ratio, args.timeout,
+                                   args.seed))
+        report(f"{args.host}:{args.port}", args.clients, *result)
+        return
+
+    for transport in TRANSPORTS if args.transport == "both" else (args.transport,):
+        port = free_port()
+        env = dict(os.environ, SIM_LOG_LEVEL="WARNING")
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", transport, "--port", str(port)],
+                                env=env)
+        try:
+            wait_ready([f"tcp:127.0.0.1:{port}"], timeout=10)
+            result = asyncio.run(bench("127.0.0.1", port, args.clients, args.duration, args.write_ratio,
+                                       args.timeout, args.seed))
+            report(transport, args.clients, *result)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
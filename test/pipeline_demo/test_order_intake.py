@@ -0,0 +1,41 @@
+'''
+订单接入服务请求校验的单元测试
+'''
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("psycopg")
+# order_intake 与 send_order 位于同一目录，按脚本方式导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "script", "pipeline_demo"))
+from order_intake import MAX_COFFEE_TYPE, parse_order  # noqa: E402
+
+
+class TestParseOrder:
+    def test_valid(self):
+        assert parse_order({"coffee_type": " latte ", "need_ice": True, "table_number": 8}) == ("LATTE", True, 8)
+
+    def test_need_ice_defaults_to_false(self):
+        assert parse_order({"coffee_type": "MOCHA", "table_number": 0}) == ("MOCHA", False, 0)
+
+    @pytest.mark.parametrize("item", [
+        [],
+        "LATTE",
+        {"need_ice": True, "table_number": 8},
+        {"coffee_type": "   ", "table_number": 8},
+        {"coffee_type": "X" * (MAX_COFFEE_TYPE + 1), "table_number": 8},
+        {"coffee_type": 1, "table_number": 8},
+        {"coffee_type": "LATTE", "need_ice": "yes", "table_number": 8},
+        {"coffee_type": "LATTE", "need_ice": 1, "table_number": 8},
+        {"coffee_type": "LATTE"},
+        {"coffee_type": "LATTE", "table_number": -1},
+        {"coffee_type": "LATTE", "table_number": 2 ** 31},
+        {"coffee_type": "LATTE", "table_number": 8.0},
+        {"coffee_type": "LATTE", "table_number": True},
+        {"coffee_type": "LATTE", "table_number": "8"},
+    ])
+    def test_invalid(self, item):
+        with pytest.raises(ValueError):
+            parse_order(item)